@@ -12,7 +12,7 @@ a = Analysis(
     ['main.py'],
     pathex=[],
     binaries=[('cloudflared.exe', '.')],
-    datas=[('server.py', '.'), ('client.py', '.'), ('web_server.py', '.'), ('web_server_trusted.py', '.'), ('cloudflare_helper.py', '.'), ('web_client.html', '.'), ('web_client_trusted.html', '.'), ('icon.ico', '.'), ('icon.png', '.')],
+    datas=[('server.py', '.'), ('client.py', '.'), ('web_server.py', '.'), ('web_server_trusted.py', '.'), ('cloudflare_helper.py', '.'), ('capture_sources.py', '.'), ('capture_engine.py', '.'), ('combined_server.py', '.'), ('frame_delta.py', '.'), ('tier_pyramid.py', '.'), ('process_encoder.py', '.'), ('capture_daemon.py', '.'), ('mjpeg_broadcaster.py', '.'), ('wire_format.py', '.'), ('web_client.html', '.'), ('web_client_trusted.html', '.'), ('delta_viewer.js', '.'), ('icon.ico', '.'), ('icon.png', '.')],
     hiddenimports=hiddenimports,
     hookspath=[],
     hooksconfig={},
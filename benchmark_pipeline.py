@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Capture Pipeline Benchmark
+Times every stage of the shared capture engine (capture -> detect ->
+convert -> cursor -> resize -> encode -> publish) at fixed resolutions using synthetic or
+file-backed capture sources, so results are reproducible on any machine
+(including headless Linux boxes).
+
+Usage:
+    python benchmark_pipeline.py                       # pattern + text at 1080p, 1440p, 4k
+    python benchmark_pipeline.py --source text --resolutions 4k --frames 200
+    python benchmark_pipeline.py --source video:clip.mp4@1080p
+    python benchmark_pipeline.py --buffers compare    # reused vs freshly allocated frame buffers
+    python benchmark_pipeline.py --resize compare     # tier pyramid vs INTER_AREA from full size
+    python benchmark_pipeline.py --encode compare     # tiers encoded serially vs on threads vs in processes
+    python benchmark_pipeline.py --source text --resolutions 4k --encode processes
+"""
+
+import argparse
+import cv2
+import numpy as np
+
+from capture_sources import create_capture_source, RESOLUTIONS
+from capture_engine import CaptureEngine, ENGINE_STAGES
+
+STAGES = list(ENGINE_STAGES)
+
+# --buffers / --resize / --encode compare: (title, engine option, (column name, option value)..., stages shown)
+COMPARISONS = {
+    'buffers': ("Buffer reuse", 'reuse_buffers', (('fresh', False), ('reused', True)),
+                ('capture', 'convert', 'resize')),
+    'resize': ("Tier pyramid", 'tier_pyramid', (('direct', False), ('pyramid', True)), ('resize', 'encode')),
+    'encode': ("Encode backend", 'encode_backend',
+               (('serial', 'serial'), ('threads', 'threads'), ('processes', 'processes')), ('encode',))
+}
+
+
+def run_pipeline(source, frames, tiers=None, **engine_options):
+    """Push frames through the shared engine
+
+    Returns per-stage timings in seconds, encoded bytes, the skip ratio and
+    how many frame buffers the engine allocated.
+    """
+    engine = CaptureEngine(capture_source=source, **engine_options)
+    # One simulated viewer per tier (only subscribed tiers get encoded)
+    for tier in tiers or engine.quality_settings:
+        engine.subscribe(f"bench-{tier}", tier)
+    timings = {stage: [] for stage in STAGES}
+    total_bytes = 0
+
+    source.open()
+    try:
+        for _ in range(frames):
+            encoded = engine.process_frame(source) or {}  # None = unchanged frame
+            total_bytes += sum(len(frame) for frame in encoded.values())
+            for stage in STAGES:
+                timings[stage].append(engine.last_stage_times[stage])
+    finally:
+        source.close()
+        engine.close_encoders()
+
+    return timings, total_bytes, engine.skip_ratio(), engine.buffer_pool.allocations
+
+
+def print_report(label, timings, total_bytes, frames, skip_ratio=0.0, allocations=None):
+    """Print mean/p95 per stage and the sustainable frame rate"""
+    per_frame = np.sum([timings[stage] for stage in STAGES], axis=0)
+    print(f"\n📊 {label}")
+    print("   Stage      mean ms    p95 ms")
+    print("   " + "-" * 30)
+    for stage in STAGES:
+        values = np.array(timings[stage]) * 1000
+        print(f"   {stage.ljust(9)} {values.mean():8.2f} {np.percentile(values, 95):9.2f}")
+    mean_frame = per_frame.mean()
+    print("   " + "-" * 30)
+    print(f"   {'total'.ljust(9)} {mean_frame * 1000:8.2f} {np.percentile(per_frame, 95) * 1000:9.2f}")
+    print(f"   Sustainable FPS: {1.0 / mean_frame:.1f}")
+    print(f"   Encoded output: {total_bytes / frames / 1024:.1f} KB/frame (all encoded tiers)")
+    print(f"   Unchanged frames skipped: {skip_ratio * 100:.0f}%")
+    if allocations is not None:
+        print(f"   Frame buffers allocated: {allocations} ({allocations / frames:.2f} per frame)")
+
+
+def print_comparison(label, comparison, results, frames):
+    """Side by side summary of one engine option (first frame excluded: warm-up, calibration)
+
+    results: [(column name, run_pipeline() result)] in COMPARISONS order
+    """
+    title, _, _, stages = COMPARISONS[comparison]
+
+    def stage_ms(timings, stage):
+        return np.mean(timings[stage][1:]) * 1000
+
+    def total_ms(timings):
+        return np.sum([timings[stage][1:] for stage in STAGES], axis=0).mean() * 1000
+
+    def row(name, values, fmt):
+        print(f"   {name.ljust(9)} " + " ".join(format(value, fmt) for value in values))
+
+    timings = [result[0] for _, result in results]
+    rule = "   " + "-" * (10 + 13 * len(results))
+    print(f"\n🔁 {title}: {label}")
+    print("   Stage     " + " ".join(f"{name + ' ms':>12}" for name, _ in results))
+    print(rule)
+    for stage in stages:
+        row(stage, [stage_ms(t, stage) for t in timings], '12.2f')
+    print(rule)
+    row('total', [total_ms(t) for t in timings], '12.2f')
+    row('FPS', [1000.0 / total_ms(t) for t in timings], '12.1f')
+    print("   Encoded output: " + " -> ".join(f"{result[1] / frames / 1024:.1f}" for _, result in results)
+          + " KB/frame")
+    print("   Frame buffers allocated per frame: "
+          + " -> ".join(f"{result[3] / frames:.2f}" for _, result in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the screen share capture pipeline")
+    parser.add_argument('--source', action='append',
+                        help="Capture source spec (pattern, text, office, images:<dir>, video:<file>, screen). "
+                             "Can be given multiple times. Default: pattern and text")
+    parser.add_argument('--resolutions', default='1080p,1440p,4k',
+                        help=f"Comma separated resolutions for synthetic sources ({', '.join(RESOLUTIONS)})")
+    parser.add_argument('--frames', type=int, default=100, help="Frames per run (default: 100)")
+    parser.add_argument('--tiers', default='high,medium,low',
+                        help="Comma separated tiers with viewers (default: all three)")
+    parser.add_argument('--buffers', choices=('reuse', 'fresh', 'compare'), default='reuse',
+                        help="Reuse frame buffers (default), allocate fresh ones every frame, "
+                             "or run both and compare")
+    parser.add_argument('--resize', choices=('pyramid', 'direct', 'compare'), default='pyramid',
+                        help="Derive tiers from each other with measured kernels (default), resize every "
+                             "tier from full size with INTER_AREA, or run both and compare")
+    parser.add_argument('--encode', choices=('threads', 'processes', 'serial', 'compare'), default='threads',
+                        help="Encode tiers concurrently on a thread pool (default), in worker processes, "
+                             "one after another, or run all three and compare")
+    args = parser.parse_args()
+
+    sources = args.source or ['pattern', 'text']
+    resolutions = [r.strip() for r in args.resolutions.split(',') if r.strip()]
+    tiers = [t.strip().lower() for t in args.tiers.split(',') if t.strip()]
+
+    print("🖥️  SCREEN SHARE PIPELINE BENCHMARK")
+    print("=" * 60)
+    print(f"OpenCV {cv2.__version__}, NumPy {np.__version__}, {args.frames} frames per run")
+    print(f"Tiers with viewers: {', '.join(tiers)}")
+
+    for spec in sources:
+        kind = spec.split(':', 1)[0]
+        if kind in ('pattern', 'text', 'office') and ':' not in spec:
+            specs = [f"{kind}:{resolution}" for resolution in resolutions]
+        else:
+            specs = [spec]
+
+        for run_spec in specs:
+            options = {
+                'reuse_buffers': args.buffers != 'fresh',
+                'tier_pyramid': args.resize != 'direct',
+                'encode_backend': 'threads' if args.encode == 'compare' else args.encode
+            }
+            source = create_capture_source(run_spec)
+            result = run_pipeline(source, args.frames, tiers, **options)
+            timings, total_bytes, skip_ratio, allocations = result
+            print_report(source.describe(), timings, total_bytes, args.frames, skip_ratio, allocations)
+
+            # Same frames again with every other value of the option
+            for comparison in COMPARISONS:
+                if getattr(args, comparison) == 'compare':
+                    _, option, variants, _ = COMPARISONS[comparison]
+                    results = []
+                    for name, value in variants:
+                        if value == options[option]:
+                            results.append((name, result))
+                        else:
+                            results.append((name, run_pipeline(create_capture_source(run_spec), args.frames,
+                                                               tiers, **dict(options, **{option: value}))))
+                    print_comparison(source.describe(), comparison, results, args.frames)
+
+
+if __name__ == "__main__":
+    main()
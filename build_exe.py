@@ -32,8 +32,18 @@ def build_exe():
         'web_server.py',
         'web_server_trusted.py',
         'cloudflare_helper.py',
+        'capture_sources.py',
+        'capture_engine.py',
+        'combined_server.py',
+        'frame_delta.py',
+        'tier_pyramid.py',
+        'process_encoder.py',
+        'capture_daemon.py',
+        'mjpeg_broadcaster.py',
+        'wire_format.py',
         'web_client.html',
         'web_client_trusted.html',
+        'delta_viewer.js',
         'cloudflared.exe',
         'icon.ico',
         'icon.png'
@@ -75,8 +85,18 @@ def build_exe():
         '--add-data=web_server.py;.',
         '--add-data=web_server_trusted.py;.',
         '--add-data=cloudflare_helper.py;.',
+        '--add-data=capture_sources.py;.',
+        '--add-data=capture_engine.py;.',
+        '--add-data=combined_server.py;.',
+        '--add-data=frame_delta.py;.',
+        '--add-data=tier_pyramid.py;.',
+        '--add-data=process_encoder.py;.',
+        '--add-data=capture_daemon.py;.',
+        '--add-data=mjpeg_broadcaster.py;.',
+        '--add-data=wire_format.py;.',
         '--add-data=web_client.html;.',
         '--add-data=web_client_trusted.html;.',
+        '--add-data=delta_viewer.js;.',
         
         # Data files
         # '--add-data=path/to/datafile;destination_folder',
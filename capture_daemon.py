@@ -0,0 +1,940 @@
+#!/usr/bin/env python3
+"""
+Capture daemon
+Runs the capture/encode engine in its own process and publishes the encoded
+tiers (with sequence numbers and timestamps), delta tiles and the cursor
+position into a shared memory ring. Any number of front-end processes - the
+TCP server, the web server, the trusted web server - attach to the ring with
+RingEngine, which has the consumer side of CaptureEngine's interface. Front-
+ends can be restarted, run as several processes or crash without disturbing
+capture, and their serving threads never contend with capture for the GIL.
+
+Usage:
+    python capture_daemon.py                          # ring 'screenshare', real screen
+    python capture_daemon.py --source text:4k --name demo
+    SCREENSHARE_CAPTURE_DAEMON=screenshare python server.py
+"""
+
+import argparse
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+from capture_engine import (CaptureEngine, FrameSet, CURSOR_FPS, DEFAULT_QUALITY_SETTINGS, adaptive_fps_for,
+                            mjpeg_part)
+from wire_format import HEADER_SIZE as WIRE_HEADER_SIZE, decode_header, decode_message, encode_message
+
+# Front-ends attach to the daemon named in this environment variable
+CAPTURE_DAEMON_ENV = 'SCREENSHARE_CAPTURE_DAEMON'
+DEFAULT_RING_NAME = 'screenshare'
+
+RING_MAGIC = b'SSRING1\x00'
+RING_VERSION = 4
+
+MAX_TIERS = 8
+MAX_FRONTENDS = 16
+DEFAULT_SLOTS = 16  # Room for a frame plus two tile records per active tier and frame
+DEFAULT_SLOT_SIZE = 4 * 1024 * 1024  # Largest record: a 4K JPEG at quality 95 is ~1-2 MB
+
+# Daemon and front-ends refresh their heartbeat this often; a side that has
+# been silent for FRONTEND_TIMEOUT seconds is considered gone
+HEARTBEAT_INTERVAL = 0.5
+FRONTEND_TIMEOUT = 3.0
+CONTROL_INTERVAL = 0.01  # Daemon control loop: subscriptions, wake requests, cursor
+# The daemon wakes each front-end's poller with a datagram per published
+# frame; a poller whose datagram got lost re-checks the ring after this long
+FRAME_WAKE_TIMEOUT = 0.1
+
+RECORD_FRAME = 0
+RECORD_TILES = 1  # A tiles update in the wire format (nothing in the ring is unpickled)
+RECORD_CATCHUP = 2  # Tiles changed since an older frame, for viewers a few frames behind
+RECORD_KINDS = 3
+
+# Catch-up records cover viewers up to this many frames behind the newest frame
+TILE_CATCHUP_FRAMES = 8
+
+# Ring layout: header | meta (JSON) | stats (JSON) | tier index | front-end table | slots
+HEADER_FORMAT = '<8sIIIIqdQiiiQIQ'  # magic, version, slots, slot size, tiers, pid, heartbeat,
+                                    # frame sequence, cursor x/y/visible, cursor sequence, fps,
+                                    # epoch (new for every ring: sequences restart with it)
+HEADER_SIZE = 256
+META_SIZE = 4096
+STATS_SIZE = 16384
+STATS_HEADER = '<QI'  # generation (odd while written), JSON length
+INDEX_ENTRY = '<qQ'  # slot (-1 = none), sequence; one per tier and record kind
+FRONTEND_HEADER = '<qdQI'  # pid (0 = free row), heartbeat, wake counter, frame signal UDP port
+FRONTEND_COUNTS = f'<{MAX_TIERS * 3}I'  # per tier: viewers, delta viewers, viewers needing the cursor in frames
+SLOT_HEADER = '<QIIQQdI'  # generation, kind, tier, sequence, base sequence (tiles), timestamp, length
+SLOT_HEADER_SIZE = 64
+
+META_OFFSET = HEADER_SIZE
+STATS_OFFSET = META_OFFSET + META_SIZE
+INDEX_OFFSET = STATS_OFFSET + STATS_SIZE
+INDEX_SIZE = MAX_TIERS * RECORD_KINDS * struct.calcsize(INDEX_ENTRY)
+FRONTEND_OFFSET = INDEX_OFFSET + INDEX_SIZE
+FRONTEND_ROW_SIZE = struct.calcsize(FRONTEND_HEADER) + struct.calcsize(FRONTEND_COUNTS)
+SLOTS_OFFSET = FRONTEND_OFFSET + MAX_FRONTENDS * FRONTEND_ROW_SIZE
+
+
+def create_engine(capture_source=None, quality_settings=None):
+    """Engine for a server: attached to a capture daemon if SCREENSHARE_CAPTURE_DAEMON is set"""
+    name = os.environ.get(CAPTURE_DAEMON_ENV, '').strip()
+    if name:
+        return RingEngine(name, quality_settings=quality_settings)
+    return CaptureEngine(capture_source=capture_source, quality_settings=quality_settings)
+
+
+def pack_tiles(update, tier):
+    """Ring record of a tiles update: the wire format message"""
+    return b''.join(encode_message(update, tier=tier))
+
+
+def unpack_tiles(payload):
+    """Tiles update of a ring record (as CaptureEngine.get_tile_update returns it)"""
+    kind, tier, sequence, timestamp, length = decode_header(payload)
+    message = decode_message(kind, tier, sequence, timestamp,
+                             memoryview(payload)[WIRE_HEADER_SIZE:WIRE_HEADER_SIZE + length])
+    return {
+        'type': 'tiles',
+        'sequence': message['sequence'],
+        'size': message['size'],
+        'copies': [tuple(rect) for rect in message['copies']],
+        'tiles': [(x, y, bytes(data)) for x, y, data in message['tiles']]
+    }
+
+
+def _attach_shared_memory(name):
+    """Attach an existing block without letting this process's resource tracker unlink it on exit"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(block._name, 'shared_memory')
+        except Exception:
+            pass
+        return block
+
+
+class FrameRing:
+    """Shared memory ring of encoded records plus the daemon <-> front-end tables
+
+    One writer (the daemon) fills fixed-size slots round robin and points
+    the tier index at the newest frame and tile record of every tier.
+    Readers copy a record out and check its generation before and after
+    (odd = being written), so a slot overwritten mid-read is detected and
+    read again rather than served torn.
+    """
+
+    def __init__(self, block, owner=False):
+        self.block = block
+        self.buf = block.buf
+        self.owner = owner
+        (magic, version, self.slot_count, self.slot_size, self.tier_count,
+         *_) = struct.unpack_from(HEADER_FORMAT, self.buf, 0)
+        if magic != RING_MAGIC or version != RING_VERSION:
+            raise RuntimeError(f"'{block.name}' is not a capture daemon ring (version {RING_VERSION})")
+        self.tiers = json.loads(self._read_json(META_OFFSET, META_SIZE))['tiers']
+        self.write_count = 0
+        self.write_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, name, quality_settings, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE, description=''):
+        """Create the ring (the daemon side)"""
+        tiers = list(quality_settings)[:MAX_TIERS]
+        size = SLOTS_OFFSET + slots * (SLOT_HEADER_SIZE + slot_size)
+        block = shared_memory.SharedMemory(name=name, create=True, size=size)
+        block.buf[:SLOTS_OFFSET] = bytes(SLOTS_OFFSET)
+        struct.pack_into(HEADER_FORMAT, block.buf, 0, RING_MAGIC, RING_VERSION, slots, slot_size,
+                         len(tiers), os.getpid(), time.time(), 0, 0, 0, 0, 0, 0, time.time_ns())
+        meta = {'tiers': tiers, 'quality_settings': {tier: quality_settings[tier] for tier in tiers},
+                'source': description}
+        cls._write_json(block.buf, META_OFFSET, META_SIZE, json.dumps(meta))
+        for index in range(MAX_TIERS * RECORD_KINDS):
+            struct.pack_into(INDEX_ENTRY, block.buf, INDEX_OFFSET + index * struct.calcsize(INDEX_ENTRY), -1, 0)
+        return cls(block, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to a running daemon's ring (the front-end side)"""
+        try:
+            block = _attach_shared_memory(name)
+        except FileNotFoundError:
+            raise RuntimeError(f"Capture daemon '{name}' is not running. Start it with: "
+                               f"python capture_daemon.py --name {name}") from None
+        return cls(block)
+
+    def close(self):
+        """Detach (and remove the ring if this process created it)"""
+        self.buf = None
+        self.block.close()
+        if self.owner:
+            try:
+                self.block.unlink()
+            except FileNotFoundError:
+                pass
+
+    # ------------------------------------------------------------------
+    # Header
+    # ------------------------------------------------------------------
+    def header(self):
+        """(daemon pid, heartbeat, frame sequence, cursor (x, y, visible, sequence), adaptive fps, epoch)"""
+        values = struct.unpack_from(HEADER_FORMAT, self.buf, 0)
+        return values[5], values[6], values[7], tuple(values[8:12]), values[12], values[13]
+
+    def set_status(self, frame_sequence=None, adaptive_fps=None):
+        """Daemon heartbeat, plus the published sequence and frame rate"""
+        offset = struct.calcsize('<8sIIIIq')
+        struct.pack_into('<d', self.buf, offset, time.time())
+        if frame_sequence is not None:
+            struct.pack_into('<Q', self.buf, offset + 8, frame_sequence)
+        if adaptive_fps is not None:
+            struct.pack_into('<I', self.buf, struct.calcsize('<8sIIIIqdQiiiQ'), adaptive_fps)
+
+    def set_cursor(self, x, y, visible, sequence):
+        struct.pack_into('<iiiQ', self.buf, struct.calcsize('<8sIIIIqdQ'), x, y, int(visible), sequence)
+
+    # ------------------------------------------------------------------
+    # JSON areas (meta once, stats about every second)
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _write_json(buf, offset, size, text):
+        data = text.encode('utf-8')
+        header = struct.calcsize(STATS_HEADER)
+        if len(data) > size - header:
+            data = b'{}'
+        generation = struct.unpack_from(STATS_HEADER, buf, offset)[0]
+        struct.pack_into('<Q', buf, offset, generation + 1)
+        buf[offset + header:offset + header + len(data)] = data
+        struct.pack_into(STATS_HEADER, buf, offset, generation + 2, len(data))
+
+    def _read_json(self, offset, size):
+        header = struct.calcsize(STATS_HEADER)
+        for _ in range(10):
+            generation, length = struct.unpack_from(STATS_HEADER, self.buf, offset)
+            data = bytes(self.buf[offset + header:offset + header + min(length, size - header)])
+            if generation % 2 == 0 and struct.unpack_from('<Q', self.buf, offset)[0] == generation:
+                return data.decode('utf-8') or '{}'
+            time.sleep(0.001)
+        return '{}'
+
+    def write_stats(self, stats):
+        self._write_json(self.buf, STATS_OFFSET, STATS_SIZE, json.dumps(stats, default=str))
+
+    def read_stats(self):
+        return json.loads(self._read_json(STATS_OFFSET, STATS_SIZE))
+
+    def read_meta(self):
+        return json.loads(self._read_json(META_OFFSET, META_SIZE))
+
+    # ------------------------------------------------------------------
+    # Records
+    # ------------------------------------------------------------------
+    def _index_offset(self, tier_index, kind):
+        return INDEX_OFFSET + (tier_index * RECORD_KINDS + kind) * struct.calcsize(INDEX_ENTRY)
+
+    def _slot_offset(self, slot):
+        return SLOTS_OFFSET + slot * (SLOT_HEADER_SIZE + self.slot_size)
+
+    def write(self, kind, tier, sequence, payload, base=0, timestamp=None):
+        """Store a record and make it the newest of its tier and kind; False if it does not fit"""
+        if len(payload) > self.slot_size:
+            return False
+        tier_index = self.tiers.index(tier)
+        with self.write_lock:
+            slot = self.write_count % self.slot_count
+            self.write_count += 1
+            offset = self._slot_offset(slot)
+            generation = struct.unpack_from('<Q', self.buf, offset)[0]
+            struct.pack_into('<Q', self.buf, offset, generation + 1)  # Odd: being written
+            self.buf[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + len(payload)] = payload
+            struct.pack_into(SLOT_HEADER, self.buf, offset, generation + 2, kind, tier_index, sequence, base,
+                             timestamp or time.time(), len(payload))
+            struct.pack_into(INDEX_ENTRY, self.buf, self._index_offset(tier_index, kind), slot, sequence)
+        return True
+
+    def clear_index(self):
+        """Forget every newest record (capture paused: nobody should be served an old screen)"""
+        with self.write_lock:
+            for tier_index in range(len(self.tiers)):
+                for kind in range(RECORD_KINDS):
+                    struct.pack_into(INDEX_ENTRY, self.buf, self._index_offset(tier_index, kind), -1, 0)
+
+    def newest(self, tier, kind):
+        """Sequence of the newest record of a tier and kind, or None"""
+        slot, sequence = struct.unpack_from(INDEX_ENTRY, self.buf, self._index_offset(self.tiers.index(tier), kind))
+        return None if slot < 0 else sequence
+
+    def read(self, tier, kind):
+        """Newest record of a tier and kind: (sequence, base, timestamp, payload) or None"""
+        tier_index = self.tiers.index(tier)
+        for _ in range(3):
+            slot, sequence = struct.unpack_from(INDEX_ENTRY, self.buf, self._index_offset(tier_index, kind))
+            if slot < 0:
+                return None
+            offset = self._slot_offset(slot)
+            generation, record_kind, record_tier, record_sequence, base, timestamp, length = \
+                struct.unpack_from(SLOT_HEADER, self.buf, offset)
+            if generation % 2 or (record_kind, record_tier, record_sequence) != (kind, tier_index, sequence):
+                continue  # Being rewritten, or the index moved on meanwhile
+            payload = bytes(self.buf[offset + SLOT_HEADER_SIZE:offset + SLOT_HEADER_SIZE + length])
+            if struct.unpack_from('<Q', self.buf, offset)[0] == generation:
+                return sequence, base, timestamp, payload
+        return None
+
+    # ------------------------------------------------------------------
+    # Front-end table
+    # ------------------------------------------------------------------
+    def _row_offset(self, row):
+        return FRONTEND_OFFSET + row * FRONTEND_ROW_SIZE
+
+    def read_frontend(self, row):
+        """(pid, heartbeat, wake counter, signal port, counts) of a front-end row"""
+        offset = self._row_offset(row)
+        pid, heartbeat, wake, port = struct.unpack_from(FRONTEND_HEADER, self.buf, offset)
+        counts = struct.unpack_from(FRONTEND_COUNTS, self.buf, offset + struct.calcsize(FRONTEND_HEADER))
+        return pid, heartbeat, wake, port, counts
+
+    def claim_frontend(self, port=0):
+        """Take a free (or abandoned) row for this process, returns its number
+
+        port is the local UDP port the daemon signals new frames to.
+        """
+        now = time.time()
+        for row in range(MAX_FRONTENDS):
+            pid, heartbeat = self.read_frontend(row)[:2]
+            if pid == 0 or now - heartbeat > FRONTEND_TIMEOUT:
+                offset = self._row_offset(row)
+                self.buf[offset:offset + FRONTEND_ROW_SIZE] = bytes(FRONTEND_ROW_SIZE)
+                struct.pack_into(FRONTEND_HEADER, self.buf, offset, os.getpid(), now, 0, port)
+                time.sleep(0.01)
+                if self.read_frontend(row)[0] == os.getpid():  # Nobody claimed it at the same moment
+                    return row
+        raise RuntimeError(f"Capture daemon already serves {MAX_FRONTENDS} front-ends")
+
+    def update_frontend(self, row, counts=None, wake=False):
+        """Refresh a row's heartbeat (and its per-tier counts / wake request)"""
+        offset = self._row_offset(row)
+        pid, _, wake_count, port = struct.unpack_from(FRONTEND_HEADER, self.buf, offset)
+        struct.pack_into(FRONTEND_HEADER, self.buf, offset, pid, time.time(), wake_count + (1 if wake else 0), port)
+        if counts is not None:
+            struct.pack_into(FRONTEND_COUNTS, self.buf, offset + struct.calcsize(FRONTEND_HEADER), *counts)
+
+    def release_frontend(self, row):
+        offset = self._row_offset(row)
+        self.buf[offset:offset + FRONTEND_ROW_SIZE] = bytes(FRONTEND_ROW_SIZE)
+
+
+class DaemonEngine(CaptureEngine):
+    """Capture engine whose viewers are the front-ends' viewers (for the adaptive FPS)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frontend_viewers = 0
+
+    def viewer_count(self):
+        return self.frontend_viewers
+
+    def catchup_base(self, tier, sequence):
+        """Oldest frame (at most TILE_CATCHUP_FRAMES back) a tier's tiles can be taken from,
+        None if that is just the previous frame"""
+        tracker = self.tile_trackers.get(tier)
+        if tracker is None or tracker.start_sequence is None:
+            return None
+        base = max(sequence - TILE_CATCHUP_FRAMES, tracker.start_sequence)
+        return base if base < sequence - 1 else None
+
+
+class CaptureDaemon:
+    """Owns the engine and the ring; mirrors front-end subscriptions into the engine"""
+
+    def __init__(self, name=DEFAULT_RING_NAME, capture_source=None, quality_settings=None,
+                 slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE):
+        self.name = name
+        self.engine = DaemonEngine(capture_source=capture_source, quality_settings=quality_settings)
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ring = None
+        self.running = False
+        self.frontend_state = {}  # row -> (pid, wake counter, signal port)
+        self.signal_socket = None  # Sends the front-ends' new-frame datagrams
+        self.subscribed = {}  # (row, tier) -> (tiles, draws cursor itself)
+        self.subscribed_before = False
+        self.last_cursor = None
+        self.stats = {
+            'records_written': 0,
+            'records_too_large': 0,
+            'frontends': 0
+        }
+
+    def open_ring(self):
+        """Create the ring, replacing one left behind by a daemon that died"""
+        try:
+            stale = FrameRing.attach(self.name)
+        except RuntimeError:
+            stale = None
+        if stale is not None:
+            heartbeat = stale.header()[1]
+            stale.close()
+            if time.time() - heartbeat < FRONTEND_TIMEOUT:
+                raise RuntimeError(f"Capture daemon '{self.name}' is already running")
+            print(f"[*] Replacing the ring of a capture daemon that stopped: {self.name}")
+            shared_memory.SharedMemory(name=self.name).unlink()
+        self.ring = FrameRing.create(self.name, self.engine.quality_settings, self.slots, self.slot_size,
+                                     str(self.engine.capture_source or 'screen'))
+
+    def write(self, kind, tier, sequence, payload, base=0, timestamp=None):
+        if self.ring.write(kind, tier, sequence, payload, base, timestamp):
+            self.stats['records_written'] += 1
+        else:
+            self.stats['records_too_large'] += 1
+
+    def on_publish(self, engine, encoded):
+        """Publish hook: copy the new tiers, and the tiles delta viewers need, into the ring"""
+        frame_set = engine.frame_set
+        sequence, timestamp = frame_set.sequence, frame_set.timestamp  # Capture time, for the front-ends' frame age
+        for tier, frame in encoded.items():
+            self.write(RECORD_FRAME, tier, sequence, frame, timestamp=timestamp)
+        for tier in engine.tile_tiers():
+            # Tiles since the previous frame, and since an older one for viewers that fell behind
+            for kind, base in ((RECORD_TILES, sequence - 1), (RECORD_CATCHUP, engine.catchup_base(tier, sequence))):
+                if base is None:
+                    continue
+                update, _ = engine.get_tile_update(tier, base)
+                if update is not None and update['type'] == 'tiles':
+                    self.write(kind, tier, sequence, pack_tiles(update, tier), base, timestamp)
+        self.ring.set_status(frame_sequence=sequence)
+        self.signal_frontends()
+        return None
+
+    def signal_frontends(self):
+        """Wake every front-end's frame poller (one datagram each, lost ones are re-checked)"""
+        for _, _, port in list(self.frontend_state.values()):
+            if port:
+                try:
+                    self.signal_socket.sendto(b'\0', ('127.0.0.1', port))
+                except OSError:
+                    pass  # Front-end gone or its buffer full: it re-checks on its own
+
+    def sync_frontends(self):
+        """Mirror the live front-ends' viewers into engine subscriptions"""
+        now = time.time()
+        wanted = {}
+        viewers = 0
+        wake = False
+        for row in range(MAX_FRONTENDS):
+            pid, heartbeat, wake_count, port, counts = self.ring.read_frontend(row)
+            if pid == 0 or now - heartbeat > FRONTEND_TIMEOUT:
+                if row in self.frontend_state:
+                    old_pid = self.frontend_state.pop(row)[0]
+                    if pid != 0:
+                        print(f"[-] Front-end {pid} stopped responding - its viewers were dropped")
+                        self.ring.release_frontend(row)
+                    else:
+                        print(f"[-] Front-end {old_pid} detached")
+                continue
+            previous = self.frontend_state.get(row)
+            if previous is None:
+                print(f"[+] Front-end {pid} attached")
+            elif previous[1] != wake_count:
+                wake = True
+            self.frontend_state[row] = (pid, wake_count, port)
+            for tier_index, tier in enumerate(self.ring.tiers):
+                tier_viewers, tile_viewers, frame_cursor_viewers = counts[tier_index * 3:tier_index * 3 + 3]
+                if tier_viewers:
+                    viewers += tier_viewers
+                    wanted[(row, tier)] = (tile_viewers > 0, frame_cursor_viewers == 0)
+
+        self.engine.frontend_viewers = viewers
+        self.stats['frontends'] = len(self.frontend_state)
+        for key in list(self.subscribed):
+            if key not in wanted:
+                self.engine.unsubscribe(key)
+                del self.subscribed[key]
+        for key, mode in wanted.items():
+            if self.subscribed.get(key) != mode:
+                new_tier = key[1] not in self.engine.active_tiers()
+                self.engine.subscribe(key, key[1], tiles=mode[0], cursor=mode[1])
+                self.subscribed[key] = mode
+                if new_tier:
+                    # Encoded on demand by subscribe(): hand it over right away
+                    frame, sequence = self.engine.get_frame_with_sequence(key[1])
+                    if frame is not None:
+                        self.write(RECORD_FRAME, key[1], sequence, frame,
+                                   timestamp=self.engine.frame_timestamp(sequence) or None)
+        if not wanted and self.subscribed_before:
+            self.ring.clear_index()
+        self.subscribed_before = bool(wanted)
+        if wake:
+            self.engine.request_frame()
+
+    def publish_cursor(self):
+        engine = self.engine
+        engine.poll_cursor(engine.source)
+        with engine.cursor_lock:
+            cursor, sequence = engine.cursor, engine.cursor_sequence
+        if (cursor, sequence) != self.last_cursor:
+            self.last_cursor = (cursor, sequence)
+            x, y = cursor if cursor is not None else (0, 0)
+            self.ring.set_cursor(x, y, cursor is not None, sequence)
+
+    def run(self):
+        """Capture until stop() (or Ctrl+C)"""
+        self.open_ring()
+        self.signal_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.signal_socket.setblocking(False)
+        self.engine.add_hook('publish', self.on_publish)
+        self.running = True
+        self.engine.start()
+        print(f"[*] Capture daemon '{self.name}' running (pid {os.getpid()}): "
+              f"{self.slots} slots of {self.slot_size // 1024} KB, tiers {', '.join(self.ring.tiers)}")
+        print(f"[*] Attach servers with {CAPTURE_DAEMON_ENV}={self.name}")
+
+        last_heartbeat = 0
+        last_stats = 0
+        try:
+            while self.running:
+                self.sync_frontends()
+                self.publish_cursor()
+                now = time.time()
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    self.ring.set_status(adaptive_fps=adaptive_fps_for(self.engine.frontend_viewers))
+                    last_heartbeat = now
+                if now - last_stats >= 1.0:
+                    stats = self.engine.get_performance_stats()
+                    stats.update(self.stats)
+                    stats['capture_daemon'] = self.name
+                    stats['daemon_pid'] = os.getpid()
+                    self.ring.write_stats(stats)
+                    last_stats = now
+                time.sleep(min(CONTROL_INTERVAL, 1.0 / CURSOR_FPS))
+        finally:
+            self.running = False
+            self.engine.stop()
+            self.engine.remove_hook('publish', self.on_publish)
+            self.ring.close()
+            self.signal_socket.close()
+            print(f"[*] Capture daemon '{self.name}' stopped")
+
+    def stop(self):
+        self.running = False
+
+
+class RingEngine:
+    """Front-end view of a capture daemon, with CaptureEngine's consumer interface
+
+    Servers use it exactly like a CaptureEngine: subscribe viewers, read
+    frames, tile updates and the cursor. Subscriptions are summed per tier
+    into this process's row of the ring, which the daemon turns into its own
+    subscriptions. Each new frame is copied out of the ring once per process.
+    One poller thread per process waits for the daemon's new-frame signal
+    and wakes the threads blocked in wait_for_frame().
+    """
+
+    def __init__(self, name=DEFAULT_RING_NAME, quality_settings=None):
+        self.name = name
+        self.quality_settings = {
+            tier.lower(): dict(config)
+            for tier, config in (quality_settings or DEFAULT_QUALITY_SETTINGS).items()
+        }
+        self.ring = None
+        self.row = None
+        self.ring_lock = threading.Lock()
+        # Epoch of the attached ring: a restarted daemon counts frames from 0
+        # again, so viewers holding older sequences start over (see DeltaViewer)
+        self.epoch = 0
+
+        self.subscriptions = {}
+        self.tile_viewers = set()
+        self.cursor_viewers = set()
+        self.subscriptions_lock = threading.Lock()
+
+        self.frames = {}  # tier -> (sequence, timestamp, JPEG) last copied out of the ring
+        self.tile_updates = {}  # (tier, record kind) -> (sequence, base, update)
+        self.parts = {}  # tier -> (sequence, MJPEG part)
+        self.performance_stats = {
+            'tile_updates': 0,
+            'delta_keyframes': 0,
+            'cursor_updates': 0,
+            'frame_age_ms': 0.0,
+            'ring_reattaches': 0
+        }
+
+        self.running = False
+        self.users = 0
+        self.users_lock = threading.Lock()
+        self.heartbeat_thread = None
+        self.stop_event = threading.Event()
+
+        # Newest frame sequence seen by the poller; waiting threads block on
+        # frame_condition and the poller only runs while some are waiting
+        self.frame_condition = threading.Condition()
+        self.seen_sequence = 0
+        self.frame_waiters = 0
+        self.poll_thread = None
+        self.signal_socket = None  # UDP socket the daemon signals new frames to
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Attach to the daemon (no-op if another server in this process already did)"""
+        with self.users_lock:
+            self.users += 1
+            if self.running:
+                return
+            self.signal_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.signal_socket.bind(('127.0.0.1', 0))
+            self.attach()
+            self.running = True
+            self.stop_event.clear()
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat_loop, daemon=True)
+            self.heartbeat_thread.start()
+            self.poll_thread = threading.Thread(target=self.frame_poll_loop, daemon=True)
+            self.poll_thread.start()
+
+    def stop(self):
+        """Detach once the last server in this process has stopped (capture goes on)"""
+        with self.users_lock:
+            self.users = max(0, self.users - 1)
+            if self.users > 0 or not self.running:
+                return
+            self.running = False
+            self.stop_event.set()
+        with self.frame_condition:
+            self.frame_condition.notify_all()  # Poller and waiting threads re-check whether to go on
+        for thread in (self.heartbeat_thread, self.poll_thread):
+            if thread is not None:
+                thread.join(timeout=2)
+        self.heartbeat_thread = None
+        self.poll_thread = None
+        self.detach()
+        self.signal_socket.close()
+        self.signal_socket = None
+
+    def attach(self):
+        with self.ring_lock:
+            ring = FrameRing.attach(self.name)
+            self.quality_settings = dict(ring.read_meta()['quality_settings'])
+            self.ring = ring
+            self.row = ring.claim_frontend(self.signal_socket.getsockname()[1])
+            self.frames = {}
+            self.tile_updates = {}
+            self.parts = {}
+            epoch = ring.header()[5]
+        if epoch != self.epoch:
+            with self.frame_condition:
+                self.epoch = epoch
+                self.seen_sequence = 0
+                self.frame_condition.notify_all()  # Waiters' `after` belongs to the old ring
+        self.sync_subscriptions()
+        print(f"[*] Attached to capture daemon '{self.name}' (pid {ring.header()[0]})")
+
+    def detach(self):
+        with self.ring_lock:
+            if self.ring is not None:
+                self.ring.release_frontend(self.row)
+                self.ring.close()
+                self.ring = None
+
+    def heartbeat_loop(self):
+        """Keep this front-end's row alive; reattach if the daemon was restarted"""
+        while not self.stop_event.wait(HEARTBEAT_INTERVAL):
+            with self.ring_lock:
+                ring = self.ring
+                if ring is not None:
+                    ring.update_frontend(self.row)
+                    daemon_alive = time.time() - ring.header()[1] < FRONTEND_TIMEOUT
+            if ring is not None and daemon_alive:
+                continue
+            self.detach()
+            try:
+                self.attach()
+                self.performance_stats['ring_reattaches'] += 1
+            except RuntimeError:
+                pass  # Daemon not back yet: try again on the next beat
+
+    def frame_poll_loop(self):
+        """Wake waiting threads when the daemon publishes a frame
+
+        There is no condition variable across processes, so the daemon sends
+        a datagram to signal_socket after every publish. While threads of
+        this process are waiting, this thread blocks on it (re-checking the
+        ring header every FRAME_WAKE_TIMEOUT in case a datagram got lost) and
+        notifies frame_condition, so however many viewers wait, one thread
+        listens and an idle ring costs nothing.
+        """
+        sock = self.signal_socket
+        while not self.stop_event.is_set():
+            with self.frame_condition:
+                while not self.frame_waiters and not self.stop_event.is_set():
+                    self.frame_condition.wait()
+            sequence = self.frame_sequence
+            if sequence != self.seen_sequence:
+                with self.frame_condition:
+                    self.seen_sequence = sequence
+                    self.frame_condition.notify_all()
+            try:
+                sock.settimeout(FRAME_WAKE_TIMEOUT)
+                sock.recv(64)
+                sock.setblocking(False)
+                while sock.recv(64):
+                    pass  # Signals that queued up meanwhile
+            except (socket.timeout, BlockingIOError):
+                pass
+            except OSError:
+                break  # Socket closed: stopping
+
+    # ------------------------------------------------------------------
+    # Consumers
+    # ------------------------------------------------------------------
+    def subscribe(self, viewer, tier, tiles=None, cursor=None):
+        """Register (or move) a viewer on a tier (see CaptureEngine.subscribe)"""
+        tier = tier.lower()
+        if tier not in self.quality_settings:
+            raise ValueError(f"Unknown quality tier '{tier}'")
+        with self.subscriptions_lock:
+            self.subscriptions[viewer] = tier
+            if tiles:
+                self.tile_viewers.add(viewer)
+            elif tiles is not None:
+                self.tile_viewers.discard(viewer)
+            if cursor:
+                self.cursor_viewers.add(viewer)
+            elif cursor is not None:
+                self.cursor_viewers.discard(viewer)
+        self.sync_subscriptions()
+
+    def unsubscribe(self, viewer):
+        with self.subscriptions_lock:
+            self.subscriptions.pop(viewer, None)
+            self.tile_viewers.discard(viewer)
+            self.cursor_viewers.discard(viewer)
+        self.sync_subscriptions()
+
+    def sync_subscriptions(self):
+        """Write this process's per-tier viewer counts into its ring row"""
+        counts = [0] * (MAX_TIERS * 3)
+        with self.ring_lock:
+            tiers = self.ring.tiers if self.ring is not None else list(self.quality_settings)
+        with self.subscriptions_lock:
+            for viewer, tier in self.subscriptions.items():
+                if tier not in tiers:
+                    continue
+                index = tiers.index(tier) * 3
+                counts[index] += 1
+                counts[index + 1] += viewer in self.tile_viewers
+                counts[index + 2] += viewer not in self.cursor_viewers
+        with self.ring_lock:
+            if self.ring is not None:
+                self.ring.update_frontend(self.row, counts)
+
+    def active_tiers(self):
+        with self.subscriptions_lock:
+            return set(self.subscriptions.values())
+
+    def viewer_count(self):
+        """Viewers across every front-end attached to the daemon"""
+        with self.ring_lock:
+            if self.ring is None:
+                return 0
+            now = time.time()
+            total = 0
+            for row in range(MAX_FRONTENDS):
+                pid, heartbeat, _, _, counts = self.ring.read_frontend(row)
+                if pid and now - heartbeat <= FRONTEND_TIMEOUT:
+                    total += sum(counts[0::3])
+            return total
+
+    def request_frame(self):
+        """Ask the daemon for the next frame right away"""
+        with self.ring_lock:
+            if self.ring is not None:
+                self.ring.update_frontend(self.row, wake=True)
+
+    @property
+    def adaptive_fps(self):
+        with self.ring_lock:
+            fps = self.ring.header()[4] if self.ring is not None else 0
+        return fps or adaptive_fps_for(self.viewer_count())
+
+    @property
+    def frame_sequence(self):
+        with self.ring_lock:
+            return self.ring.header()[2] if self.ring is not None else 0
+
+    @property
+    def frame_cache(self):
+        """Newest JPEG per tier this process has read"""
+        return {tier: frame for tier, (_, _, frame) in self.frames.items()}
+
+    # ------------------------------------------------------------------
+    # Frame access
+    # ------------------------------------------------------------------
+    def wait_for_frame(self, after, timeout=None):
+        """Wait until the daemon publishes a frame newer than `after` (see CaptureEngine.wait_for_frame)
+
+        Blocks on frame_condition, which frame_poll_loop() notifies. The
+        returned FrameSet only carries the sequence: frames are copied out
+        of the ring by get_frame_with_sequence(), for the tiers actually needed.
+        """
+        sequence = self.frame_sequence
+        if sequence > after or not self.running:
+            return FrameSet(sequence)
+        with self.frame_condition:
+            epoch = self.epoch
+            self.frame_waiters += 1
+            self.frame_condition.notify_all()  # Start the poller
+            try:
+                self.frame_condition.wait_for(
+                    lambda: self.seen_sequence > after or self.epoch != epoch or self.stop_event.is_set(), timeout)
+            finally:
+                self.frame_waiters -= 1
+        return FrameSet(self.frame_sequence)
+
+    def get_frame(self, tier):
+        return self.get_frame_with_sequence(tier)[0]
+
+    def get_frame_with_sequence(self, tier):
+        """Newest JPEG bytes of a tier plus their frame sequence (copied once per new frame)"""
+        tier = tier.lower()
+        with self.ring_lock:
+            if self.ring is None or tier not in self.ring.tiers:
+                return None, 0
+            sequence = self.ring.newest(tier, RECORD_FRAME)
+            cached = self.frames.get(tier)
+            if sequence is None:
+                cached = None
+            elif cached is None or cached[0] != sequence:
+                record = self.ring.read(tier, RECORD_FRAME)
+                if record is not None:
+                    cached = (record[0], record[2], record[3])
+                    self.frames[tier] = cached
+                    self.performance_stats['frame_age_ms'] = round((time.time() - record[2]) * 1000, 1)
+        if cached is None:
+            # Nobody subscribed the tier until now: the daemon encodes it on its next pass
+            self.request_frame()
+            return None, self.frame_sequence
+        return cached[2], cached[0]
+
+    def frame_timestamp(self, sequence):
+        """Capture time of frame `sequence` as recorded in the ring, 0.0 if this process has not read it"""
+        for cached_sequence, timestamp, _ in list(self.frames.values()):
+            if cached_sequence == sequence:
+                return timestamp
+        return 0.0
+
+    def get_mjpeg_part_with_sequence(self, tier):
+        """Newest tier as an MJPEG part (built once per frame for all of this process's viewers)"""
+        tier = tier.lower()
+        frame, sequence = self.get_frame_with_sequence(tier)
+        if frame is None:
+            return None, sequence
+        cached = self.parts.get(tier)
+        if cached is None or cached[0] != sequence:
+            cached = (sequence, mjpeg_part(frame))
+            self.parts[tier] = cached
+        return cached[1], sequence
+
+    def get_tile_update(self, tier, since=None):
+        """Changes of a tier since frame `since` (see CaptureEngine.get_tile_update)
+
+        The daemon publishes the tiles between consecutive frames, plus the
+        tiles changed since a frame up to TILE_CATCHUP_FRAMES back. A viewer
+        that missed a few frames gets the latter (tiles carry their newest
+        content, so it fits any canvas from that frame on); only a viewer
+        further behind than the ring keeps gets a keyframe.
+        """
+        tier = tier.lower()
+        current = self.frame_sequence
+        if since is not None and since >= current:
+            return None, current
+        if since is not None:
+            for kind in (RECORD_TILES, RECORD_CATCHUP):
+                cached = self.read_tiles(tier, kind)
+                if cached is None:
+                    continue
+                sequence, base, update = cached
+                if base == since or (kind == RECORD_CATCHUP and base <= since < sequence and not update['copies']):
+                    self.performance_stats['tile_updates'] += 1
+                    return update, sequence
+
+        frame, sequence = self.get_frame_with_sequence(tier)
+        if frame is None or (since is not None and since >= sequence):
+            return None, sequence
+        self.performance_stats['delta_keyframes'] += 1
+        return {'type': 'keyframe', 'sequence': sequence, 'data': frame}, sequence
+
+    def read_tiles(self, tier, kind):
+        """Newest tile record of a tier and kind: (sequence, base, update) or None (decoded once per record)"""
+        with self.ring_lock:
+            sequence = self.ring.newest(tier, kind) if self.ring is not None else None
+            if sequence is None:
+                return None
+            cached = self.tile_updates.get((tier, kind))
+            if cached is None or cached[0] != sequence:
+                record = self.ring.read(tier, kind)
+                if record is None:
+                    return cached
+                cached = (record[0], record[1], unpack_tiles(record[3]))
+                self.tile_updates[(tier, kind)] = cached
+            return cached
+
+    def get_cursor(self, tier):
+        """Cursor message in a tier's pixel coordinates plus the cursor sequence"""
+        with self.ring_lock:
+            if self.ring is None:
+                return {'type': 'cursor', 'x': 0, 'y': 0, 'visible': False}, 0
+            x, y, visible, sequence = self.ring.header()[3]
+        if not visible:
+            return {'type': 'cursor', 'x': 0, 'y': 0, 'visible': False}, sequence
+        scale = self.quality_settings[tier.lower()]['scale'] / 100
+        return {'type': 'cursor', 'x': int(x * scale), 'y': int(y * scale), 'visible': True}, sequence
+
+    def screen_size(self):
+        """(width, height) of the daemon's screen, from its published stats"""
+        with self.ring_lock:
+            stats = self.ring.read_stats() if self.ring is not None else {}
+        width, height = stats.get('screen_size') or (0, 0)
+        return width, height
+
+    def get_performance_stats(self):
+        """The daemon's capture statistics plus this front-end's ring statistics"""
+        with self.ring_lock:
+            stats = self.ring.read_stats() if self.ring is not None else {}
+        stats.update(self.performance_stats)
+        stats['capture_daemon_attached'] = self.ring is not None
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Screen share capture daemon")
+    parser.add_argument('--name', default=os.environ.get(CAPTURE_DAEMON_ENV) or DEFAULT_RING_NAME,
+                        help=f"Ring name front-ends attach to (default: {DEFAULT_RING_NAME})")
+    parser.add_argument('--source', default=None,
+                        help="Capture source spec (default: SCREENSHARE_CAPTURE_SOURCE or the screen)")
+    parser.add_argument('--slots', type=int, default=DEFAULT_SLOTS, help=f"Ring slots (default: {DEFAULT_SLOTS})")
+    parser.add_argument('--slot-mb', type=float, default=DEFAULT_SLOT_SIZE / (1024 * 1024),
+                        help="Largest record in MB (default: 4)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("SCREEN SHARE CAPTURE DAEMON")
+    print("=" * 60)
+    daemon = CaptureDaemon(args.name, capture_source=args.source, slots=args.slots,
+                           slot_size=int(args.slot_mb * 1024 * 1024))
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+    except RuntimeError as e:
+        print(f"[-] {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1094 @@
+"""
+Shared capture/encode engine
+One capture -> cursor -> resize -> encode pipeline used by the TCP server,
+the web server and the trusted web server. Every stage is timed and can be
+extended with hooks, so an optimization made here speeds up every mode.
+"""
+
+import base64
+import os
+import threading
+import time
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from capture_sources import create_capture_source
+from frame_delta import ChangeDetector, TileTracker
+from tier_pyramid import TierPyramid
+
+try:
+    from process_encoder import ProcessEncoder
+    PROCESS_ENCODER_AVAILABLE = True
+except ImportError:
+    PROCESS_ENCODER_AVAILABLE = False
+
+# Quality tiers shared by every server (tier names are lowercase here;
+# the TCP protocol's HIGH/MEDIUM/LOW map onto them case-insensitively)
+DEFAULT_QUALITY_SETTINGS = {
+    'high': {'scale': 100, 'jpeg_quality': 95},
+    'medium': {'scale': 85, 'jpeg_quality': 85},
+    'low': {'scale': 70, 'jpeg_quality': 75}
+}
+
+# Pipeline stages, in order. Hooks registered for a stage run right after it.
+ENGINE_STAGES = ('capture', 'detect', 'convert', 'cursor', 'resize', 'encode', 'publish')
+
+# Stream loops resend an unchanged frame this often so viewers and proxies
+# can tell an idle screen from a dead connection
+KEEPALIVE_INTERVAL = 2.0
+
+# A viewer whose outbound slot makes no progress for this many seconds is
+# evicted: the peer is dead or its link cannot carry even one frame
+STALL_TIMEOUT = 5.0
+
+# Delta viewers get a full keyframe instead of tiles when more than this
+# fraction of the tiles changed (one JPEG is smaller than many small ones)
+DELTA_KEYFRAME_RATIO = 0.5
+
+# How tiers are JPEG-encoded: one after another, concurrently on threads, or
+# in worker processes (4K / multi-monitor hosts). Default from the environment.
+ENCODE_BACKENDS = ('serial', 'threads', 'processes')
+ENCODE_BACKEND_ENV = 'SCREENSHARE_ENCODE_BACKEND'
+DEFAULT_ENCODE_BACKEND = 'threads'
+
+# multipart/x-mixed-replace boundary of the MJPEG /stream endpoints
+MJPEG_BOUNDARY = 'frame'
+
+# Viewers that draw the cursor themselves get its position up to this often
+# (independent of the frame rate: a moving pointer costs no new frames)
+CURSOR_FPS = 30
+
+
+def adaptive_fps_for(viewer_count):
+    """Adaptive FPS: more viewers = lower FPS to maintain performance"""
+    if viewer_count <= 2:
+        return 20  # Full speed for 0-2 viewers
+    elif viewer_count <= 5:
+        return 15  # Slight reduction for 3-5 viewers
+    elif viewer_count <= 10:
+        return 12  # Further reduction for 6-10 viewers
+    return 8       # Conservative for 10+ viewers
+
+
+def mjpeg_part(frame):
+    """One complete MJPEG multipart part: boundary, headers, JPEG and the closing CRLF"""
+    header = (f'--{MJPEG_BOUNDARY}\r\nContent-Type: image/jpeg\r\n'
+              f'Content-Length: {len(frame)}\r\n\r\n').encode('ascii')
+    return b''.join((header, frame, b'\r\n'))
+
+
+def draw_cursor(img, cursor_x, cursor_y):
+    """Draw the cursor marker into a BGR image"""
+    cursor_size = 12
+    cursor_thickness = 2
+    # Outer circle (white outline for visibility on any background)
+    cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
+    # Inner circle (black for contrast)
+    cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
+    # Center dot (red for visibility)
+    cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
+
+
+class BufferPool:
+    """Reusable image arrays, so steady-state frames allocate no frame buffers
+
+    Ownership is explicit: every array handed out belongs to the frame
+    generation being built (begin_frame(), the sequence it will be published
+    as). Once a newer frame has replaced its images the engine retires the
+    generation, and its arrays are handed out again as soon as no reader
+    holds it any more (hold()/release()) - images of the published frame
+    must never change under the tile trackers and viewer threads.
+    clear() forgets every array, held or not: a hold taken before it is
+    released as a no-op, so those arrays are never handed out again.
+    reuse=False allocates a fresh array every time (for comparisons).
+    """
+
+    def __init__(self, reuse=True):
+        self.reuse = reuse
+        self.lock = threading.Lock()
+        self.free = {}  # shape -> arrays nobody uses
+        self.owned = {}  # generation -> arrays handed out for it
+        self.holds = {}  # generation -> readers still using its arrays
+        self.retired = set()  # Generations to recycle once nobody holds them
+        self.generation = 0
+        self.epoch = 0  # Bumped by clear(): holds taken before it no longer count
+        self.allocations = 0
+
+    def begin_frame(self, generation):
+        """Arrays handed out from now on belong to frame `generation`"""
+        with self.lock:
+            if generation in self.owned and not self.holds.get(generation):
+                # An attempt at this frame failed part way: take its arrays back
+                self.recycle(self.owned.pop(generation))
+            self.generation = generation
+
+    def get(self, shape):
+        """A uint8 array of the given shape that nobody uses (contents undefined)"""
+        with self.lock:
+            buffers = self.free.get(shape)
+            if buffers:
+                buffer = buffers.pop()
+            else:
+                buffer = np.empty(shape, dtype=np.uint8)
+                self.allocations += 1
+            if self.reuse:
+                self.owned.setdefault(self.generation, []).append(buffer)
+        return buffer
+
+    def hold(self, generation):
+        """A reader uses generation's images: keep its arrays until release(hold)"""
+        with self.lock:
+            self.holds[generation] = self.holds.get(generation, 0) + 1
+            return generation, self.epoch
+
+    def release(self, hold):
+        generation, epoch = hold
+        with self.lock:
+            if epoch != self.epoch:
+                return  # Pool was cleared since: its arrays left the pool with it
+            count = self.holds.pop(generation, 0) - 1
+            if count > 0:
+                self.holds[generation] = count
+            elif generation in self.retired:
+                self.retire_locked(generation)
+
+    def retire(self, generation):
+        """Generation's images were replaced: reuse its arrays once nobody holds them"""
+        with self.lock:
+            self.retire_locked(generation)
+
+    def retire_locked(self, generation):
+        # Older generations still owning arrays belong to attempts that were never published
+        for retired in [owner for owner in self.owned if owner < generation] + [generation]:
+            if self.holds.get(retired):
+                self.retired.add(retired)
+            else:
+                self.retired.discard(retired)
+                self.recycle(self.owned.pop(retired, ()))
+
+    def recycle(self, buffers):
+        for buffer in buffers:
+            self.free.setdefault(buffer.shape, []).append(buffer)
+
+    def clear(self):
+        """Drop every pooled array (capture paused, resolution changed)"""
+        with self.lock:
+            self.free = {}
+            self.owned = {}
+            self.holds = {}
+            self.retired = set()
+            self.epoch += 1
+
+
+class FrameSet:
+    """One published frame: the JPEG of every encoded tier, its sequence and capture time
+
+    Never modified once published; the engine swaps in a new FrameSet
+    instead, so a reader can keep using the one it got without any lock.
+    """
+
+    __slots__ = ('sequence', 'timestamp', 'frames', 'parts')
+
+    def __init__(self, sequence=0, timestamp=0.0, frames=None):
+        self.sequence = sequence
+        self.timestamp = timestamp  # time.time() of the capture
+        self.frames = MappingProxyType(dict(frames or {}))  # tier -> JPEG bytes
+        self.parts = {}  # tier -> MJPEG part, built by the first MJPEG viewer that needs it
+
+    def get(self, tier):
+        return self.frames.get(tier)
+
+    def mjpeg_part(self, tier):
+        """The tier as a ready-to-send MJPEG part (shared by every MJPEG viewer), or None"""
+        part = self.parts.get(tier)
+        if part is None:
+            frame = self.frames.get(tier)
+            if frame is None:
+                return None
+            # Two viewers may build it at once; both results are identical
+            part = self.parts.setdefault(tier, mjpeg_part(frame))
+        return part
+
+    def with_tier(self, tier, frame):
+        """Same frame plus one more tier (encoded on demand)"""
+        frames = dict(self.frames)
+        frames[tier] = frame
+        frame_set = FrameSet(self.sequence, self.timestamp, frames)
+        frame_set.parts.update(self.parts)
+        return frame_set
+
+
+class CaptureEngine:
+    """Captures the screen once per tick and caches one JPEG per quality tier
+
+    Servers subscribe each viewer to a tier and consume frames with
+    get_frame(tier), or wait for the next FrameSet with wait_for_frame().
+    Only tiers with subscribers are encoded; a tier nobody watched yet is encoded on demand from the last captured image. Frames
+    identical to the previous capture are not re-encoded or published.
+    Viewers subscribed with tiles=True can fetch only the changed tiles of
+    their tier with get_tile_update(tier, since). Viewers subscribed with
+    cursor=True draw the pointer themselves from get_cursor(tier); it is
+    only drawn into the frames while some other viewer is watching. Several
+    servers may share one engine: start()/stop() are reference counted.
+    """
+
+    def __init__(self, capture_source=None, quality_settings=None, change_detection=True, reuse_buffers=True,
+                 tier_pyramid=True, encode_backend=None):
+        self.capture_source = capture_source  # Spec string or CaptureSource (None = real screen)
+        self.quality_settings = {
+            name.lower(): dict(config)
+            for name, config in (quality_settings or DEFAULT_QUALITY_SETTINGS).items()
+        }
+
+        # Encoded frames, one JPEG (bytes) per quality tier, swapped in whole on
+        # every publish; stream loops wait on frame_condition for the next one
+        self.frame_set = FrameSet()
+        self.frame_condition = threading.Condition()
+        # Frame sequences only ever grow within an epoch; a RingEngine moves to
+        # a new one when its capture daemon restarts and counts from 0 again
+        self.epoch = 0
+        self.cache_lock = threading.Lock()  # Last images and tile trackers
+        self.capture_time = 0.0
+        self.last_image = None  # Last captured BGR image, for encoding tiers on demand
+        self.last_image_generation = 0  # Its buffer pool generation
+        self.lazy_lock = threading.Lock()
+        # Converted and resized images are written into reused arrays (dst=)
+        self.buffer_pool = BufferPool(reuse=reuse_buffers)
+        # Tiers are derived from each other with measured kernels (None = INTER_AREA from full size)
+        self.tier_pyramid = TierPyramid() if tier_pyramid else None
+        # Tiers are JPEG-encoded concurrently: threads (cv2.imencode releases the GIL)
+        # or worker processes; pools are created on first use, one worker per tier
+        # up to the CPU count
+        self.encode_backend = (encode_backend or os.environ.get(ENCODE_BACKEND_ENV, '')
+                               or DEFAULT_ENCODE_BACKEND).lower()
+        if self.encode_backend not in ENCODE_BACKENDS:
+            raise ValueError(f"Unknown encode backend '{self.encode_backend}'. Backends: {', '.join(ENCODE_BACKENDS)}")
+        self.encode_pool = None
+        self.process_encoder = None
+
+        # Tier subscriptions: viewer key (socket, session id, ...) -> tier
+        self.subscriptions = {}
+        self.subscriptions_lock = threading.Lock()
+        self.viewers_event = threading.Event()  # Set while anyone is subscribed
+        self.idle = False
+
+        # Delta viewers: per-tier tile versions, updated on every publish
+        self.tile_viewers = set()
+        self.tile_trackers = {}  # tier -> TileTracker
+        self.tiles_lock = threading.Lock()
+        self.last_tier_images = {}
+
+        self.adaptive_fps = 20
+
+        # Change detection: unchanged frames are not converted, encoded or published
+        self.change_detection = change_detection
+        self.change_detector = ChangeDetector()
+        self.dirty_tiles = None  # Boolean tile mask of the last captured frame
+
+        # Cursor: drawn into the frames only for viewers that cannot draw it
+        # themselves; the others poll get_cursor() between frames
+        self.cursor_viewers = set()
+        self.cursor = None  # Cursor position (source pixels), None = not on the captured area
+        self.cursor_sequence = 0  # Incremented every time the cursor moves or hides
+        self.cursor_lock = threading.Lock()
+        self.cursor_poll_time = 0
+        self.cursor_in_frames = True  # Decided per frame in stage_detect
+        self.published_cursor_in_frames = None  # Whether the cached frames contain the cursor
+        self.source_size = None  # (width, height) of the captured frames
+
+        # Stage hooks: callback(engine, value) -> replacement value or None
+        self.hooks = {stage: [] for stage in ENGINE_STAGES}
+        self.stage_times = {stage: 0.0 for stage in ENGINE_STAGES}  # Smoothed seconds per stage
+        self.last_stage_times = {stage: 0.0 for stage in ENGINE_STAGES}  # Seconds per stage, last frame
+
+        self.performance_stats = {
+            'frames_captured': 0,
+            'avg_frame_time': 0,
+            'stage_times_ms': {stage: 0.0 for stage in ENGINE_STAGES},
+            'tiers_encoded': 0,
+            'lazy_tier_encodes': 0,
+            'frames_checked': 0,
+            'frames_unchanged': 0,
+            'tile_updates': 0,
+            'tiles_encoded': 0,
+            'delta_keyframes': 0,
+            'cursor_updates': 0,
+            'idle_seconds': 0.0
+        }
+
+        self.running = False
+        self.users = 0  # Servers currently using the engine
+        self.users_lock = threading.Lock()
+        self.capture_thread = None
+        self.wake_event = threading.Event()
+        self.source = None
+
+    # ------------------------------------------------------------------
+    # Consumers
+    # ------------------------------------------------------------------
+    def subscribe(self, viewer, tier, tiles=None, cursor=None):
+        """Register (or move) a viewer on a tier; encodes the tier now if needed
+
+        tiles=True marks a delta viewer: its tier's tile versions are tracked
+        so get_tile_update() can return only what changed. cursor=True marks
+        a viewer that draws the cursor itself from get_cursor(). None keeps
+        the viewer's current mode.
+        """
+        tier = tier.lower()
+        if tier not in self.quality_settings:
+            raise ValueError(f"Unknown quality tier '{tier}'")
+        with self.subscriptions_lock:
+            self.subscriptions[viewer] = tier
+            if tiles:
+                self.tile_viewers.add(viewer)
+            elif tiles is not None:
+                self.tile_viewers.discard(viewer)
+            if cursor:
+                self.cursor_viewers.add(viewer)
+            elif cursor is not None:
+                self.cursor_viewers.discard(viewer)
+            self.viewers_event.set()  # Wakes an idle capture loop
+        # Switching to a tier nobody watched: produce it right away
+        self.get_frame(tier)
+
+    def unsubscribe(self, viewer):
+        """Forget a viewer (its tier stops being encoded if nobody else uses it)"""
+        with self.subscriptions_lock:
+            self.subscriptions.pop(viewer, None)
+            self.tile_viewers.discard(viewer)
+            self.cursor_viewers.discard(viewer)
+            if not self.subscriptions:
+                self.viewers_event.clear()
+
+    def active_tiers(self):
+        """Tiers that currently have at least one subscriber"""
+        with self.subscriptions_lock:
+            return set(self.subscriptions.values())
+
+    def tile_tiers(self):
+        """Tiers that have at least one delta viewer"""
+        with self.subscriptions_lock:
+            return {self.subscriptions[viewer] for viewer in self.tile_viewers if viewer in self.subscriptions}
+
+    def cursor_needed_in_frames(self):
+        """True while any viewer relies on the cursor being drawn into the frames"""
+        with self.subscriptions_lock:
+            return any(viewer not in self.cursor_viewers for viewer in self.subscriptions)
+
+    def viewer_count(self):
+        """Total viewers across every server attached to this engine"""
+        with self.subscriptions_lock:
+            return len(self.subscriptions)
+
+    def add_hook(self, stage, callback):
+        """Run callback(engine, value) after a stage; a non-None return replaces the value"""
+        if stage not in self.hooks:
+            raise ValueError(f"Unknown stage '{stage}'. Stages: {', '.join(ENGINE_STAGES)}")
+        self.hooks[stage].append(callback)
+
+    def remove_hook(self, stage, callback):
+        """Unregister a stage hook"""
+        if callback in self.hooks.get(stage, []):
+            self.hooks[stage].remove(callback)
+
+    # ------------------------------------------------------------------
+    # Lifecycle
+    # ------------------------------------------------------------------
+    def start(self):
+        """Start capturing (no-op if another server already started it)"""
+        with self.users_lock:
+            self.users += 1
+            if self.running:
+                return
+            self.running = True
+            self.wake_event.clear()
+            self.capture_thread = threading.Thread(target=self.capture_loop, daemon=True)
+            self.capture_thread.start()
+
+    def stop(self):
+        """Stop capturing once the last server using the engine has stopped"""
+        with self.users_lock:
+            self.users = max(0, self.users - 1)
+            if self.users > 0 or not self.running:
+                return
+            self.running = False
+            self.wake_event.set()
+            self.viewers_event.set()  # Release the loop if it is parked idle
+        with self.frame_condition:
+            self.frame_condition.notify_all()  # Stream loops re-check whether to go on
+            capture_thread = self.capture_thread
+            self.capture_thread = None
+        if capture_thread and capture_thread is not threading.current_thread():
+            capture_thread.join(timeout=2)
+
+    def request_frame(self):
+        """Wake the capture loop so the next frame is produced immediately"""
+        self.wake_event.set()
+
+    # ------------------------------------------------------------------
+    # Pipeline stages
+    # ------------------------------------------------------------------
+    def _run_hooks(self, stage, value):
+        for callback in self.hooks[stage]:
+            try:
+                result = callback(self, value)
+            except Exception as e:
+                print(f"[-] {stage} hook failed: {e}")
+                continue
+            if result is not None:
+                value = result
+        return value
+
+    def stage_capture(self, source):
+        """Grab a BGRA frame"""
+        self.capture_time = time.time()
+        return source.grab()
+
+    def poll_cursor(self, source, force=False):
+        """Read the cursor position (at most CURSOR_FPS times a second), returns True if it moved"""
+        with self.cursor_lock:
+            now = time.time()
+            if source is None or (not force and now - self.cursor_poll_time < 1.0 / CURSOR_FPS):
+                return False
+            self.cursor_poll_time = now
+            cursor = source.cursor_position()
+            if cursor is not None and self.source_size is not None:
+                width, height = self.source_size
+                if not (0 <= cursor[0] < width and 0 <= cursor[1] < height):
+                    cursor = None  # Pointer is on another monitor
+            if cursor == self.cursor:
+                return False
+            self.cursor = cursor
+            self.cursor_sequence += 1
+            return True
+
+    def stage_detect(self, screenshot, source):
+        """Compare the frame (and cursor) with the previous one, returns True if anything changed"""
+        self.source_size = (screenshot.shape[1], screenshot.shape[0])
+        cursor_moved = self.poll_cursor(source, force=True)
+        self.cursor_in_frames = self.cursor_needed_in_frames()
+        self.performance_stats['frames_checked'] += 1
+        if not self.change_detection:
+            self.dirty_tiles = None
+            return True
+
+        self.dirty_tiles = self.change_detector.update(screenshot)
+        # A moving cursor only needs new frames while it is drawn into them
+        changed = (bool(self.dirty_tiles.any())
+                   or (self.cursor_in_frames and cursor_moved)
+                   or self.cursor_in_frames != self.published_cursor_in_frames)
+        if not changed:
+            self.performance_stats['frames_unchanged'] += 1
+        return changed
+
+    def stage_convert(self, screenshot):
+        """Convert BGRA to BGR (into a reused array)"""
+        dst = self.buffer_pool.get(screenshot.shape[:2] + (3,))
+        return cv2.cvtColor(screenshot, cv2.COLOR_BGRA2BGR, dst=dst)
+
+    def stage_cursor(self, img, source):
+        """Draw the cursor on the image (only once for all viewers, only if one needs it)"""
+        cursor = self.cursor
+        if cursor is not None and self.cursor_in_frames:
+            try:
+                draw_cursor(img, cursor[0], cursor[1])
+            except Exception:
+                # Cursor drawing failed, continue without cursor
+                pass
+        return img
+
+    def tier_shape(self, img, tier):
+        """Shape of a tier's image for a full-resolution image"""
+        scale_percent = self.quality_settings[tier]['scale']
+        return (int(img.shape[0] * scale_percent / 100), int(img.shape[1] * scale_percent / 100)) + img.shape[2:]
+
+    def resize_tier(self, img, tier, dst=None):
+        """Scale a full-resolution image down to a tier's size (into dst if given)"""
+        if self.quality_settings[tier]['scale'] == 100:
+            # Encoding does not modify the image, so no copy is needed
+            return img
+        height, width = self.tier_shape(img, tier)[:2]
+        return cv2.resize(img, (width, height), dst=dst, interpolation=cv2.INTER_AREA)  # Faster for downscaling
+
+    def encode_params(self, tier):
+        """cv2.imencode parameters of a tier"""
+        return [
+            int(cv2.IMWRITE_JPEG_QUALITY), self.quality_settings[tier]['jpeg_quality'],
+            int(cv2.IMWRITE_JPEG_OPTIMIZE), 1
+        ]
+
+    def encode_tier(self, tier_img, tier):
+        """JPEG-encode one tier image, returns bytes or None"""
+        result, encoded_img = cv2.imencode('.jpg', tier_img, self.encode_params(tier))
+        return encoded_img.tobytes() if result else None
+
+    def stage_resize(self, img, tiers):
+        """Produce one image per requested quality tier"""
+        with self.cache_lock:
+            self.last_image = img
+            self.last_image_generation = self.buffer_pool.generation
+        if self.tier_pyramid is not None:
+            self.last_tier_images = self.tier_pyramid.build(img, tiers, self.quality_settings, self.buffer_pool)
+            return self.last_tier_images
+        tier_images = {}
+        for tier in tiers:
+            if self.quality_settings[tier]['scale'] == 100:
+                tier_images[tier] = img
+            else:
+                tier_images[tier] = self.resize_tier(img, tier, self.buffer_pool.get(self.tier_shape(img, tier)))
+        self.last_tier_images = tier_images
+        return tier_images
+
+    def encode_workers(self):
+        """Pool size: one worker per tier, up to the CPU count"""
+        return max(1, min(len(self.quality_settings), os.cpu_count() or 1))
+
+    def stage_encode(self, tier_images):
+        """JPEG-encode every tier image (all at once with the threads/processes backends)
+
+        publish() swaps the whole set in together, so viewers never see a
+        mix of tiers from different frames.
+        """
+        tiers = list(tier_images)
+        frames = None
+        if self.encode_backend == 'processes' and tiers:
+            frames = self.encode_in_processes(tier_images, tiers)
+        if frames is None and self.encode_backend != 'serial' and len(tiers) > 1:
+            if self.encode_pool is None:
+                self.encode_pool = ThreadPoolExecutor(max_workers=self.encode_workers(), thread_name_prefix='tier-encode')
+            frames = list(self.encode_pool.map(lambda tier: self.encode_tier(tier_images[tier], tier), tiers))
+        if frames is None:
+            frames = [self.encode_tier(tier_images[tier], tier) for tier in tiers]
+        encoded = {tier: frame for tier, frame in zip(tiers, frames) if frame is not None}
+        self.performance_stats['tiers_encoded'] += len(encoded)
+        return encoded
+
+    def encode_in_processes(self, tier_images, tiers):
+        """Encode on the process pool; None (and threads from now on) if it cannot run"""
+        try:
+            if self.process_encoder is None:
+                if not PROCESS_ENCODER_AVAILABLE:
+                    raise RuntimeError("multiprocessing.shared_memory is not available")
+                self.process_encoder = ProcessEncoder(self.encode_workers())
+                print(f"[*] Encoding tiers in {self.process_encoder.workers} worker process(es)")
+            return self.process_encoder.encode([(tier_images[tier], self.encode_params(tier)) for tier in tiers])
+        except Exception as e:
+            print(f"[-] Process encoder failed ({e}), encoding on threads instead")
+            self.encode_backend = 'threads'
+            self.close_encoders()
+            return None
+
+    def close_encoders(self):
+        """Shut down the encode thread pool and worker processes"""
+        if self.encode_pool is not None:
+            self.encode_pool.shutdown(wait=False)
+            self.encode_pool = None
+        if self.process_encoder is not None:
+            try:
+                self.process_encoder.close()
+            except Exception as e:
+                print(f"[-] Could not stop encoder processes: {e}")
+            self.process_encoder = None
+
+    def publish(self, encoded):
+        """Swap the new tiers into the cache (and record changed tiles for delta viewers)"""
+        tile_tiers = self.tile_tiers()
+        with self.cache_lock:
+            self.swap_frame_set(FrameSet(self.frame_set.sequence + 1, self.capture_time, encoded), notify=True)
+            self.published_cursor_in_frames = self.cursor_in_frames
+            for tier in list(self.tile_trackers):
+                if tier not in tile_tiers or tier not in self.last_tier_images:
+                    del self.tile_trackers[tier]  # Would keep an image of a retired frame
+            for tier in tile_tiers:
+                tier_img = self.last_tier_images.get(tier)
+                if tier_img is not None:
+                    tracker = self.tile_trackers.setdefault(tier, TileTracker())
+                    tracker.update(tier_img, self.frame_set.sequence)
+            # Nothing current refers to the previous frame's images any more
+            self.buffer_pool.retire(self.frame_set.sequence - 1)
+        return encoded
+
+    def swap_frame_set(self, frame_set, notify=False):
+        """Make frame_set the current one (notify=True wakes wait_for_frame() callers)"""
+        with self.frame_condition:
+            self.frame_set = frame_set
+            if notify:
+                self.frame_condition.notify_all()
+
+    def encode_tier_now(self, tier):
+        """Encode a tier from the last captured image (viewer just switched to it)"""
+        with self.lazy_lock:
+            with self.cache_lock:
+                frame = self.frame_set.get(tier)
+                img = self.last_image
+                sequence = self.frame_set.sequence
+                generation = self.last_image_generation
+                if frame is not None or img is None:
+                    return frame
+                hold = self.buffer_pool.hold(generation)
+
+            try:
+                frame = self.encode_tier(self.resize_tier(img, tier), tier)
+            finally:
+                self.buffer_pool.release(hold)
+            self.performance_stats['lazy_tier_encodes'] += 1
+            with self.cache_lock:
+                # Only add it if no newer frame was published meanwhile
+                if frame is not None and self.frame_set.sequence == sequence:
+                    self.swap_frame_set(self.frame_set.with_tier(tier, frame))
+            return frame
+
+    def _timed(self, stage, func, *args):
+        start = time.perf_counter()
+        value = func(*args)
+        value = self._run_hooks(stage, value)
+        elapsed = time.perf_counter() - start
+        self.last_stage_times[stage] = elapsed
+        # Exponential moving average keeps the numbers stable but responsive
+        self.stage_times[stage] = self.stage_times[stage] * 0.9 + elapsed * 0.1
+        return value
+
+    def process_frame(self, source):
+        """Run one capture -> detect -> ... -> publish pass
+
+        Returns the published tiers, or None when the frame was identical
+        to the previous one (the cache and frame_sequence stay untouched).
+        """
+        screenshot = self._timed('capture', self.stage_capture, source)
+        changed = self._timed('detect', self.stage_detect, screenshot, source)
+        if not changed and self.last_image is not None:
+            for stage in ENGINE_STAGES[2:]:
+                self.last_stage_times[stage] = 0.0
+            return None
+
+        # Arrays taken from the pool from here on belong to this frame
+        self.buffer_pool.begin_frame(self.frame_set.sequence + 1)
+        img = self._timed('convert', self.stage_convert, screenshot)
+        img = self._timed('cursor', self.stage_cursor, img, source)
+        tier_images = self._timed('resize', self.stage_resize, img, self.active_tiers())
+        encoded = self._timed('encode', self.stage_encode, tier_images)
+        return self._timed('publish', self.publish, encoded)
+
+    # ------------------------------------------------------------------
+    # Capture loop
+    # ------------------------------------------------------------------
+    def capture_loop(self):
+        """Optimized screen capture with multi-user performance enhancements"""
+        source = create_capture_source(self.capture_source)
+        self.source = source
+        frame_count = 0
+
+        try:
+            source.open()
+        except Exception as e:
+            print(f"[-] Could not open capture source: {e}")
+            self.running = False
+            return
+
+        print("[*] Starting optimized capture loop for multi-user performance")
+        print(f"[*] Capture source: {source.describe()}")
+
+        while self.running:
+            # Nobody watching: park until the first viewer subscribes
+            if not self.viewers_event.is_set():
+                self.wait_while_idle()
+                continue
+
+            capture_start = time.time()
+
+            try:
+                # Dynamic FPS adjustment based on user count
+                active_count = self.viewer_count()
+                self.adaptive_fps = adaptive_fps_for(active_count)
+
+                self.process_frame(source)
+
+                # Performance tracking
+                capture_time = time.time() - capture_start
+                frame_count += 1
+
+                # Update stats every 100 frames
+                if frame_count % 100 == 0:
+                    self.performance_stats['frames_captured'] = frame_count
+                    self.performance_stats['avg_frame_time'] = capture_time
+                    self.performance_stats['stage_times_ms'] = {
+                        stage: round(seconds * 1000, 2) for stage, seconds in self.stage_times.items()
+                    }
+
+                    if active_count > 0:
+                        stages = ', '.join(f"{stage} {seconds * 1000:.1f}"
+                                           for stage, seconds in self.stage_times.items())
+                        print(f"[📊] Performance: {active_count} viewers, "
+                              f"{self.adaptive_fps} FPS, "
+                              f"{capture_time*1000:.1f}ms/frame ({stages}), "
+                              f"{self.skip_ratio() * 100:.0f}% unchanged")
+
+                # Dynamic sleep based on adaptive FPS (request_frame() wakes us early)
+                sleep_time = max(0, (1.0 / self.adaptive_fps) - capture_time)
+                if sleep_time > 0:
+                    self.wake_event.wait(sleep_time)
+                self.wake_event.clear()
+
+            except Exception as e:
+                print(f"[-] Error capturing screen: {e}")
+                time.sleep(1)
+
+        source.close()
+        self.source = None
+        self.close_encoders()
+        print("[*] Screen capture loop ended")
+
+    def wait_while_idle(self):
+        """Do no capture work until a viewer subscribes (or the engine stops)"""
+        self.idle = True
+        # Drop frames now so nobody is served an hours-old screen on resume
+        with self.cache_lock:
+            self.swap_frame_set(FrameSet(self.frame_set.sequence))
+            self.last_image = None
+            self.last_tier_images = {}
+            self.tile_trackers = {}
+            self.published_cursor_in_frames = None
+        self.change_detector.reset()
+        self.buffer_pool.clear()
+        print("[💤] No viewers - capture paused until someone connects")
+
+        idle_start = time.time()
+        self.viewers_event.wait()
+
+        self.performance_stats['idle_seconds'] += time.time() - idle_start
+        self.idle = False
+        # Loop continues straight into a capture, so the first frame is ready
+        # within one frame interval of the subscription
+        self.wake_event.clear()
+        if self.running:
+            print("[*] Viewer connected - capture resumed")
+
+    # ------------------------------------------------------------------
+    # Frame access
+    # ------------------------------------------------------------------
+    def get_frame(self, tier):
+        """Latest JPEG bytes for a tier, or None before the first frame"""
+        return self.get_frame_with_sequence(tier)[0]
+
+    def get_frame_with_sequence(self, tier):
+        """Latest JPEG bytes for a tier plus the frame_sequence they belong to
+
+        Stream loops remember the (tier, sequence) they sent last and skip
+        sending until either changes.
+        """
+        tier = tier.lower()
+        frame_set = self.frame_set  # Never modified after publish: no lock needed
+        frame, sequence = frame_set.get(tier), frame_set.sequence
+        if frame is None and tier in self.quality_settings:
+            frame = self.encode_tier_now(tier)
+        return frame, sequence
+
+    def get_mjpeg_part_with_sequence(self, tier):
+        """Latest tier as a prebuilt MJPEG part plus its frame_sequence (see get_frame_with_sequence)"""
+        tier = tier.lower()
+        frame_set = self.frame_set
+        part = frame_set.mjpeg_part(tier)
+        if part is not None:
+            return part, frame_set.sequence
+        frame, sequence = self.get_frame_with_sequence(tier)  # Encodes the tier on demand
+        if frame is None:
+            return None, sequence
+        frame_set = self.frame_set
+        if frame_set.sequence == sequence and frame_set.get(tier) is frame:
+            return frame_set.mjpeg_part(tier), sequence
+        return mjpeg_part(frame), sequence
+
+    def frame_timestamp(self, sequence):
+        """time.time() of the capture of frame `sequence`, 0.0 once it is no longer the current one"""
+        frame_set = self.frame_set
+        return frame_set.timestamp if frame_set.sequence == sequence else 0.0
+
+    def wait_for_frame(self, after, timeout=None):
+        """Block until a FrameSet newer than sequence `after` is published (or the timeout)
+
+        Returns the current FrameSet either way. Stream loops pass the
+        sequence they sent last, so every frame goes out once, right after
+        it is encoded.
+        """
+        with self.frame_condition:
+            self.frame_condition.wait_for(lambda: self.frame_set.sequence > after, timeout)
+            return self.frame_set
+
+    @property
+    def frame_sequence(self):
+        """Sequence of the current FrameSet (incremented on every publish)"""
+        return self.frame_set.sequence
+
+    @property
+    def frame_cache(self):
+        """Tier -> JPEG bytes of the current FrameSet (read-only)"""
+        return self.frame_set.frames
+
+    def get_tile_update(self, tier, since=None):
+        """Changes of a tier since frame `since`, for delta viewers
+
+        Returns (update, sequence). update is None when nothing changed,
+        {'type': 'keyframe', 'sequence', 'data'} with a full JPEG, or
+        {'type': 'tiles', 'sequence', 'size', 'copies', 'tiles'} where copies
+        is a list of (src_x, src_y, width, height, dst_x, dst_y) regions to
+        move within the viewer's canvas first (scrolling) and tiles a list
+        of (x, y, JPEG). since=None asks for a keyframe.
+        """
+        tier = tier.lower()
+        with self.cache_lock:
+            tracker = self.tile_trackers.get(tier)
+            current = self.frame_set.sequence
+            if tracker is not None and tracker.image is not None:
+                image, versions = tracker.image, tracker.versions
+                sequence, start = tracker.sequence, tracker.start_sequence
+                copy = tracker.copy
+                hold = self.buffer_pool.hold(sequence)  # Its arrays stay as they are while tiles are encoded from it
+            else:
+                image = None
+
+        try:
+            if since is not None and since >= current:
+                return None, current
+
+            if image is None or since is None or since < start:
+                # Tracking just started (or the viewer is too far behind)
+                return self._keyframe_update(tier)
+
+            copies = []
+            if copy is not None and copy['base'] == since:
+                # Viewer has the frame right before a scroll: move, then patch the rest
+                copies.append(copy['rect'])
+                changed = np.argwhere(copy['residual'])
+            else:
+                changed = np.argwhere(versions > since)
+            if len(changed) > DELTA_KEYFRAME_RATIO * versions.size:
+                return self._keyframe_update(tier)
+
+            tiles = []
+            with self.tiles_lock:
+                for row, col in changed:
+                    version = versions[row, col]
+                    cached = tracker.encoded_tiles.get((row, col))
+                    if cached is not None and cached[0] == version:
+                        data = cached[1]
+                    else:
+                        y, x = row * tracker.tile_size, col * tracker.tile_size
+                        data = self.encode_tier(image[y:y + tracker.tile_size, x:x + tracker.tile_size], tier)
+                        if data is None:
+                            continue
+                        self.performance_stats['tiles_encoded'] += 1
+                        if cached is None or cached[0] < version:
+                            tracker.encoded_tiles[(row, col)] = (version, data)
+                    tiles.append((int(col) * tracker.tile_size, int(row) * tracker.tile_size, data))
+
+            # Many small JPEGs can outweigh one full frame (e.g. scrolling on a scaled tier)
+            frame_set = self.frame_set
+            full_frame = frame_set.get(tier) if frame_set.sequence == sequence else None
+            if full_frame is not None and sum(len(data) for _, _, data in tiles) > len(full_frame):
+                return self._keyframe_update(tier)
+
+            self.performance_stats['tile_updates'] += 1
+            update = {
+                'type': 'tiles',
+                'sequence': sequence,
+                'size': (image.shape[1], image.shape[0]),
+                'copies': copies,
+                'tiles': tiles
+            }
+            return update, sequence
+        finally:
+            if image is not None:
+                self.buffer_pool.release(hold)
+
+    def _keyframe_update(self, tier):
+        frame, sequence = self.get_frame_with_sequence(tier)
+        if frame is None:
+            return None, sequence
+        self.performance_stats['delta_keyframes'] += 1
+        return {'type': 'keyframe', 'sequence': sequence, 'data': frame}, sequence
+
+    def get_cursor(self, tier):
+        """Cursor message in a tier's pixel coordinates plus the cursor_sequence it belongs to"""
+        self.poll_cursor(self.source)
+        with self.cursor_lock:
+            cursor = self.cursor
+            sequence = self.cursor_sequence
+        if cursor is None:
+            return {'type': 'cursor', 'x': 0, 'y': 0, 'visible': False}, sequence
+        scale = self.quality_settings[tier.lower()]['scale'] / 100
+        return {'type': 'cursor', 'x': int(cursor[0] * scale), 'y': int(cursor[1] * scale), 'visible': True}, sequence
+
+    def skip_ratio(self):
+        """Fraction of captured frames that were unchanged and skipped"""
+        checked = self.performance_stats['frames_checked']
+        return self.performance_stats['frames_unchanged'] / checked if checked else 0.0
+
+    def screen_size(self):
+        """(width, height) of the captured screen, (0, 0) while no source is open"""
+        source = self.source
+        if source is None:
+            return 0, 0
+        return source.monitor['width'], source.monitor['height']
+
+    def get_performance_stats(self):
+        """Snapshot of capture statistics (merged into the servers' stats)"""
+        stats = dict(self.performance_stats)
+        stats['screen_size'] = list(self.screen_size())
+        stats['adaptive_fps'] = self.adaptive_fps
+        stats['active_tiers'] = sorted(self.active_tiers())
+        stats['capture_idle'] = self.idle
+        stats['skip_ratio'] = round(self.skip_ratio(), 3)
+        stats['buffer_allocations'] = self.buffer_pool.allocations
+        stats['encode_backend'] = self.encode_backend
+        if self.tier_pyramid is not None:
+            stats['tier_pyramid'] = self.tier_pyramid.describe()
+        stats['stage_times_ms'] = {
+            stage: round(seconds * 1000, 2) for stage, seconds in self.stage_times.items()
+        }
+        return stats
+
+
+class DeltaViewer:
+    """Delta protocol state of one viewer: the frame it has and when it got a keyframe"""
+
+    def __init__(self, engine, keyframe_interval=30.0):
+        self.engine = engine
+        self.keyframe_interval = keyframe_interval  # Seconds between forced keyframes
+        self.since = None  # Sequence of the frame the viewer has (None = needs a keyframe)
+        self.epoch = engine.epoch  # Epoch `since` belongs to
+        self.last_keyframe_time = 0
+        self.last_send_time = 0
+
+    def request_keyframe(self):
+        """Next update is a full keyframe (new tier, lost sync, client request)"""
+        self.since = None
+
+    def next_update(self, tier):
+        """Next message for the viewer, or None when there is nothing to send"""
+        now = time.time()
+        if now - self.last_keyframe_time >= self.keyframe_interval or self.engine.epoch != self.epoch:
+            # Periodic keyframe, or sequences restarted: the viewer's frame is not comparable
+            self.epoch = self.engine.epoch
+            self.since = None
+        update, sequence = self.engine.get_tile_update(tier, self.since)
+        if update is None:
+            if self.since is None or now - self.last_send_time < KEEPALIVE_INTERVAL:
+                return None
+            # Screen unchanged: a tiny message keeps the connection exercised
+            update = {'type': 'keepalive', 'sequence': self.since}
+        return update
+
+    def sent(self, update):
+        """Record that an update reached the viewer"""
+        self.last_send_time = time.time()
+        if update['type'] == 'keyframe':
+            self.last_keyframe_time = self.last_send_time
+        self.since = update['sequence']
+
+
+class CursorFeed:
+    """Cursor updates for one viewer that draws the pointer itself"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.last_sent = None  # (tier, cursor_sequence) the viewer has
+        self.epoch = engine.epoch
+
+    def reset(self):
+        """Send the current position again (new connection or tier)"""
+        self.last_sent = None
+
+    def next_update(self, tier):
+        """Cursor message if the pointer moved since the last one, else None"""
+        if self.engine.epoch != self.epoch:
+            self.epoch = self.engine.epoch
+            self.reset()
+        message, sequence = self.engine.get_cursor(tier)
+        if (tier, sequence) == self.last_sent:
+            return None
+        self.last_sent = (tier, sequence)
+        self.engine.performance_stats['cursor_updates'] += 1
+        return message
+
+
+class ViewerLink:
+    """Outbound slot and traffic counters of one viewer connection
+
+    A viewer has at most one message in flight. While it drains, newer
+    frames are not queued (drop policy: the viewer gets the newest frame
+    once the slot is free, the frames in between count as dropped). A
+    slot that stops draining for STALL_TIMEOUT marks the viewer stalled.
+    """
+
+    def __init__(self):
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.bytes_sent = 0
+        self.pending = 0  # Bytes of the message in flight the socket has not taken yet
+        self.last_sent = None  # (tier, sequence) of the last frame put in the slot
+        self.epoch = 0  # Engine epoch of last_sent
+        self.last_progress = time.time()
+        self.drain_rate = 0.0  # Bytes per second the socket takes, smoothed
+        self.rate_bytes = 0
+        self.rate_start = self.last_progress
+
+    def queue(self, size, tier=None, sequence=None):
+        """Put a message in the slot (the slot must be free)"""
+        if (sequence is not None and self.last_sent is not None
+                and self.last_sent[0] == tier and sequence > self.last_sent[1] + 1):
+            self.frames_dropped += sequence - self.last_sent[1] - 1
+        if sequence is not None:
+            self.last_sent = (tier, sequence)
+        self.pending = size
+        self.last_progress = time.time()
+
+    def sync_epoch(self, epoch):
+        """Forget the last frame sent once frame sequences restarted (new engine epoch)"""
+        if epoch != self.epoch:
+            self.epoch = epoch
+            self.last_sent = None
+
+    def progress(self, nbytes):
+        """The socket took nbytes of the message in flight"""
+        if nbytes <= 0:
+            return
+        now = time.time()
+        self.pending = max(self.pending - nbytes, 0)
+        self.bytes_sent += nbytes
+        self.last_progress = now
+        self.rate_bytes += nbytes
+        elapsed = now - self.rate_start
+        if elapsed >= 1.0:
+            rate = self.rate_bytes / elapsed
+            self.drain_rate = rate if not self.drain_rate else (self.drain_rate + rate) / 2
+            self.rate_bytes = 0
+            self.rate_start = now
+
+    def stalled(self, now=None):
+        """True once the message in flight made no progress for STALL_TIMEOUT"""
+        return self.pending > 0 and (now or time.time()) - self.last_progress >= STALL_TIMEOUT
+
+    def link_stats(self):
+        now = time.time()
+        return {
+            'frames_sent': self.frames_sent,
+            'frames_dropped': self.frames_dropped,
+            'bytes_sent': self.bytes_sent,
+            'drain_rate_kbps': round(self.drain_rate * 8 / 1000, 1),
+            'pending_bytes': self.pending,
+            'stalled_seconds': round(now - self.last_progress, 1) if self.pending else 0
+        }
+
+
+def update_to_json(update):
+    """JSON-safe copy of a delta update (JPEG bytes as base64) for web viewers"""
+    message = dict(update)
+    if 'data' in message:
+        message['data'] = base64.b64encode(message['data']).decode('ascii')
+    if 'tiles' in message:
+        message['tiles'] = [(x, y, base64.b64encode(data).decode('ascii')) for x, y, data in message['tiles']]
+    if 'copies' in message:
+        message['copies'] = [[int(value) for value in rect] for rect in message['copies']]
+    return message
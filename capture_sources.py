@@ -0,0 +1,419 @@
+"""
+Capture sources for the screen share pipeline
+The real screen (mss) is one source; synthetic and file-backed sources
+let the pipeline be benchmarked and load-tested on headless machines
+at fixed, reproducible resolutions.
+"""
+
+import os
+import glob
+import cv2
+import numpy as np
+
+# mss is only needed for real screen capture
+try:
+    from mss import mss
+    MSS_AVAILABLE = True
+except ImportError:
+    MSS_AVAILABLE = False
+
+# Import for cursor capture (cross-platform)
+try:
+    import pyautogui
+    CURSOR_AVAILABLE = True
+except Exception:
+    # pyautogui raises more than ImportError on headless machines (no display)
+    CURSOR_AVAILABLE = False
+    print("[!] Warning: pyautogui not installed. Cursor won't be visible. Install with: pip install pyautogui")
+
+# Environment variable used to pick the capture source without code changes
+# e.g. SCREENSHARE_CAPTURE_SOURCE=pattern:4k python main.py
+CAPTURE_SOURCE_ENV = 'SCREENSHARE_CAPTURE_SOURCE'
+
+# Fixed resolutions for reproducible benchmarks
+RESOLUTIONS = {
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+    '1440p': (2560, 1440),
+    '4k': (3840, 2160)
+}
+
+
+def parse_resolution(value, default='1080p'):
+    """Parse '1080p', '4k' or '1920x1080' into a (width, height) tuple"""
+    if value is None or value == '':
+        value = default
+    if isinstance(value, (tuple, list)):
+        return int(value[0]), int(value[1])
+
+    value = str(value).strip().lower()
+    if value in RESOLUTIONS:
+        return RESOLUTIONS[value]
+    if 'x' in value:
+        width, height = value.split('x', 1)
+        return int(width), int(height)
+    raise ValueError(f"Unknown resolution '{value}'. Use one of {list(RESOLUTIONS.keys())} or WIDTHxHEIGHT")
+
+
+class CaptureSource:
+    """Base class for everything that can feed frames into the capture loop
+
+    grab() returns a BGRA uint8 array of shape (height, width, 4), the same
+    layout mss produces, so the rest of the pipeline does not care where
+    the pixels came from.
+    """
+    name = 'base'
+
+    def __init__(self):
+        # Geometry of the captured area in desktop coordinates
+        self.monitor = {'left': 0, 'top': 0, 'width': 0, 'height': 0}
+
+    def open(self):
+        """Prepare the source (called from the capture thread)"""
+        pass
+
+    def grab(self):
+        """Return the next frame as a BGRA numpy array
+
+        The array may be a view of a buffer the source reuses: it is only
+        valid until the next grab() and must not be modified.
+        """
+        raise NotImplementedError
+
+    def cursor_position(self):
+        """Return the cursor position relative to the captured area, or None"""
+        return None
+
+    def close(self):
+        """Release any resources held by the source"""
+        pass
+
+    def describe(self):
+        """Short human readable description for logs"""
+        return f"{self.name} {self.monitor['width']}x{self.monitor['height']}"
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MSSCaptureSource(CaptureSource):
+    """Real screen capture through mss"""
+    name = 'screen'
+
+    def __init__(self, monitor_index=1):
+        super().__init__()
+        self.monitor_index = monitor_index
+        self.sct = None
+
+    def open(self):
+        if not MSS_AVAILABLE:
+            raise RuntimeError("mss is not installed. Install with: pip install mss")
+        # mss handles are thread bound on some platforms, so create it here
+        self.sct = mss()
+        self.monitor = dict(self.sct.monitors[self.monitor_index])
+
+    def grab(self):
+        if self.sct is None:
+            self.open()
+        screenshot = self.sct.grab(self.monitor)
+        # Wrap mss' BGRA buffer instead of copying it (np.array() would)
+        return np.frombuffer(screenshot.raw, dtype=np.uint8).reshape(screenshot.height, screenshot.width, 4)
+
+    def cursor_position(self):
+        if not CURSOR_AVAILABLE:
+            return None
+        try:
+            cursor_x, cursor_y = pyautogui.position()
+        except Exception:
+            return None
+        # Adjust cursor position relative to monitor
+        return cursor_x - self.monitor['left'], cursor_y - self.monitor['top']
+
+    def close(self):
+        if self.sct is not None:
+            try:
+                self.sct.close()
+            except Exception:
+                pass
+            self.sct = None
+
+
+class PatternCaptureSource(CaptureSource):
+    """Generated moving content at a fixed resolution
+
+    mode='pattern' scrolls colour bars horizontally with a bouncing box,
+    mode='text' scrolls lines of code-like text vertically (worst case for
+    text-heavy screens), mode='office' keeps a static page of text while a
+    line is typed with a blinking caret (typical office workload). All are
+    deterministic frame by frame.
+    """
+    name = 'pattern'
+
+    def __init__(self, resolution='1080p', mode='pattern', speed=8):
+        super().__init__()
+        if mode not in ('pattern', 'text', 'office'):
+            raise ValueError("mode must be 'pattern', 'text' or 'office'")
+        self.width, self.height = parse_resolution(resolution)
+        self.mode = mode
+        self.name = mode
+        self.speed = speed
+        self.frame_index = 0
+        self.strip = None
+        self.frame = None  # Reused output buffer for modes that draw on top of the strip
+        self.monitor = {'left': 0, 'top': 0, 'width': self.width, 'height': self.height}
+
+    def open(self):
+        # Render a double-size strip once; every frame is a window into it
+        if self.strip is not None:
+            return
+        if self.mode in ('text', 'office'):
+            self.strip = self._render_text_strip()
+        else:
+            self.strip = self._render_pattern_strip()
+        self.frame = np.empty((self.height, self.width, 4), dtype=np.uint8)
+
+    def _render_pattern_strip(self):
+        """Colour bars repeated twice horizontally so the window can wrap around"""
+        tile = np.zeros((self.height, self.width, 4), dtype=np.uint8)
+        colors = [
+            (255, 255, 255), (0, 255, 255), (255, 255, 0), (0, 255, 0),
+            (255, 0, 255), (0, 0, 255), (255, 0, 0), (40, 40, 40)
+        ]
+        bar_width = -(-self.width // len(colors))
+        for i, color in enumerate(colors):
+            tile[:, i * bar_width:(i + 1) * bar_width, :3] = color
+        # Gradient band in the lower third
+        gradient = np.linspace(0, 255, self.width, dtype=np.uint8)
+        band_top = self.height * 2 // 3
+        tile[band_top:, :, 0] = gradient
+        tile[band_top:, :, 1] = gradient[::-1]
+        tile[band_top:, :, 2] = 128
+        tile[:, :, 3] = 255
+        return np.concatenate([tile, tile], axis=1)
+
+    def _render_text_strip(self):
+        """Lines of code-like text repeated twice vertically"""
+        tile = np.full((self.height, self.width, 4), 30, dtype=np.uint8)
+        tile[:, :, 3] = 255
+        line_height = 24
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        words = ['def', 'capture', 'frame', 'return', 'self', 'encode', 'quality',
+                 'import', 'numpy', 'while', 'sharing', 'for', 'in', 'range', 'lock']
+        for line in range(self.height // line_height):
+            indent = (line % 4) * 4
+            text = ' ' * indent + ' '.join(words[(line * 7 + i) % len(words)] for i in range(6 + line % 5))
+            color = (200, 200, 200, 255) if line % 3 else (120, 200, 255, 255)
+            cv2.putText(tile, f"{line + 1:4d}  {text}", (10, (line + 1) * line_height - 6),
+                        font, 0.6, color, 1, cv2.LINE_AA)
+        return np.concatenate([tile, tile], axis=0)
+
+    def grab(self):
+        if self.strip is None:
+            self.open()
+        offset = self.frame_index * self.speed
+        self.frame_index += 1
+
+        if self.mode == 'text':
+            # Whole rows of the strip: already contiguous, no copy needed
+            y = offset % self.height
+            frame = self.strip[y:y + self.height]
+        elif self.mode == 'office':
+            frame = self.frame
+            np.copyto(frame, self.strip[:self.height])
+            self._draw_typing(frame)
+        else:
+            x = offset % self.width
+            frame = self.frame
+            np.copyto(frame, self.strip[:, x:x + self.width])
+            # Bouncing box so the content is not a pure translation
+            box = max(16, self.height // 8)
+            span_x = max(1, self.width - box)
+            span_y = max(1, self.height - box)
+            bx = abs((self.frame_index * 7) % (2 * span_x) - span_x)
+            by = abs((self.frame_index * 5) % (2 * span_y) - span_y)
+            frame[by:by + box, bx:bx + box, :3] = (0, 0, 0)
+        return frame
+
+    def _draw_typing(self, frame):
+        """A line being typed (one character every other frame) plus a blinking caret"""
+        sentence = "the quick brown fox jumps over the lazy dog while the meeting notes are written "
+        line_y = self.height // 2
+        typed = sentence[:(self.frame_index // 2) % len(sentence)]
+        frame[line_y - 20:line_y + 6, 10:, :3] = 30
+        cv2.putText(frame, typed, (10, line_y), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                    (255, 255, 255, 255), 1, cv2.LINE_AA)
+        if (self.frame_index // 10) % 2 == 0:
+            caret_x = 12 + cv2.getTextSize(typed, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 1)[0][0]
+            frame[line_y - 16:line_y + 4, caret_x:caret_x + 2, :3] = 255
+
+    def cursor_position(self):
+        # Deterministic cursor path (a slow circle around the centre)
+        angle = self.frame_index * 0.05
+        radius = min(self.width, self.height) // 4
+        return (int(self.width / 2 + radius * np.cos(angle)),
+                int(self.height / 2 + radius * np.sin(angle)))
+
+    def describe(self):
+        return f"{self.mode} {self.width}x{self.height}"
+
+
+class ImageSequenceCaptureSource(CaptureSource):
+    """Cycles through a set of image files (screenshots, slides)"""
+    name = 'images'
+
+    IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+    def __init__(self, path, resolution=None, frames_per_image=1, loop=True):
+        super().__init__()
+        self.path = path
+        self.resolution = parse_resolution(resolution) if resolution else None
+        self.frames_per_image = max(1, int(frames_per_image))
+        self.loop = loop
+        self.frames = []
+        self.frame_index = 0
+
+    def _list_files(self):
+        if os.path.isdir(self.path):
+            files = [os.path.join(self.path, name) for name in os.listdir(self.path)]
+        else:
+            files = glob.glob(self.path)
+        return sorted(f for f in files if f.lower().endswith(self.IMAGE_EXTENSIONS))
+
+    def open(self):
+        if self.frames:
+            return
+        for file_path in self._list_files():
+            img = cv2.imread(file_path, cv2.IMREAD_COLOR)
+            if img is None:
+                print(f"[!] Could not read image {file_path}, skipping")
+                continue
+            if self.resolution is None:
+                self.resolution = (img.shape[1], img.shape[0])
+            if (img.shape[1], img.shape[0]) != self.resolution:
+                img = cv2.resize(img, self.resolution, interpolation=cv2.INTER_AREA)
+            self.frames.append(cv2.cvtColor(img, cv2.COLOR_BGR2BGRA))
+
+        if not self.frames:
+            raise RuntimeError(f"No readable images found for '{self.path}'")
+        self.monitor = {'left': 0, 'top': 0, 'width': self.resolution[0], 'height': self.resolution[1]}
+
+    def grab(self):
+        if not self.frames:
+            self.open()
+        index = self.frame_index // self.frames_per_image
+        if index >= len(self.frames):
+            if not self.loop:
+                index = len(self.frames) - 1
+            else:
+                self.frame_index = 0
+                index = 0
+        self.frame_index += 1
+        # The pipeline draws into its converted copy, never into this frame
+        return self.frames[index]
+
+    def describe(self):
+        return f"images '{self.path}' ({len(self.frames)} files) {self.monitor['width']}x{self.monitor['height']}"
+
+
+class VideoFileCaptureSource(CaptureSource):
+    """Reads frames from a video file through cv2.VideoCapture"""
+    name = 'video'
+
+    def __init__(self, path, resolution=None, loop=True):
+        super().__init__()
+        self.path = path
+        self.resolution = parse_resolution(resolution) if resolution else None
+        self.loop = loop
+        self.capture = None
+        self.last_frame = None
+        # Decode, resize and convert into the same arrays every frame
+        self.read_buffer = None
+        self.resize_buffer = None
+
+    def open(self):
+        if self.capture is not None:
+            return
+        self.capture = cv2.VideoCapture(self.path)
+        if not self.capture.isOpened():
+            self.capture = None
+            raise RuntimeError(f"Could not open video file '{self.path}'")
+        if self.resolution is None:
+            self.resolution = (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                               int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        self.monitor = {'left': 0, 'top': 0, 'width': self.resolution[0], 'height': self.resolution[1]}
+
+    def grab(self):
+        if self.capture is None:
+            self.open()
+        ok, frame = self.capture.read(self.read_buffer)
+        if not ok and self.loop:
+            # Rewind and try again
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.capture.read(self.read_buffer)
+        if not ok:
+            if self.last_frame is None:
+                raise RuntimeError(f"Video file '{self.path}' has no readable frames")
+            return self.last_frame
+        self.read_buffer = frame
+
+        if (frame.shape[1], frame.shape[0]) != self.resolution:
+            frame = self.resize_buffer = cv2.resize(frame, self.resolution, dst=self.resize_buffer,
+                                                    interpolation=cv2.INTER_AREA)
+        self.last_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=self.last_frame)
+        return self.last_frame
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def describe(self):
+        return f"video '{self.path}' {self.monitor['width']}x{self.monitor['height']}"
+
+
+def create_capture_source(spec=None):
+    """Create a capture source from a spec string
+
+    Supported specs:
+        screen / screen:2        real monitor through mss (default: monitor 1)
+        pattern[:1080p]          moving colour bars
+        text[:4k]                scrolling code-like text
+        office[:1080p]           static text page with typing and a blinking caret
+        images:<dir or glob>[@1440p]
+        video:<file>[@1080p]
+    Without a spec the SCREENSHARE_CAPTURE_SOURCE environment variable is
+    used, falling back to the real screen.
+    """
+    if spec is None:
+        spec = os.environ.get(CAPTURE_SOURCE_ENV, '') or 'screen'
+    if isinstance(spec, CaptureSource):
+        return spec
+
+    kind, _, argument = spec.strip().partition(':')
+    kind = kind.lower()
+
+    if kind == 'screen':
+        return MSSCaptureSource(int(argument) if argument else 1)
+    if kind in ('pattern', 'text', 'office'):
+        return PatternCaptureSource(argument or '1080p', mode=kind)
+    if kind in ('images', 'video'):
+        if not argument:
+            raise ValueError(f"'{kind}' source needs a path, e.g. {kind}:path/to/files")
+        path, resolution = argument, None
+        # Optional @resolution suffix, only when it parses as one
+        if '@' in argument:
+            candidate_path, _, candidate_res = argument.rpartition('@')
+            try:
+                parse_resolution(candidate_res)
+                path, resolution = candidate_path, candidate_res
+            except ValueError:
+                pass
+        if kind == 'images':
+            return ImageSequenceCaptureSource(path, resolution)
+        return VideoFileCaptureSource(path, resolution)
+
+    raise ValueError(f"Unknown capture source '{spec}'")
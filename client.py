@@ -1,11 +1,144 @@
 import socket
-import pickle
 import struct
+import threading
 import cv2
 import numpy as np
 import time
 import os
 import sys
+from wire_format import (SELECTED_PREFIX, WIRE_COMMAND, WIRE_MAGIC, HEADER_SIZE, decode_header, decode_message,
+                         hello_line, is_wire_message, loads_legacy, parse_line)
+
+# Initial size of the receive buffer; it grows to the largest message seen
+RECEIVE_BUFFER_SIZE = 2 * 1024 * 1024
+LEGACY_LENGTH = struct.Struct("L")  # Length prefix of pickled messages from older servers
+
+# Tile updates waiting for the decode thread beyond this are dropped in
+# favour of a keyframe (a new picture needs no backlog)
+MAX_PENDING_UPDATES = 4
+# The display loop checks for a decoded frame / window events this often
+DISPLAY_INTERVAL = 0.01
+
+# Window size changes are picked up this often (the query is not free on
+# every platform, and layout is only recomputed when it changed)
+WINDOW_POLL_INTERVAL = 0.25
+
+# JPEG decode reductions: libjpeg scales down while decoding, several times
+# faster than decoding at full size and shrinking afterwards
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def message_type(message):
+    """'frame' for a legacy full frame (numpy array), else the message's type"""
+    return message.get('type') if isinstance(message, dict) else 'frame'
+
+
+class ReceiveBuffer:
+    """Reusable, growable buffer filled with recv_into()
+    
+    Bytes land in one preallocated bytearray with as large a read as the
+    free space allows, and messages are handed out as memoryviews of it, so
+    a frame is never concatenated or sliced into a new bytes object. A
+    view stays valid until the next fill(); unread bytes are moved to the
+    front (or into a bigger buffer) only when a message would not fit.
+    
+    With keep_views set (messages handed to another thread) received bytes
+    are never overwritten while a message may still point at them: unread
+    bytes move into another array instead, and the old one is retired until
+    the reader calls release() for every message handed out from it. Then
+    it is reused, so a pipeline alternates between a couple of arrays
+    rather than allocating one per wrap.
+    """
+    
+    def __init__(self, size=RECEIVE_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First unread byte
+        self.end = 0  # End of received data
+        self.keep_views = False
+        self.handed_out = 0  # Messages consumed so far
+        self.retired = []  # (array, handed_out when it was given up) still in use by the reader
+        self.spare = []  # Released arrays, reused by the next wrap
+        self.allocations = 1
+        self.lock = threading.Lock()  # retired / spare: release() runs on the reader's thread
+    
+    def __len__(self):
+        return self.end - self.start
+    
+    def clear(self):
+        self.start = self.end = 0
+    
+    def feed(self, data):
+        """Append bytes that were read some other way (handshake leftovers)"""
+        self.reserve(len(self) + len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+    
+    def reserve(self, size):
+        """Make sure size unread bytes fit behind self.start"""
+        if self.start + size <= len(self.buffer):
+            return
+        unread = len(self)
+        if size <= len(self.buffer) and not self.keep_views:
+            self.view[:unread] = self.view[self.start:self.end]
+        else:
+            # Another buffer instead of resizing: views of the old one stay intact
+            capacity = len(self.buffer) if size <= len(self.buffer) else max(size, 2 * len(self.buffer))
+            buffer = self.take(capacity)
+            buffer[:unread] = self.view[self.start:self.end]
+            if self.keep_views:
+                with self.lock:
+                    self.retired.append((self.buffer, self.handed_out))
+            self.buffer, self.view = buffer, memoryview(buffer)
+        self.start, self.end = 0, unread
+    
+    def take(self, capacity):
+        """A released array of at least capacity bytes, or a new one"""
+        with self.lock:
+            while self.spare:
+                buffer = self.spare.pop()
+                if len(buffer) >= capacity:
+                    return buffer
+        self.allocations += 1
+        return bytearray(capacity)
+    
+    def release(self, handed_out):
+        """The reader is done with the first handed_out messages: their arrays can be reused"""
+        with self.lock:
+            retired = []
+            for buffer, last in self.retired:
+                if last > handed_out:
+                    retired.append((buffer, last))
+                elif len(buffer) >= len(self.buffer) and not self.spare:
+                    self.spare.append(buffer)  # One spare is enough to alternate
+            self.retired = retired
+    
+    def fill(self, sock, size):
+        """Receive until at least size unread bytes are buffered"""
+        if len(self) >= size:
+            return
+        self.reserve(size)
+        while len(self) < size:
+            received = sock.recv_into(self.view[self.end:])
+            if not received:
+                raise ConnectionResetError("Connection lost to server")
+            self.end += received
+    
+    def peek(self, size, offset=0):
+        """View of size unread bytes starting offset bytes in (no copy)"""
+        return self.view[self.start + offset:self.start + offset + size]
+    
+    def consume(self, size):
+        self.start += size
+        self.handed_out += 1
+        if self.start == self.end and not self.keep_views:
+            self.clear()  # Empty: the next message starts at the front again
+
 
 class ScreenShareClient:
     def __init__(self):
@@ -21,6 +154,7 @@ class ScreenShareClient:
         
         # Multi-user optimized quality system
         self.quality = "MEDIUM"  # Default quality
+        # Client-side detail: lower levels let choose_reduction() decode smaller
         self.quality_scales = {
             'LOW': 0.6,      # 60% scale for bandwidth conservation
             'MEDIUM': 0.8,   # 80% scale for balanced performance
@@ -30,6 +164,48 @@ class ScreenShareClient:
         self.show_quality_menu = False
         self.quality_menu_rect = None
         
+        # Delta mode: server sends only changed tiles, patched into a persistent canvas
+        self.delta_mode = True
+        self.canvas = None
+        self.keyframe_requested = False
+        
+        # Cursor channel: the server sends pointer positions, we draw the cursor
+        # (older servers keep drawing it into the frames)
+        self.cursor_channel = True
+        self.cursor = None  # (x, y) in frame pixels, None = hidden / not received yet
+        
+        # Binary wire format: raw JPEG behind a fixed header instead of pickled
+        # messages (older servers ignore the request and keep pickling)
+        self.wire_format = True
+        
+        # Capability handshake: HELLO after APPROVED, the server answers with
+        # what it picked (older servers ignore it and just start streaming)
+        self.viewport = (1280, 720)  # Window size, lets the server skip needless pixels
+        self.max_resolution = None  # Largest frame worth receiving, None = any
+        self.negotiated = None
+        self.receive_buffer = ReceiveBuffer()  # Also holds stream bytes read during the handshake
+        
+        # Viewer pipeline: network thread -> decode thread -> display loop,
+        # the newest picture wins at each handoff
+        self.pipeline_lock = threading.Condition()
+        self.pending_messages = []  # Received, not decoded yet
+        self.skip_updates = False  # Tile backlog dropped: wait for the keyframe
+        self.messages_received = 0  # receive_buffer.handed_out of the newest message enqueued
+        self.display_frame = None  # (image, has new picture), not shown yet
+        self.display_ready = threading.Event()
+        self.pipeline_stop = threading.Event()
+        self.pipeline_error = None  # Exception that ended the network/decode thread
+        self.pipeline_threads = []
+        self.frames_skipped = 0  # Pictures dropped without being decoded
+        
+        # Reduced decode: pictures are decoded at 1/2, 1/4 or 1/8 size while
+        # the window shows them that small anyway (full size when zoomed)
+        self.decode_reduction = 1  # Wanted by the display loop
+        self.canvas_reduction = 1  # The canvas is decoded at
+        self.shown_reduction = 1  # Of the picture on screen
+        self.frame_full_size = None  # (width, height) of the server's frames
+        self.last_frame = None  # JPEG of the last full frame, re-decoded on a reduction change
+        
         # Performance monitoring
         self.frame_count = 0
         self.fps_counter = 0
@@ -45,12 +221,22 @@ class ScreenShareClient:
         self.is_zoomed = False
         self.zoom_center = None
         self.zoom_level = 2.0  # 2x zoom
-        self.original_frame = None
+        self.original_frame = None  # Last picture shown, re-rendered when the UI changes
         self.current_frame_size = None  # Store current frame dimensions
         # Drag feature for zoom
         self.is_dragging = False
         self.drag_start = None
         
+        # Render cache: window layout, the reused window image and overlay
+        # sprites, rebuilt only when the window size or UI state changes
+        self.window_size = (0, 0)
+        self.window_checked = 0
+        self.layout = None  # {'key', 'rect': (x, y, width, height) of the picture in the window}
+        self.window_canvas = None
+        self.overlay_key = None
+        self.overlay_sprites = []  # (x, y, patch, mask)
+        self.render_state = None  # UI state of the last render
+        
         # Multi-user awareness
         self.adaptive_quality = True  # Automatically adjust quality based on performance
         self.connection_timeout = 5.0  # Timeout for server communication
@@ -102,6 +288,11 @@ class ScreenShareClient:
                             print("[*] You can adjust quality from the window if needed")
                         
                         self.connected = True
+                        if not self.negotiate():
+                            print("[-] Handshake failed - reconnect to try again")
+                            self.connected = False
+                            self.client_socket.close()
+                            return False
                         self.client_socket.settimeout(None)  # Remove timeout
                         return True
                     elif approval_response == "REJECTED":
@@ -135,6 +326,7 @@ class ScreenShareClient:
                 if show_debug:
                     print("[+] Successfully connected to server!")
                 self.connected = True
+                self.request_stream_mode()
                 return True
             else:
                 print("[-] Unauthorized - Wrong security code!")
@@ -165,7 +357,7 @@ class ScreenShareClient:
             return False
         
         try:
-            quality_msg = f"QUALITY:{new_quality}"
+            quality_msg = f"QUALITY:{new_quality}\n"
             self.client_socket.send(quality_msg.encode())
             self.server_quality = new_quality
             print(f"[📺] Requested quality change to {new_quality} from server")
@@ -174,6 +366,198 @@ class ScreenShareClient:
             print(f"[-] Failed to send quality change: {e}")
             return False
     
+    def request_stream_mode(self):
+        """Ask for tile deltas, the cursor channel and the wire format (older servers ignore them)"""
+        self.canvas = None  # New connection: wait for a keyframe
+        self.keyframe_requested = False
+        self.cursor = None
+        commands = b""
+        if self.delta_mode:
+            commands += b"MODE:DELTA\n"
+        if self.cursor_channel:
+            commands += b"CURSOR\n"
+        if self.wire_format:
+            commands += WIRE_COMMAND.encode() + b"\n"
+        if commands:
+            try:
+                self.client_socket.send(commands)
+            except Exception as e:
+                print(f"[-] Failed to request stream mode: {e}")
+    
+    def negotiate(self):
+        """Advertise our capabilities and apply the server's choice
+        
+        A server that does not know HELLO starts streaming instead of
+        answering: whatever it sent is kept for receive_frames() and the
+        stream mode is requested with separate commands. Returns False if
+        the SELECTED reply stopped partway (the stream cannot be framed).
+        """
+        self.canvas = None  # New connection: wait for a keyframe
+        self.keyframe_requested = False
+        self.cursor = None
+        self.negotiated = None
+        self.receive_buffer.clear()
+        
+        features = []
+        if self.delta_mode:
+            features.append('delta')
+        if self.cursor_channel:
+            features.append('cursor')
+        transports = ['wire1', 'pickle'] if self.wire_format else ['pickle']
+        prefix = SELECTED_PREFIX.encode()
+        data = b""
+        try:
+            self.client_socket.send(hello_line(transports=transports, features=features,
+                                               max_resolution=self.max_resolution,
+                                               viewport=self.viewport, quality=self.server_quality))
+            self.client_socket.settimeout(self.connection_timeout)
+            # Enough bytes to tell a SELECTED line from the first frame
+            while len(data) < len(prefix) and prefix.startswith(data):
+                chunk = self.client_socket.recv(4096)
+                if not chunk:
+                    raise ConnectionResetError
+                data += chunk
+            if data.startswith(prefix):
+                while b"\n" not in data:
+                    chunk = self.client_socket.recv(4096)
+                    if not chunk:
+                        raise ConnectionResetError
+                    data += chunk
+                line, data = data.split(b"\n", 1)
+                self.negotiated = parse_line(line, SELECTED_PREFIX)
+        except socket.timeout:
+            if data and (data.startswith(prefix) or prefix.startswith(data)):
+                # Part of a SELECTED line: the rest would be read as a message
+                print("[-] Server's handshake reply timed out")
+                return False
+            # Nothing at all (not even a frame): ask the old way
+        self.receive_buffer.feed(data)
+        
+        if self.negotiated is None:
+            self.request_stream_mode()
+            return True
+        # Messages are decoded by type, so the choice needs no further state
+        features = self.negotiated.get('features', [])
+        self.server_quality = self.negotiated.get('quality') or self.server_quality
+        print(f"[*] Negotiated {self.negotiated.get('codec')} over {self.negotiated.get('transport')}, "
+              f"features: {', '.join(features) or 'none'}, quality: {self.server_quality}")
+        return True
+    
+    def request_keyframe(self):
+        """Ask the server for a full frame (canvas missing or out of sync)"""
+        if self.keyframe_requested:
+            return
+        try:
+            self.client_socket.send(b"KEYFRAME\n")
+            self.keyframe_requested = True
+        except Exception as e:
+            print(f"[-] Failed to request keyframe: {e}")
+    
+    def decode_message(self, message):
+        """Turn a server message into the image to display (None if there is nothing yet)"""
+        self.apply_message(message)
+        return self.render_canvas()
+    
+    def apply_message(self, message):
+        """Decode a server message into the canvas / cursor position"""
+        if not isinstance(message, dict):
+            # Legacy full frame: numpy array of JPEG bytes
+            message = {'type': 'frame', 'data': message}
+        message_type = message.get('type')
+        
+        if message_type == 'frame':
+            if self.decode_picture(message['data']):
+                # Kept for a reduction change; a copy, the receive buffer is reused
+                data = message['data']
+                self.last_frame = bytes(data) if isinstance(data, memoryview) else data
+        elif message_type == 'cursor':
+            self.cursor = (message['x'], message['y']) if message['visible'] else None
+        elif message_type == 'keyframe':
+            self.last_frame = None  # Tiles follow: the canvas is more than this picture
+            if self.decode_picture(message['data']):
+                self.keyframe_requested = False
+        elif message_type == 'tiles':
+            width, height = message['size']
+            # Canvas and tiles at the canvas's reduction (JPEG sizes round up)
+            reduction = self.canvas_reduction
+            if self.canvas is None or self.canvas.shape[:2] != (-(-height // reduction), -(-width // reduction)):
+                self.request_keyframe()
+                return
+            # Scrolled/moved regions: reuse what the canvas already shows
+            for src_x, src_y, copy_w, copy_h, dst_x, dst_y in message.get('copies', ()):
+                if (dst_x - src_x) % reduction or (dst_y - src_y) % reduction:
+                    # Shift falls between reduced pixels: the copy would drift, resync
+                    self.request_keyframe()
+                    continue
+                src_x, src_y, dst_x, dst_y = (value // reduction for value in (src_x, src_y, dst_x, dst_y))
+                copy_w, copy_h = copy_w // reduction, copy_h // reduction
+                region = self.canvas[src_y:src_y + copy_h, src_x:src_x + copy_w].copy()
+                self.canvas[dst_y:dst_y + copy_h, dst_x:dst_x + copy_w] = region
+            # Patch changed tiles into the canvas
+            for x, y, data in message['tiles']:
+                tile = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), DECODE_FLAGS[reduction])
+                if tile is None:
+                    self.request_keyframe()
+                    continue
+                x, y = x // reduction, y // reduction
+                self.canvas[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+        # 'keepalive' (screen unchanged) just redisplays the canvas
+    
+    def render_canvas(self):
+        """Copy of the canvas with the cursor drawn (None before the first frame)"""
+        if self.canvas is None:
+            return None
+        # Display code scales and draws overlays, the canvas must stay untouched
+        img = self.canvas.copy()
+        if self.cursor is not None:
+            reduction = self.canvas_reduction
+            self.draw_cursor(img, self.cursor[0] // reduction, self.cursor[1] // reduction)
+        return img
+    
+    def decode_picture(self, data):
+        """Decode a whole picture into the canvas at the wanted reduction, True on success"""
+        reduction = self.decode_reduction
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), DECODE_FLAGS[reduction])
+        if img is None:
+            return False
+        self.canvas = img
+        self.canvas_reduction = reduction
+        self.frame_full_size = (img.shape[1] * reduction, img.shape[0] * reduction)
+        return True
+    
+    def follow_reduction(self):
+        """Bring the canvas to a new decode reduction, True if it was redrawn
+        
+        Full frame streams re-decode their last frame; a delta canvas is
+        built from many messages, so it asks for a keyframe instead.
+        """
+        if self.canvas is None or self.decode_reduction == self.canvas_reduction:
+            return False
+        if self.last_frame is not None:
+            return self.decode_picture(self.last_frame)
+        self.request_keyframe()
+        return False
+    
+    def choose_reduction(self, window_width, window_height):
+        """Largest decode reduction whose picture still covers the window at the quality's detail (1 while zoomed)"""
+        if self.is_zoomed or not self.frame_full_size or window_width <= 0 or window_height <= 0:
+            return 1
+        scale = self.quality_scales.get(self.quality, 0.75)
+        width, height = self.frame_full_size
+        fit = min(window_width * scale / width, window_height * scale / height)
+        for reduction in (8, 4, 2):
+            if reduction * fit <= 1:
+                return reduction
+        return 1
+    
+    def draw_cursor(self, img, cursor_x, cursor_y):
+        """Draw the cursor marker (same look as the server-drawn one)"""
+        cursor_size = 12
+        cursor_thickness = 2
+        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
+        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
+        cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
+    
     def update_performance_stats(self):
         """Update performance statistics for multi-user optimization"""
         current_time = time.time()
@@ -413,11 +797,9 @@ class ScreenShareClient:
                 dy = y - self.drag_start[1]
                 
                 # Convert drag offset to frame coordinates based on current scaling
-                # Get window size
+                # (cached window size, see poll_window_size)
                 try:
-                    window_rect = cv2.getWindowImageRect(self.window_name)
-                    window_width = window_rect[2]
-                    window_height = window_rect[3]
+                    window_width, window_height = self.window_size
                     
                     if window_width > 0 and window_height > 0 and self.current_frame_size:
                         frame_width, frame_height = self.current_frame_size
@@ -458,58 +840,33 @@ class ScreenShareClient:
     
     def window_to_frame_coords(self, window_x, window_y):
         """Convert window coordinates to frame coordinates"""
-        try:
-            # Get window size
-            window_rect = cv2.getWindowImageRect(self.window_name)
-            window_width = window_rect[2]
-            window_height = window_rect[3]
-            
-            if window_width <= 0 or window_height <= 0 or not self.current_frame_size:
-                return None
-            
-            frame_width, frame_height = self.current_frame_size
-            
-            # Calculate the aspect ratio scaling that was applied
-            img_aspect = frame_width / frame_height
-            window_aspect = window_width / window_height
-            
-            if img_aspect > window_aspect:
-                # Image is wider - fit to width
-                displayed_width = window_width
-                displayed_height = int(window_width / img_aspect)
-                x_offset = 0
-                y_offset = (window_height - displayed_height) // 2
-            else:
-                # Image is taller - fit to height
-                displayed_height = window_height
-                displayed_width = int(window_height * img_aspect)
-                y_offset = 0
-                x_offset = (window_width - displayed_width) // 2
-            
-            # Check if click is within the displayed frame area
-            if (window_x < x_offset or window_x > x_offset + displayed_width or
-                window_y < y_offset or window_y > y_offset + displayed_height):
-                return None
-            
-            # Convert to frame coordinates
-            frame_x = int((window_x - x_offset) * frame_width / displayed_width)
-            frame_y = int((window_y - y_offset) * frame_height / displayed_height)
-            
-            # Clamp to frame bounds
-            frame_x = max(0, min(frame_x, frame_width - 1))
-            frame_y = max(0, min(frame_y, frame_height - 1))
-            
-            return (frame_x, frame_y)
-        except:
+        if self.layout is None or not self.current_frame_size:
+            return None
+        
+        frame_width, frame_height = self.current_frame_size
+        x_offset, y_offset, displayed_width, displayed_height = self.layout['rect']
+        
+        # Check if click is within the displayed frame area
+        if (window_x < x_offset or window_x > x_offset + displayed_width or
+            window_y < y_offset or window_y > y_offset + displayed_height):
             return None
-    
-    def apply_zoom(self, img, click_x, click_y):
-        """Apply zoom effect centered at the clicked position"""
-        img_height, img_width = img.shape[:2]
         
+        # Convert to frame coordinates
+        frame_x = int((window_x - x_offset) * frame_width / displayed_width)
+        frame_y = int((window_y - y_offset) * frame_height / displayed_height)
+        
+        # Clamp to frame bounds
+        frame_x = max(0, min(frame_x, frame_width - 1))
+        frame_y = max(0, min(frame_y, frame_height - 1))
+        
+        return (frame_x, frame_y)
+    
+    def zoom_crop(self, img_width, img_height):
+        """Region (x1, y1, x2, y2) of the picture shown while zoomed"""
         # Calculate the region to extract (smaller region = more zoom)
         extract_width = int(img_width / self.zoom_level)
         extract_height = int(img_height / self.zoom_level)
+        click_x, click_y = self.zoom_center
         
         # Calculate extraction boundaries centered on click position
         x1 = max(0, click_x - extract_width // 2)
@@ -522,19 +879,11 @@ class ScreenShareClient:
             x1 = max(0, x2 - extract_width)
         if y2 - y1 < extract_height:
             y1 = max(0, y2 - extract_height)
-        
-        # Extract the region
-        zoomed_region = img[y1:y2, x1:x2]
-        
-        # Scale up to original image size
-        zoomed_img = cv2.resize(zoomed_region, (img_width, img_height), interpolation=cv2.INTER_LINEAR)
-        
-        # Add a visual indicator (border) to show zoom is active
-        border_color = (0, 255, 255)  # Yellow border
-        border_thickness = 3
-        cv2.rectangle(zoomed_img, (0, 0), (img_width - 1, img_height - 1), border_color, border_thickness)
-        
-        # Add zoom indicator text
+        return x1, y1, x2, y2
+    
+    def draw_zoom_labels(self, frame, origin):
+        """Zoom indicator texts at the top-left of the picture area"""
+        border_color = (0, 255, 255)  # Yellow, like the zoom border
         zoom_text = f"ZOOM {self.zoom_level}x"
         drag_text = "Drag to Pan | Right-click to Exit"
         font = cv2.FONT_HERSHEY_SIMPLEX
@@ -543,35 +892,48 @@ class ScreenShareClient:
         
         # Main zoom text
         text_size = cv2.getTextSize(zoom_text, font, font_scale, font_thickness)[0]
-        text_x = 10
-        text_y = 30
+        text_x = origin[0] + 10
+        text_y = origin[1] + 30
         
         # Text background
-        cv2.rectangle(zoomed_img, (text_x - 5, text_y - text_size[1] - 5),
+        cv2.rectangle(frame, (text_x - 5, text_y - text_size[1] - 5),
                      (text_x + text_size[0] + 5, text_y + 5), (0, 0, 0), -1)
         # Text
-        cv2.putText(zoomed_img, zoom_text, (text_x, text_y), font, font_scale, 
+        cv2.putText(frame, zoom_text, (text_x, text_y), font, font_scale, 
                    border_color, font_thickness)
         
         # Drag instruction text (smaller)
         drag_font_scale = 0.4
         drag_font_thickness = 1
         drag_text_size = cv2.getTextSize(drag_text, font, drag_font_scale, drag_font_thickness)[0]
-        drag_text_x = 10
+        drag_text_x = text_x
         drag_text_y = text_y + 25
         
         # Drag text background
-        cv2.rectangle(zoomed_img, (drag_text_x - 5, drag_text_y - drag_text_size[1] - 5),
+        cv2.rectangle(frame, (drag_text_x - 5, drag_text_y - drag_text_size[1] - 5),
                      (drag_text_x + drag_text_size[0] + 5, drag_text_y + 5), (0, 0, 0), -1)
         # Drag text
-        cv2.putText(zoomed_img, drag_text, (drag_text_x, drag_text_y), font, drag_font_scale, 
+        cv2.putText(frame, drag_text, (drag_text_x, drag_text_y), font, drag_font_scale, 
                    (200, 200, 200), drag_font_thickness)
-        
-        return zoomed_img
     
-    def resize_with_aspect_ratio(self, img, window_width, window_height):
-        """Resize image to fit window while maintaining aspect ratio"""
-        img_height, img_width = img.shape[:2]
+    def poll_window_size(self):
+        """Refresh the cached window size (at most every WINDOW_POLL_INTERVAL)"""
+        now = time.time()
+        if now - self.window_checked < WINDOW_POLL_INTERVAL:
+            return
+        self.window_checked = now
+        window_rect = cv2.getWindowImageRect(self.window_name)
+        self.window_size = (window_rect[2], window_rect[3])
+    
+    def update_layout(self, img_width, img_height):
+        """Where the picture goes in the window, aspect ratio kept (cached per size)"""
+        key = (self.window_size, img_width, img_height)
+        if self.layout is not None and self.layout['key'] == key:
+            return self.layout
+        
+        window_width, window_height = self.window_size
+        if window_width <= 0 or window_height <= 0:
+            window_width, window_height = img_width, img_height  # Window size unknown: as is
         
         # Calculate aspect ratios
         img_aspect = img_width / img_height
@@ -587,24 +949,225 @@ class ScreenShareClient:
             new_height = window_height
             new_width = int(window_height * img_aspect)
         
-        # Resize image
-        resized = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+        # Center the picture in a black window image that is reused every frame
+        x_offset = (window_width - new_width) // 2
+        y_offset = (window_height - new_height) // 2
+        self.layout = {'key': key, 'rect': (x_offset, y_offset, new_width, new_height)}
+        self.window_canvas = np.zeros((window_height, window_width, 3), dtype=np.uint8)
+        self.overlay_key = None
+        return self.layout
+    
+    def build_sprite(self, draw):
+        """Pre-render an overlay: (x, y, patch, mask) of the pixels draw(image) paints
+        
+        Drawing once on black and once on white tells painted pixels (same
+        in both) from untouched ones, so the overlay can be blitted onto
+        any frame without running the drawing code again.
+        """
+        height, width = self.window_canvas.shape[:2]
+        dark = np.zeros((height, width, 3), dtype=np.uint8)
+        light = np.full((height, width, 3), 255, dtype=np.uint8)
+        draw(dark)
+        draw(light)
+        mask = (dark == light).all(axis=2)
+        rows, columns = np.nonzero(mask)
+        if not len(rows):
+            return None
+        y1, y2, x1, x2 = rows.min(), rows.max() + 1, columns.min(), columns.max() + 1
+        return x1, y1, dark[y1:y2, x1:x2].copy(), mask[y1:y2, x1:x2, None].copy()
+    
+    def update_overlays(self):
+        """Rebuild the overlay sprites when the layout or UI state changed"""
+        zoomed = self.is_zoomed and self.zoom_center is not None
+        key = (self.layout['key'], self.quality, self.show_quality_menu, zoomed and self.zoom_level)
+        if key == self.overlay_key:
+            return
+        self.overlay_key = key
+        self.window_canvas[:] = 0  # Old overlays may have covered the black border
+        x_offset, y_offset = self.layout['rect'][:2]
+        sprites = [self.build_sprite(self.draw_quality_selector)]
+        if zoomed:
+            sprites.append(self.build_sprite(lambda frame: self.draw_zoom_labels(frame, (x_offset, y_offset))))
+        self.overlay_sprites = [sprite for sprite in sprites if sprite is not None]
+    
+    def render_window(self, img):
+        """Window image for a picture: one crop-and-scale into the reused canvas plus cached overlays
+        
+        The returned array is overwritten by the next call.
+        """
+        img_height, img_width = img.shape[:2]
+        self.current_frame_size = (img_width, img_height)
+        x_offset, y_offset, width, height = self.update_layout(img_width, img_height)['rect']
+        self.update_overlays()
         
-        # Create black canvas with window size
-        canvas = np.zeros((window_height, window_width, 3), dtype=np.uint8)
+        # Zoom: scale the cropped region straight to the window
+        source = img
+        if self.is_zoomed and self.zoom_center:
+            x1, y1, x2, y2 = self.zoom_crop(img_width, img_height)
+            source = img[y1:y2, x1:x2]
+        target = self.window_canvas[y_offset:y_offset + height, x_offset:x_offset + width]
+        if source.shape[:2] == (height, width):
+            target[:] = source
+        else:
+            cv2.resize(source, (width, height), dst=target, interpolation=cv2.INTER_LINEAR)
         
-        # Center the resized image on canvas
-        y_offset = (window_height - new_height) // 2
-        x_offset = (window_width - new_width) // 2
-        canvas[y_offset:y_offset + new_height, x_offset:x_offset + new_width] = resized
+        if self.is_zoomed and self.zoom_center:
+            # Yellow border shows zoom is active
+            cv2.rectangle(self.window_canvas, (x_offset, y_offset),
+                          (x_offset + width - 1, y_offset + height - 1), (0, 255, 255), 3)
+        for x, y, patch, mask in self.overlay_sprites:
+            np.copyto(self.window_canvas[y:y + patch.shape[0], x:x + patch.shape[1]], patch, where=mask)
         
-        return canvas
+        self.render_state = self.ui_state()
+        return self.window_canvas
+    
+    def ui_state(self):
+        """Everything besides the picture that changes what the window shows"""
+        return (self.window_size, self.quality, self.show_quality_menu, self.is_zoomed, self.zoom_center)
+    
+    def receive_message(self):
+        """Next message from the socket (None for types this version does not know)
+
+        Wire format messages start with their magic; anything else is a
+        legacy length-prefixed pickle from an older server. JPEG payloads
+        are views into the receive buffer, valid until the next call.
+        """
+        buffer = self.receive_buffer
+        buffer.fill(self.client_socket, len(WIRE_MAGIC))
+        if is_wire_message(buffer.peek(len(WIRE_MAGIC))):
+            buffer.fill(self.client_socket, HEADER_SIZE)
+            kind, tier, sequence, timestamp, length = decode_header(buffer.peek(HEADER_SIZE))
+            buffer.fill(self.client_socket, HEADER_SIZE + length)
+            message = decode_message(kind, tier, sequence, timestamp, buffer.peek(length, HEADER_SIZE))
+            buffer.consume(HEADER_SIZE + length)
+            return message
+        
+        buffer.fill(self.client_socket, LEGACY_LENGTH.size)
+        msg_size = LEGACY_LENGTH.unpack(buffer.peek(LEGACY_LENGTH.size))[0]
+        buffer.fill(self.client_socket, LEGACY_LENGTH.size + msg_size)
+        message = loads_legacy(buffer.peek(msg_size, LEGACY_LENGTH.size))
+        buffer.consume(LEGACY_LENGTH.size + msg_size)
+        return message
+    
+    def enqueue_message(self, message):
+        """Hand a received message to the decode thread (latest picture wins)
+        
+        A full frame or keyframe makes every picture still waiting stale, so
+        those are dropped without being decoded. Tile updates have to be
+        applied in order; if they pile up the backlog is dropped and a
+        keyframe requested instead.
+        """
+        kind = message_type(message)
+        request_keyframe = False
+        with self.pipeline_lock:
+            self.messages_received = self.receive_buffer.handed_out
+            pending = self.pending_messages
+            if kind in ('frame', 'keyframe'):
+                kept = [queued for queued in pending if message_type(queued) not in ('frame', 'keyframe', 'tiles')]
+                self.frames_skipped += len(pending) - len(kept)
+                pending[:] = kept
+                self.skip_updates = False
+            elif kind == 'tiles':
+                updates = sum(1 for queued in pending if message_type(queued) == 'tiles')
+                if not self.skip_updates and updates >= MAX_PENDING_UPDATES:
+                    pending[:] = [queued for queued in pending if message_type(queued) != 'tiles']
+                    self.frames_skipped += updates
+                    self.skip_updates = request_keyframe = True
+                if self.skip_updates:
+                    self.frames_skipped += 1
+                    message = None
+            elif kind == 'cursor':
+                pending[:] = [queued for queued in pending if message_type(queued) != 'cursor']
+            elif pending:
+                message = None  # Keepalive: anything queued redraws anyway
+            if message is not None:
+                pending.append(message)
+                self.pipeline_lock.notify()
+        if request_keyframe:
+            self.request_keyframe()
+    
+    def network_loop(self):
+        """Pipeline stage 1: read messages as fast as the server sends them"""
+        try:
+            while not self.pipeline_stop.is_set():
+                message = self.receive_message()
+                if message is not None:  # None: message type from a newer server
+                    self.enqueue_message(message)
+        except Exception as e:
+            self.stop_with_error(e)
+    
+    def decode_loop(self):
+        """Pipeline stage 2: decode everything queued, publish the newest picture"""
+        try:
+            while not self.pipeline_stop.is_set():
+                with self.pipeline_lock:
+                    if not self.pending_messages:
+                        self.pipeline_lock.wait(0.1)
+                    messages, self.pending_messages = self.pending_messages, []
+                    received = self.messages_received  # Everything older was dropped or is in messages
+                redrawn = self.follow_reduction()
+                if not messages and not redrawn:
+                    continue
+                for message in messages:
+                    self.apply_message(message)
+                # Done with their payloads: the receive buffer may reuse the bytes
+                self.receive_buffer.release(received)
+                img = self.render_canvas()
+                if img is None:
+                    continue  # Waiting for a keyframe
+                # Cursor-only updates are not frames
+                new_picture = redrawn or any(message_type(message) != 'cursor' for message in messages)
+                with self.pipeline_lock:
+                    if self.display_frame is not None:
+                        new_picture = new_picture or self.display_frame[1]
+                    self.display_frame = (img, new_picture, self.canvas_reduction)
+                self.display_ready.set()
+        except Exception as e:
+            self.stop_with_error(e)
+    
+    def stop_with_error(self, error):
+        """Let the display loop handle an error from the network or decode thread"""
+        if not self.pipeline_stop.is_set():
+            self.pipeline_error = error
+            self.display_ready.set()
+    
+    def start_pipeline(self):
+        """Start the network and decode threads for the current connection"""
+        self.pipeline_stop.clear()
+        self.pipeline_error = None
+        self.pending_messages = []
+        self.skip_updates = False
+        self.display_frame = None
+        self.last_frame = None
+        # Messages outlive the next read now: never overwrite bytes the decode
+        # thread has not released
+        self.messages_received = self.receive_buffer.handed_out
+        self.receive_buffer.release(self.messages_received)
+        self.receive_buffer.keep_views = True
+        self.pipeline_threads = [
+            threading.Thread(target=self.network_loop, name='viewer-network', daemon=True),
+            threading.Thread(target=self.decode_loop, name='viewer-decode', daemon=True)
+        ]
+        for thread in self.pipeline_threads:
+            thread.start()
+    
+    def stop_pipeline(self):
+        """Stop the pipeline threads (the network thread ends with its socket)"""
+        self.pipeline_stop.set()
+        with self.pipeline_lock:
+            self.pipeline_lock.notify_all()
+        for thread in self.pipeline_threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+        self.pipeline_threads = []
     
     def receive_frames(self):
-        """Receive and display screen frames from server"""
-        data = b""
-        payload_size = struct.calcsize("L")
+        """Receive and display screen frames from server
         
+        Reading, decoding and displaying run in three stages (network thread,
+        decode thread, this loop), so a slow decode or display never stalls
+        the socket; stale pictures are skipped instead.
+        """
         print("[*] Receiving screen feed...")
         print("[*] Press 'q' to quit or ESC to quit with confirmation")
         print("[*] Click 'Quality' button in top-right to adjust quality")
@@ -618,7 +1181,7 @@ class ScreenShareClient:
         cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL | cv2.WINDOW_KEEPRATIO)
         
         # Set initial window size (1280x720 is a good default)
-        cv2.resizeWindow(self.window_name, 1280, 720)
+        cv2.resizeWindow(self.window_name, *self.viewport)
         
         # Set window icon (Windows only) - Must be done after window is created and sized
         if os.name == 'nt':  # Windows
@@ -678,83 +1241,52 @@ class ScreenShareClient:
         cv2.setMouseCallback(self.window_name, self.mouse_callback)
         self.window_created = True
         
+        self.start_pipeline()
         try:
             while self.connected:
                 try:
-                    # Retrieve message size
-                    while len(data) < payload_size:
-                        packet = self.client_socket.recv(4096)
-                        if not packet:
-                            # Connection lost
-                            print("\n[!] Connection lost to server")
-                            if self.auto_reconnect:
-                                if self.attempt_reconnection():
-                                    data = b""  # Reset data buffer
-                                    continue
-                            return
-                        data += packet
+                    self.display_ready.wait(DISPLAY_INTERVAL)
+                    self.display_ready.clear()
+                    if self.pipeline_error is not None:
+                        raise self.pipeline_error
+                    self.poll_window_size()
                     
-                    packed_msg_size = data[:payload_size]
-                    data = data[payload_size:]
-                    msg_size = struct.unpack("L", packed_msg_size)[0]
+                    # Newest decoded picture (older ones were never shown)
+                    with self.pipeline_lock:
+                        display_frame, self.display_frame = self.display_frame, None
                     
-                    # Retrieve the full frame data
-                    while len(data) < msg_size:
-                        packet = self.client_socket.recv(4096)
-                        if not packet:
-                            print("\n[!] Connection lost to server")
-                            if self.auto_reconnect:
-                                if self.attempt_reconnection():
-                                    data = b""
-                                    continue
-                            return
-                        data += packet
-                    
-                    frame_data = data[:msg_size]
-                    data = data[msg_size:]
-                    
-                    # Deserialize frame
-                    frame = pickle.loads(frame_data)
-                    
-                    # Decode image
-                    img = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-                    
-                    # Store original frame for zoom
-                    self.original_frame = img.copy()
-                    
-                    # Apply client-side quality scaling
-                    scale_factor = self.quality_scales.get(self.quality, 0.75)
-                    if scale_factor < 1.0:
-                        new_width = int(img.shape[1] * scale_factor)
-                        new_height = int(img.shape[0] * scale_factor)
-                        img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                    
-                    # Store current frame size for coordinate conversion
-                    self.current_frame_size = (img.shape[1], img.shape[0])
-                    
-                    # Apply zoom if active
-                    if self.is_zoomed and self.zoom_center:
-                        img = self.apply_zoom(img, self.zoom_center[0], self.zoom_center[1])
-                    
-                    # Get current window size
-                    window_rect = cv2.getWindowImageRect(self.window_name)
-                    window_width = window_rect[2]
-                    window_height = window_rect[3]
-                    
-                    # Resize image to fit window while maintaining aspect ratio
-                    if window_width > 0 and window_height > 0:
-                        img = self.resize_with_aspect_ratio(img, window_width, window_height)
-                    
-                    # Draw quality selector overlay
-                    img = self.draw_quality_selector(img)
+                    if display_frame is not None:
+                        img, new_picture, reduction = display_frame
+                        
+                        # Zoom center is in picture pixels: follow a reduction change
+                        if self.zoom_center and reduction != self.shown_reduction:
+                            ratio = self.shown_reduction / reduction
+                            self.zoom_center = (int(self.zoom_center[0] * ratio), int(self.zoom_center[1] * ratio))
+                        self.shown_reduction = reduction
+                        
+                        # Kept (no copy needed, the decode thread made it) to
+                        # re-render when the window or UI state changes
+                        self.original_frame = img
+                        cv2.imshow(self.window_name, self.render_window(img))
+                        
+                        # Update performance statistics for multi-user optimization
+                        # (cursor-only updates are not frames)
+                        if new_picture:
+                            self.update_performance_stats()
                     
-                    # Display the frame
-                    cv2.imshow(self.window_name, img)
+                    # Window resized, menu opened, zoom moved... with no new picture
+                    if self.original_frame is not None and display_frame is None and self.render_state != self.ui_state():
+                        cv2.imshow(self.window_name, self.render_window(self.original_frame))
                     
-                    # Update performance statistics for multi-user optimization
-                    self.update_performance_stats()
+                    # Decode no more pixels than the window shows (full size when zoomed)
+                    if self.original_frame is not None:
+                        reduction = self.choose_reduction(*self.window_size)
+                        if reduction != self.decode_reduction:
+                            self.decode_reduction = reduction
+                            with self.pipeline_lock:
+                                self.pipeline_lock.notify()  # Redraw at the new size now
                     
-                    # Check for key press
+                    # Check for key press (also keeps the window responsive between frames)
                     key = cv2.waitKey(1) & 0xFF
                     if key == ord('q'):
                         # Quit with confirmation
@@ -766,16 +1298,18 @@ class ScreenShareClient:
                 
                 except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
                     print("\n[!] Connection interrupted")
+                    self.stop_pipeline()
                     if self.auto_reconnect:
                         if self.attempt_reconnection():
-                            data = b""
+                            self.start_pipeline()
                             continue
                     break
                 except Exception as e:
                     print(f"\n[-] Error receiving frame: {e}")
+                    self.stop_pipeline()
                     if self.auto_reconnect and "connection" in str(e).lower():
                         if self.attempt_reconnection():
-                            data = b""
+                            self.start_pipeline()
                             continue
                     break
                     
@@ -800,10 +1334,15 @@ class ScreenShareClient:
         self.connected = False
         
         if self.client_socket:
+            try:
+                self.client_socket.shutdown(socket.SHUT_RDWR)  # Wakes the network thread
+            except OSError:
+                pass
             try:
                 self.client_socket.close()
             except:
                 pass
+        self.stop_pipeline()
         
         cv2.destroyAllWindows()
         print("[*] Disconnected")
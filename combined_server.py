@@ -0,0 +1,81 @@
+"""
+Combined Screen Share Server - Desktop App and Web Browser at once
+Serves native client.py viewers (TCP 5555) and browser viewers (HTTP 5000)
+from a single capture/encode pipeline in one process, so the screen is
+grabbed and JPEG-encoded once per tick no matter how many protocols are active.
+"""
+
+import threading
+from capture_daemon import create_engine
+from server import ScreenShareServer
+from web_server import ScreenShareWebServer
+
+
+class CombinedScreenShareServer:
+    def __init__(self, host='0.0.0.0', tcp_port=5555, web_port=5000, capture_source=None):
+        self.host = host
+        self.tcp_port = tcp_port
+        self.web_port = web_port
+
+        # One engine feeds both front-ends; its adaptive FPS sees the viewers of both
+        self.engine = create_engine(capture_source=capture_source)
+        self.tcp_server = ScreenShareServer(host, tcp_port, engine=self.engine)
+        self.web_server = ScreenShareWebServer(host, web_port, engine=self.engine)
+        self.web_server.tcp_server = self.tcp_server  # Desktop clients show up in /stats
+
+        # Both servers ask the operator for approval on the same console
+        self.prompt_lock = threading.Lock()
+        self.tcp_server.prompt_lock = self.prompt_lock
+        self.web_server.prompt_lock = self.prompt_lock
+
+        self.security_code = None
+        self.tcp_thread = None
+
+    def start_sharing(self):
+        """Start both servers; blocks until the web server stops"""
+        # Same security code for desktop and browser viewers
+        self.security_code = self.tcp_server.generate_security_code()
+        self.web_server.security_code = self.security_code
+
+        print("\n" + "="*60)
+        print("COMBINED MODE - DESKTOP APP + WEB BROWSER")
+        print("="*60)
+        print(f"[*] Desktop viewers: client.py / main.py → 2 on port {self.tcp_port}")
+        print(f"[*] Browser viewers: http://<this-pc>:{self.web_port}")
+        print("[*] One capture pipeline is shared by both - each frame is encoded once")
+        print("="*60)
+
+        # TCP server runs its accept loop in the background
+        self.tcp_thread = threading.Thread(target=self.tcp_server.start_sharing, daemon=True)
+        self.tcp_thread.start()
+
+        try:
+            # The web server runs in the foreground (Ctrl+C stops it)
+            self.web_server.start_sharing()
+        finally:
+            self.stop_sharing()
+
+    def stop_sharing(self):
+        """Stop both servers (the engine stops when the last one does)"""
+        self.tcp_server.stop_sharing()
+        self.web_server.stop_sharing()
+        if self.tcp_thread and self.tcp_thread.is_alive():
+            self.tcp_thread.join(timeout=2)
+
+
+def main():
+    print("="*60)
+    print("COMBINED SCREEN SHARING SERVER (DESKTOP + WEB)")
+    print("="*60)
+
+    server = CombinedScreenShareServer()
+
+    try:
+        server.start_sharing()
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted by user")
+        server.stop_sharing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+/*
+ * Delta stream viewer for the web clients
+ * Reads the /updates Server-Sent Events stream (keyframes, changed tiles,
+ * scroll copies and cursor positions) and draws it onto a canvas that keeps
+ * the last screen, so only what changed crosses the network. The cursor is
+ * drawn here on top of the screen, a moving pointer costs no new frames.
+ */
+
+class DeltaViewer {
+    constructor(canvas) {
+        this.canvas = canvas;  // What the user sees: screen + cursor
+        this.context = canvas.getContext('2d');
+        this.screen = document.createElement('canvas');  // The shared screen only
+        this.screenContext = this.screen.getContext('2d');
+        this.cursor = null;  // {x, y} in screen pixels, null = hidden
+        this.renderPending = false;
+        this.source = null;
+        this.url = null;
+        this.handlers = {};
+        this.queue = Promise.resolve();  // Updates depend on each other: applied strictly in order
+        this.frames = 0;
+    }
+
+    static isSupported() {
+        return typeof window.EventSource !== 'undefined' && !!document.createElement('canvas').getContext;
+    }
+
+    static loadJpeg(base64) {
+        return new Promise((resolve, reject) => {
+            const image = new Image();
+            image.onload = () => resolve(image);
+            image.onerror = reject;
+            image.src = 'data:image/jpeg;base64,' + base64;
+        });
+    }
+
+    // handlers.onFirstFrame(): first image drawn; handlers.onError(): stream never started
+    start(url, handlers) {
+        this.stop();
+        this.url = url;
+        this.handlers = handlers || {};
+
+        this.source = new EventSource(url);
+        this.source.onmessage = (event) => {
+            const update = JSON.parse(event.data);
+            if (update.type === 'cursor') {
+                // Independent of the screen contents, no need to wait for the queue
+                this.cursor = update.visible ? { x: update.x, y: update.y } : null;
+                if (this.frames > 0) this.scheduleRender();
+                return;
+            }
+            this.queue = this.queue
+                .then(() => this.apply(update))
+                .catch((error) => {
+                    console.error('Delta update failed, requesting a keyframe:', error);
+                    this.resync();
+                });
+        };
+        this.source.onerror = () => {
+            if (this.frames === 0 && this.handlers.onError) {
+                this.stop();
+                this.handlers.onError();
+            }
+            // Otherwise EventSource reconnects by itself and the server starts with a keyframe
+        };
+    }
+
+    stop() {
+        if (this.source) {
+            this.source.close();
+            this.source = null;
+        }
+    }
+
+    // A fresh connection always begins with a keyframe
+    resync() {
+        if (this.source && this.url) {
+            this.start(this.url, this.handlers);
+        }
+    }
+
+    hasFrame() {
+        return this.frames > 0;
+    }
+
+    apply(update) {
+        if (update.type === 'keyframe') {
+            return DeltaViewer.loadJpeg(update.data).then((image) => {
+                if (this.screen.width !== image.width || this.screen.height !== image.height) {
+                    this.screen.width = image.width;
+                    this.screen.height = image.height;
+                }
+                this.screenContext.drawImage(image, 0, 0);
+                this.frameDrawn();
+            });
+        }
+
+        // 'keepalive': the screen did not change
+        if (update.type !== 'tiles' || this.frames === 0) return null;
+
+        if (this.screen.width !== update.size[0] || this.screen.height !== update.size[1]) {
+            this.resync();
+            return null;
+        }
+
+        // Decode all tiles in parallel, then move scrolled regions and patch tiles
+        return Promise.all(update.tiles.map((tile) => DeltaViewer.loadJpeg(tile[2]))).then((images) => {
+            update.copies.forEach(([srcX, srcY, width, height, dstX, dstY]) => {
+                // Drawing a canvas onto itself copies the source first, so overlapping regions are safe
+                this.screenContext.drawImage(this.screen, srcX, srcY, width, height, dstX, dstY, width, height);
+            });
+            images.forEach((image, index) => {
+                this.screenContext.drawImage(image, update.tiles[index][0], update.tiles[index][1]);
+            });
+            this.frameDrawn();
+        });
+    }
+
+    frameDrawn() {
+        this.frames += 1;
+        this.render();
+        if (this.frames === 1 && this.handlers.onFirstFrame) {
+            this.handlers.onFirstFrame();
+        }
+    }
+
+    // Cursor messages can arrive faster than the display refreshes: draw once per frame
+    scheduleRender() {
+        if (this.renderPending) return;
+        this.renderPending = true;
+        window.requestAnimationFrame(() => {
+            this.renderPending = false;
+            this.render();
+        });
+    }
+
+    render() {
+        if (this.canvas.width !== this.screen.width || this.canvas.height !== this.screen.height) {
+            this.canvas.width = this.screen.width;
+            this.canvas.height = this.screen.height;
+        }
+        this.context.drawImage(this.screen, 0, 0);
+        if (this.cursor) {
+            this.drawCursor(this.cursor.x, this.cursor.y);
+        }
+    }
+
+    // Same marker the server draws into MJPEG frames
+    drawCursor(x, y) {
+        const context = this.context;
+        const ring = (radius, color, width) => {
+            context.beginPath();
+            context.arc(x, y, radius, 0, 2 * Math.PI);
+            context.strokeStyle = color;
+            context.lineWidth = width;
+            context.stroke();
+        };
+        ring(12, '#ffffff', 4);  // White outline for visibility on any background
+        ring(12, '#000000', 2);  // Black for contrast
+        context.beginPath();
+        context.arc(x, y, 3, 0, 2 * Math.PI);
+        context.fillStyle = '#ff0000';
+        context.fill();
+    }
+}
+
+window.DeltaViewer = DeltaViewer;
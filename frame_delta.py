@@ -0,0 +1,313 @@
+"""
+Frame change detection
+Vectorized NumPy per-tile hashing of captured BGRA frames, so the engine
+can tell which parts of the screen changed (if any) without encoding.
+"""
+
+import numpy as np
+
+DEFAULT_TILE_SIZE = 64
+
+# Scroll detection: rows/columns that must line up before a shift is
+# trusted, and the fewest dirty tiles worth looking for one
+MIN_SHIFT_MATCHES = 16
+MIN_SHIFT_TILES = 4
+
+
+def sum_tiles(values, tile_size, axis):
+    """Sum consecutive blocks of tile_size along axis 0 or 1 of a 2D array
+
+    The last block may be shorter. Sums wrap around in uint32, which is
+    all a checksum needs and much faster than widening to uint64.
+    """
+    length = values.shape[axis]
+    full = length - length % tile_size
+    if axis == 0:
+        head = values[:full].reshape(full // tile_size, tile_size, -1).sum(axis=1, dtype=np.uint32)
+        tail = values[full:].sum(axis=0, dtype=np.uint32, keepdims=True)
+    else:
+        head = values[:, :full].reshape(values.shape[0], full // tile_size, tile_size).sum(axis=2, dtype=np.uint32)
+        tail = values[:, full:].sum(axis=1, dtype=np.uint32, keepdims=True)
+    if full == length:
+        return head
+    return np.concatenate([head, tail], axis=axis)
+
+
+class ChangeDetector:
+    """Compares per-tile signatures of consecutive frames
+
+    Each tile gets two 32-bit checksums of its pixels (viewed as uint32):
+    one weighted by column position and one weighted by row position. A
+    change that keeps one sum equal (e.g. two pixels swapping places)
+    still changes the other, so in practice only identical tiles match.
+    Both take one vectorized pass over the frame and no per-frame copy.
+    """
+
+    def __init__(self, tile_size=DEFAULT_TILE_SIZE):
+        self.tile_size = tile_size
+        self.shape = None
+        self.col_weights = None
+        self.row_weights = None
+        self.signature = None
+        self.channels = 1
+        # Profiles of the last frame, reused for scroll detection:
+        # row_profile (height, tiles_x) sums each row inside every tile column,
+        # column_profile (tiles_y, width * channels) sums each column inside every tile row
+        self.row_profile = None
+        self.column_profile = None
+
+    def _prepare(self, shape):
+        self.shape = shape
+        height, width = shape[:2]
+        # Byte columns per row for BGR input, pixel columns for BGRA
+        columns = width * shape[2] if len(shape) == 3 and shape[2] != 4 else width
+        # Distinct odd position weights inside every tile (odd keeps the
+        # multiplication reversible in wrapping uint32 arithmetic)
+        self.col_weights = (np.arange(columns) % self.tile_size * 2 + 1).astype(np.uint32)
+        self.row_weights = (np.arange(height) % self.tile_size * 2 + 1).astype(np.uint32)[:, None]
+        self.signature = None
+
+    def compute_signature(self, frame):
+        """Per-tile signature array of shape (2, tiles_y, tiles_x)"""
+        height, width = frame.shape[:2]
+        if self.shape != frame.shape:
+            self._prepare(frame.shape)
+
+        frame = np.ascontiguousarray(frame)
+        if frame.ndim == 3 and frame.shape[2] == 4:
+            # One uint32 per BGRA pixel: a single reduction covers all channels
+            pixels = frame.view(np.uint32).reshape(height, width)
+        else:
+            # BGR and grayscale: every byte is a column, tiles span channels * tile_size bytes
+            pixels = frame.reshape(height, -1)
+        self.channels = pixels.shape[1] // width
+        tile_width = self.tile_size * self.channels
+
+        # Rows of each tile band summed, then columns weighted and summed per tile
+        band_sums = sum_tiles(pixels, self.tile_size, axis=0)
+        by_column = sum_tiles(band_sums * self.col_weights, tile_width, axis=1)
+
+        # Columns of each tile summed, then rows weighted and summed per tile
+        column_sums = sum_tiles(pixels, tile_width, axis=1)
+        by_row = sum_tiles(column_sums * self.row_weights, self.tile_size, axis=0)
+
+        self.row_profile = column_sums
+        self.column_profile = band_sums
+        return np.stack([by_column, by_row])
+
+    def update(self, frame):
+        """Feed the next frame; returns a boolean (tiles_y, tiles_x) dirty mask
+
+        The first frame (and any resolution change) marks every tile dirty.
+        """
+        signature = self.compute_signature(frame)
+        if self.signature is None or self.signature.shape != signature.shape:
+            dirty = np.ones(signature.shape[1:], dtype=bool)
+        else:
+            dirty = np.any(signature != self.signature, axis=0)
+        self.signature = signature
+        return dirty
+
+    def reset(self):
+        """Forget the previous frame (next update reports everything dirty)"""
+        self.signature = None
+        self.row_profile = None
+        self.column_profile = None
+
+
+def tile_any(mask, tile_size):
+    """Per-tile 'any' of a boolean (height, width[, channels]) mask"""
+    height, width = mask.shape[:2]
+    # Channels stay interleaved in the rows (a reduction over a size-3 axis is slow)
+    flat = mask.reshape(height, -1).view(np.uint8)
+    tile_width = tile_size * (flat.shape[1] // width)
+    return sum_tiles(sum_tiles(flat, tile_size, axis=0), tile_width, axis=1) > 0
+
+
+def dirty_band(counts):
+    """Contiguous run around the busiest tile row/column of runs at least half as busy"""
+    peak = int(np.argmax(counts))
+    threshold = counts[peak] / 2
+    start, end = peak, peak + 1
+    while start > 0 and counts[start - 1] >= threshold:
+        start -= 1
+    while end < len(counts) and counts[end] >= threshold:
+        end += 1
+    return start, end
+
+
+def combine_hashes(profile):
+    """One uint32 hash per line from a (lines, parts) profile"""
+    weights = (np.arange(profile.shape[1]) * 2 + 1).astype(np.uint32)
+    return (profile * weights).sum(axis=1, dtype=np.uint32)
+
+
+def shift_votes(previous, current):
+    """Offsets d with current[i] == previous[i + d], one per matching i
+
+    Only hashes that occur once in `previous` vote, so blank lines and
+    repeated content cannot produce false matches.
+    """
+    values, first_index, counts = np.unique(previous, return_index=True, return_counts=True)
+    single = counts == 1
+    values, first_index = values[single], first_index[single]
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(values, current), len(values) - 1)
+    found = values[positions] == current
+    shifts = first_index[positions[found]] - np.nonzero(found)[0]
+    return shifts[shifts != 0]
+
+
+def matches_at(previous, current, shift):
+    """Boolean mask over current: current[i] == previous[i + shift]"""
+    matched = np.zeros(len(current), dtype=bool)
+    start = max(0, -shift)
+    end = min(len(current), len(previous) - shift)
+    if end > start:
+        matched[start:end] = current[start:end] == previous[start + shift:end + shift]
+    return matched
+
+
+def find_lane_shift(previous, current, min_matches=MIN_SHIFT_MATCHES):
+    """Common shift of a (length, lanes) profile pair, lanes being tile columns or rows
+
+    Every lane votes separately, so a scrolling pane next to static
+    content still matches. Returns (shift, first_lane, end_lane, span)
+    for the contiguous lanes that agree, or None.
+    """
+    length, lanes = current.shape
+    votes = [shift_votes(previous[:, lane], current[:, lane]) for lane in range(lanes)]
+    all_votes = np.concatenate(votes)
+    if len(all_votes) == 0:
+        return None
+    counts = np.bincount(all_votes + length)
+    shift = int(np.argmax(counts)) - length
+    if counts[shift + length] < min_matches:
+        return None
+
+    matched = np.array([matches_at(previous[:, lane], current[:, lane], shift).sum()
+                        for lane in range(lanes)])
+    agreeing = matched >= min_matches
+    best = int(np.argmax(matched))
+    first, end = best, best + 1
+    while first > 0 and agreeing[first - 1]:
+        first -= 1
+    while end < lanes and agreeing[end]:
+        end += 1
+
+    # Lines where every agreeing lane lines up
+    rows = matches_at(combine_hashes(previous[:, first:end]), combine_hashes(current[:, first:end]), shift)
+    hits = np.nonzero(rows)[0]
+    if len(hits) < min_matches:
+        return None
+    return shift, first, end, (int(hits[0]), int(hits[-1]) + 1)
+
+
+def find_copy_rect(previous, image, dirty, previous_profiles, detector):
+    """Look for a scrolled/moved region between two frames
+
+    Returns ((src_x, src_y, width, height, dst_x, dst_y), residual) where
+    residual is the tile mask still dirty after the copy is applied, or
+    None when no shift explains the change better than plain tiles.
+    """
+    tile_size = detector.tile_size
+    height, width = image.shape[:2]
+    previous_rows, previous_columns = previous_profiles
+    if previous_rows is None or previous_rows.shape != detector.row_profile.shape:
+        return None
+
+    r0, r1 = dirty_band(dirty.sum(axis=1))
+    c0, c1 = dirty_band(dirty.sum(axis=0))
+    y0, y1 = r0 * tile_size, min(r1 * tile_size, height)
+    x0, x1 = c0 * tile_size, min(c1 * tile_size, width)
+
+    candidates = []
+    # Vertical: pixel rows of the dirty band, one lane per tile column
+    found = find_lane_shift(previous_rows[y0:y1, c0:c1], detector.row_profile[y0:y1, c0:c1])
+    if found:
+        shift, first, end, (top, bottom) = found
+        left = (c0 + first) * tile_size
+        right = min((c0 + end) * tile_size, width)
+        candidates.append((left, y0 + top + shift, right - left, bottom - top, left, y0 + top))
+
+    # Horizontal: pixel columns of the dirty band, one lane per tile row
+    channels = detector.channels
+    old = previous_columns[r0:r1].reshape(r1 - r0, width, channels).transpose(1, 0, 2)
+    new = detector.column_profile[r0:r1].reshape(r1 - r0, width, channels).transpose(1, 0, 2)
+    # Fold the channels of every lane into one hash per pixel column
+    old = np.stack([combine_hashes(old[x0:x1, lane]) for lane in range(r1 - r0)], axis=1)
+    new = np.stack([combine_hashes(new[x0:x1, lane]) for lane in range(r1 - r0)], axis=1)
+    found = find_lane_shift(old, new)
+    if found:
+        shift, first, end, (left, right) = found
+        top = (r0 + first) * tile_size
+        bottom = min((r0 + end) * tile_size, height)
+        candidates.append((x0 + left + shift, top, right - left, bottom - top, x0 + left, top))
+
+    best = None
+    for rect in candidates:
+        residual = copy_residual(previous, image, dirty, rect, tile_size)
+        if residual.sum() < dirty.sum() and (best is None or residual.sum() < best[1].sum()):
+            best = (rect, residual)
+    return best
+
+
+def copy_residual(previous, image, dirty, rect, tile_size):
+    """Tile mask still differing from image once rect is copied within previous"""
+    src_x, src_y, copy_width, copy_height, dst_x, dst_y = rect
+    ty0, tx0 = dst_y // tile_size, dst_x // tile_size
+    ty1 = -(-(dst_y + copy_height) // tile_size)
+    tx1 = -(-(dst_x + copy_width) // tile_size)
+    region = (slice(ty0 * tile_size, ty1 * tile_size), slice(tx0 * tile_size, tx1 * tile_size))
+    predicted = previous[region].copy()
+    predicted[dst_y - ty0 * tile_size:dst_y - ty0 * tile_size + copy_height,
+              dst_x - tx0 * tile_size:dst_x - tx0 * tile_size + copy_width] = \
+        previous[src_y:src_y + copy_height, src_x:src_x + copy_width]
+    # Tiles outside the copied region keep their plain dirty state
+    residual = dirty.copy()
+    residual[ty0:ty1, tx0:tx1] = tile_any(predicted != image[region], tile_size)
+    return residual
+
+
+class TileTracker:
+    """Remembers in which frame sequence each tile of one image stream last changed
+
+    Used for the delta protocol: a viewer that has seen frame `since` needs
+    exactly the tiles whose version is newer than `since`.
+    """
+
+    def __init__(self, tile_size=DEFAULT_TILE_SIZE):
+        self.tile_size = tile_size
+        self.detector = ChangeDetector(tile_size)
+        self.image = None  # Latest image (never modified after update)
+        self.sequence = None  # Frame sequence of self.image
+        self.start_sequence = None  # Versions are only meaningful after this sequence
+        self.versions = None  # (tiles_y, tiles_x) sequence each tile last changed in
+        self.encoded_tiles = {}  # (row, col) -> (version, JPEG bytes)
+        # Scroll/move from the previous frame: {'base', 'rect', 'residual'} or None
+        self.copy = None
+
+    def update(self, image, sequence):
+        """Record a new image published as frame `sequence`"""
+        previous, previous_sequence = self.image, self.sequence
+        previous_profiles = (self.detector.row_profile, self.detector.column_profile)
+        dirty = self.detector.update(image)
+        self.copy = None
+        if self.versions is None or self.versions.shape != dirty.shape:
+            # New stream or new size: nothing older can be patched
+            self.versions = np.full(dirty.shape, sequence, dtype=np.int64)
+            self.start_sequence = sequence
+            self.encoded_tiles = {}
+        else:
+            # A new array, so snapshots taken by readers stay consistent
+            self.versions = np.where(dirty, sequence, self.versions)
+            if previous is not None and previous.shape == image.shape and dirty.sum() >= MIN_SHIFT_TILES:
+                found = find_copy_rect(previous, image, dirty, previous_profiles, self.detector)
+                if found is not None:
+                    rect, residual = found
+                    # Viewers at previous_sequence copy rect, then need only the residual tiles
+                    self.copy = {'base': previous_sequence, 'rect': rect, 'residual': residual}
+        self.image = image
+        self.sequence = sequence
+        return dirty
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Multi-Viewer Load Generator
+Opens many simulated viewers against a running server and reports the
+frames and bytes each one receives. Combine with a synthetic capture
+source for reproducible runs, e.g.:
+
+    SCREENSHARE_CAPTURE_SOURCE=text:1080p python web_server_trusted.py
+    python load_test.py web --viewers 30 --duration 20
+
+Modes:
+    web   MJPEG viewers on /stream (trusted server auto-approves; the regular
+          web server needs --code and operator approval for each viewer)
+    tcp   native protocol viewers on port 5555 (needs --code and approval);
+          add --delta to request tile deltas (MODE:DELTA) instead of full frames
+"""
+
+import argparse
+import json
+import socket
+import struct
+import threading
+import time
+import uuid
+import http.client
+
+
+class ViewerStats:
+    def __init__(self, name):
+        self.name = name
+        self.frames = 0
+        self.bytes = 0
+        self.error = None
+        self.connected_at = None
+
+
+def verify_web_session(host, port, code=None):
+    """Authorize a session through /verify and return its session id"""
+    conn = http.client.HTTPConnection(host, port, timeout=70)
+    session_id = uuid.uuid4().hex
+    body = {'session': session_id}
+    if code:
+        body['code'] = code
+    conn.request('POST', '/verify', json.dumps(body), {'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = json.loads(response.read().decode('utf-8') or '{}')
+    conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"verify failed: {response.status} {data}")
+    # The regular web server generates its own session id
+    return data.get('session_id') or data.get('session') or session_id
+
+
+def run_web_viewer(stats, host, port, code, quality, stop_event):
+    """Read an MJPEG stream and count multipart frames"""
+    try:
+        session_id = verify_web_session(host, port, code)
+        if quality:
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            conn.request('POST', '/set_quality', json.dumps({'session': session_id, 'quality': quality}),
+                         {'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            conn.close()
+
+        sock = socket.create_connection((host, port), timeout=10)
+        sock.sendall(f"GET /stream?session={session_id} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+        stats.connected_at = time.time()
+        boundary = b'--frame\r\n'
+        tail = b''
+        while not stop_event.is_set():
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            stats.bytes += len(chunk)
+            # Keep a few bytes so a boundary split across reads is still counted
+            data = tail + chunk
+            stats.frames += data.count(boundary)
+            tail = data[-(len(boundary) - 1):]
+        sock.close()
+    except Exception as e:
+        stats.error = str(e)
+
+
+def run_tcp_viewer(stats, host, port, code, quality, stop_event, delta=False):
+    """Speak the native protocol and count frames without decoding them"""
+    try:
+        sock = socket.create_connection((host, port), timeout=70)
+        sock.send((code + '\n').encode('utf-8'))
+        # Status lines may arrive together in one read
+        lines = sock.recv(1024).decode('utf-8').split()
+        if lines == ["WAITING_APPROVAL"]:
+            lines += sock.recv(1024).decode('utf-8').split()
+        response = lines[-1] if lines else ''
+        if response not in ("APPROVED", "AUTHORIZED"):
+            raise RuntimeError(f"not approved: {response}")
+        if quality:
+            sock.send(f"QUALITY:{quality.upper()}\n".encode())
+        if delta:
+            sock.send(b"MODE:DELTA\n")
+
+        stats.connected_at = time.time()
+        sock.settimeout(10)
+        payload_size = struct.calcsize("L")
+        buffer = b''
+        while not stop_event.is_set():
+            while len(buffer) < payload_size:
+                packet = sock.recv(65536)
+                if not packet:
+                    raise ConnectionError("server closed the connection")
+                buffer += packet
+            msg_size = struct.unpack("L", buffer[:payload_size])[0]
+            buffer = buffer[payload_size:]
+            while len(buffer) < msg_size:
+                packet = sock.recv(max(65536, msg_size - len(buffer)))
+                if not packet:
+                    raise ConnectionError("server closed the connection")
+                buffer += packet
+            buffer = buffer[msg_size:]
+            stats.frames += 1
+            stats.bytes += payload_size + msg_size
+        sock.close()
+    except Exception as e:
+        if not stop_event.is_set():
+            stats.error = str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate many screen share viewers")
+    parser.add_argument('mode', choices=['web', 'tcp'])
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, help="Default: 5000 for web, 5555 for tcp")
+    parser.add_argument('--viewers', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=15.0, help="Seconds to measure")
+    parser.add_argument('--code', default=None, help="Security code (not needed for trusted mode)")
+    parser.add_argument('--quality', default=None, help="Quality tier requested by every viewer")
+    parser.add_argument('--delta', action='store_true', help="tcp mode: request tile deltas instead of full frames")
+    args = parser.parse_args()
+
+    port = args.port or (5000 if args.mode == 'web' else 5555)
+    target = run_web_viewer if args.mode == 'web' else run_tcp_viewer
+    if args.mode == 'tcp' and not args.code:
+        parser.error("tcp mode needs --code")
+
+    extra = (args.delta,) if args.mode == 'tcp' else ()
+    print(f"🚀 Starting {args.viewers} {args.mode} viewers against {args.host}:{port}")
+    stop_event = threading.Event()
+    viewers = []
+    threads = []
+    for i in range(args.viewers):
+        stats = ViewerStats(f"viewer-{i + 1}")
+        thread = threading.Thread(target=target,
+                                  args=(stats, args.host, port, args.code, args.quality, stop_event) + extra,
+                                  daemon=True)
+        viewers.append(stats)
+        threads.append(thread)
+        thread.start()
+
+    start = time.time()
+    try:
+        time.sleep(args.duration)
+    except KeyboardInterrupt:
+        print("\n[!] Interrupted, reporting partial results")
+    stop_event.set()
+    elapsed = time.time() - start
+
+    print(f"\n📊 Results over {elapsed:.1f}s")
+    print("   Viewer         FPS      KB/s   Error")
+    print("   " + "-" * 45)
+    total_frames = 0
+    total_bytes = 0
+    for stats in viewers:
+        duration = time.time() - stats.connected_at if stats.connected_at else elapsed
+        fps = stats.frames / duration if duration > 0 else 0
+        kbps = stats.bytes / duration / 1024 if duration > 0 else 0
+        total_frames += stats.frames
+        total_bytes += stats.bytes
+        print(f"   {stats.name.ljust(12)} {fps:6.1f} {kbps:9.1f}   {stats.error or ''}")
+    print("   " + "-" * 45)
+    print(f"   Total: {total_frames / elapsed:.1f} frames/s, {total_bytes / elapsed / 1024 / 1024:.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -192,6 +192,19 @@ def print_banner():
         print("=" * 60)
     print()
 
+def get_encode_backend():
+    """Encoding backend the servers will use (threads unless switched to processes)"""
+    return os.environ.get('SCREENSHARE_ENCODE_BACKEND', 'threads')
+
+def toggle_encode_backend():
+    """Switch JPEG encoding between the thread pool and worker processes"""
+    backend = 'threads' if get_encode_backend() == 'processes' else 'processes'
+    os.environ['SCREENSHARE_ENCODE_BACKEND'] = backend
+    print(f"\n[*] Encoding backend: {backend}")
+    if backend == 'processes':
+        print("💠 Worker processes keep 4K / multi-monitor encoding off the sharing threads.")
+    input("Press Enter to continue...")
+
 def main_menu():
     """Display main menu and get user choice"""
     while True:
@@ -206,11 +219,15 @@ def main_menu():
         print("  [5] Share My Screen via Cloudflare Tunnel (Merged 3 & 4)")
         print("  [6] Share My Screen (Trusted Mode - No Security Code)")
         print("  [7] Share My Screen Trusted Mode via Cloudflare Tunnel (Merged 4 & 6)")
-        print("  [8] Exit")
+        print("  [8] Share My Screen (Desktop App + Web Browser at once)")
+        print("  [9] Exit")
+        print()
+        print(f"  [E] Encoding backend: {get_encode_backend().capitalize()} (switch for 4K / multi-monitor)")
         print()
         print("Note:")
         print("💠 For same wifi network, use options 1 & 2 or 3.")
         print("💠 For worldwide access, use options 5 or 7.")
+        print("💠 Need desktop and browser viewers together? Use option 8 (one capture, half the CPU).")
         print("💠 Use Ctrl+C to stop any running mode.")
         print("💠 More info at: https://github.com/bibekchandsah/screenshare?tab=readme-ov-file#real-time-screen-sharing-application")
         print()
@@ -218,7 +235,7 @@ def main_menu():
         print(" " * 39, end="𝓓𝓮𝓿𝓮𝓵𝓸𝓹𝓮𝓭 𝓫𝔂 𝓑𝓲𝓫𝓮𝓴...")
         print()
         
-        choice = input("\nEnter your choice (1-8): ").strip()
+        choice = input("\nEnter your choice (1-9, E): ").strip()
         
         if choice == '1':
             return 'server'
@@ -235,6 +252,8 @@ def main_menu():
         elif choice == '7':
             return 'cloudflare_trusted_merged'
         elif choice == '8':
+            return 'combined_server'
+        elif choice == '9':
             # Confirm before exiting
             print()
             confirm = input("Are you sure you want to exit? (y/n): ").strip().lower()
@@ -242,8 +261,10 @@ def main_menu():
                 print("\nGoodbye! 👋")
                 sys.exit(0)
             # If 'no', loop continues and menu is shown again
+        elif choice.lower() == 'e':
+            toggle_encode_backend()
         else:
-            print("\n❌ Invalid choice! Please enter 1-8.")
+            print("\n❌ Invalid choice! Please enter 1-9 or E.")
             input("Press Enter to continue...")
 
 def run_server():
@@ -388,6 +409,34 @@ def run_web_server_trusted():
         print(f"❌ Error: {e}")
         input("\nPress Enter to return to main menu...")
 
+def run_combined_server():
+    """Run the TCP server and the web server together from one capture pipeline"""
+    clear_screen()
+    print_banner()
+    print("🖥️🌐 DESKTOP APP + WEB BROWSER SHARE MODE")
+    print("=" * 60)
+    print()
+    
+    try:
+        # Import and run combined server
+        from combined_server import CombinedScreenShareServer
+        
+        server = CombinedScreenShareServer()
+        print("[*] Desktop viewers connect with option 2, browsers open the web URL")
+        print("[*] The screen is captured and encoded once for both\n")
+        server.start_sharing()
+        
+    except KeyboardInterrupt:
+        print("\n\n[!] Combined server stopped by user")
+        input("\nPress Enter to return to main menu...")
+    except ImportError as e:
+        print(f"❌ Error: Could not import combined server module - {e}")
+        print("Make sure combined_server.py, server.py and web_server.py exist in the same directory.")
+        input("\nPress Enter to continue...")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        input("\nPress Enter to continue...")
+
 def run_cloudflare():
     """Run Cloudflare tunnel setup"""
     clear_screen()
@@ -754,6 +803,8 @@ def main():
                 run_cloudflare_merged()
             elif choice == 'cloudflare_trusted_merged':
                 run_cloudflare_trusted_merged()
+            elif choice == 'combined_server':
+                run_combined_server()
                 
     except KeyboardInterrupt:
         print("\n\nGoodbye! 👋")
@@ -763,4 +814,7 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Encoder worker processes start through the executable when frozen (PyInstaller)
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,396 @@
+"""
+MJPEG broadcaster
+Streams /stream (MJPEG) and /updates (Server-Sent Events delta) viewers from
+one event loop instead of one thread per viewer. The HTTP handler authorizes
+the viewer, sends the response headers and hands its socket over; from then
+on a single selectors loop fans each new frame out to every socket with
+non-blocking writes. Anything that may encode (a tier nobody watched yet,
+changed tiles for /updates) is built by a small worker pool, so the loop
+itself only sends, reads and checks for stalls. A viewer whose socket is
+still draining the previous message skips frames (it gets the newest one
+as soon as it catches up) instead of queueing them, so one slow viewer
+never holds back the others or grows memory; one whose message stops
+draining altogether is evicted after STALL_TIMEOUT.
+"""
+
+import itertools
+import json
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from capture_engine import CURSOR_FPS, KEEPALIVE_INTERVAL, CursorFeed, DeltaViewer, ViewerLink, update_to_json
+
+# The loop wakes at least this often to pick up quality changes, keepalives
+# and ended sessions
+TICK_INTERVAL = 0.1
+
+# Threads that build viewers' next messages off the loop (parts of tiers
+# nobody watched yet, tile updates)
+PREPARE_WORKERS = 2
+
+# Evicted viewers remembered for /stats
+MAX_EVICTION_RECORDS = 100
+
+
+class StreamViewer(ViewerLink):
+    """One MJPEG connection owned by the broadcaster"""
+
+    def __init__(self, sock, get_tier, is_active, on_sent=None, on_close=None, name=None, events=None,
+                 viewer_id=None):
+        super().__init__()
+        self.sock = sock
+        self.id = viewer_id  # Unique per broadcaster: a session may have several viewers
+        self.name = name  # Session id (None if the stream has none)
+        self.get_tier = get_tier  # () -> quality tier the viewer wants now
+        self.is_active = is_active  # () -> False once the session ended
+        self.on_sent = on_sent  # (viewer) after every complete frame
+        self.on_close = on_close  # (viewer) once, when the stream ends
+        self.events = events  # EventStream of an /updates viewer, None for MJPEG
+        self.part = None  # memoryview of the rest of the part in flight
+        self.part_is_frame = False  # False for cursor-only and keepalive events
+        self.preparing = False  # A worker is building the next message
+        self.prepared = None  # (tier, message) the worker built, picked up by the loop
+        self.last_send_time = 0
+        self.writing = False  # Registered for EVENT_WRITE
+        self.evicted = False
+
+
+class EventStream:
+    """Server-Sent Events of one /updates viewer: changed tiles (or a keyframe) and the cursor
+
+    Each message is built when the viewer's slot is free, against the frame
+    the viewer has, so frames published while the previous message drained
+    are folded into the next one instead of being queued.
+    """
+
+    def __init__(self, engine):
+        self.delta = DeltaViewer(engine)
+        self.cursor_feed = CursorFeed(engine)
+        self.tier = None
+
+    def next_message(self, tier):
+        """(event bytes, sequence or None) to send now, or None when there is nothing new"""
+        if tier != self.tier:
+            # New tier: the canvas has to start over from a keyframe
+            self.delta.request_keyframe()
+            self.cursor_feed.reset()
+            self.tier = tier
+        update = self.delta.next_update(tier)
+        cursor = self.cursor_feed.next_update(tier)
+        events = []
+        sequence = None
+        if update is not None:
+            events.append(b'data: ' + json.dumps(update_to_json(update)).encode() + b'\n\n')
+            self.delta.sent(update)
+            if update['type'] != 'keepalive':
+                sequence = update['sequence']
+        if cursor is not None:
+            events.append(b'data: ' + json.dumps(cursor).encode() + b'\n\n')
+        return (b''.join(events), sequence) if events else None
+
+
+class MJPEGBroadcaster:
+    """Single-threaded fan-out of prebuilt MJPEG parts to many sockets
+
+    get_part(tier) returns (part bytes, sequence) - the web servers'
+    get_current_part_with_sequence(). /updates viewers get their own
+    EventStream messages instead. Both are built on the worker pool, which
+    hands them back to the loop. A second small thread waits for new
+    frames on the engine and wakes the loop through a socket pair; while
+    /updates viewers are connected the loop also wakes at CURSOR_FPS.
+    """
+
+    def __init__(self, engine, get_part):
+        self.engine = engine
+        self.get_part = get_part
+        self.selector = None
+        self.viewers = {}  # socket -> StreamViewer
+        self.added = []  # Viewers handed over, picked up by the loop
+        self.viewer_ids = itertools.count(1)
+        self.ready = []  # Viewers whose next message a worker built
+        self.workers = None
+        self.lock = threading.Lock()
+        self.wake_reader = None
+        self.wake_writer = None
+        self.running = False
+        self.loop_thread = None
+        self.frame_thread = None
+        self.evictions = {}  # Viewer id -> session, stream and time of an evicted viewer (newest last)
+        self.stats = {
+            'stream_viewers': 0,
+            'stream_frames_sent': 0,
+            'stream_frames_dropped': 0,
+            'stream_evictions': 0
+        }
+
+    def start(self):
+        if self.running:
+            return
+        self.selector = selectors.DefaultSelector()
+        self.wake_reader, self.wake_writer = socket.socketpair()
+        self.wake_reader.setblocking(False)
+        self.wake_writer.setblocking(False)
+        self.selector.register(self.wake_reader, selectors.EVENT_READ)
+        self.workers = ThreadPoolExecutor(max_workers=PREPARE_WORKERS, thread_name_prefix='mjpeg-prepare')
+        self.running = True
+        self.loop_thread = threading.Thread(target=self.loop, name='mjpeg-broadcaster', daemon=True)
+        self.loop_thread.start()
+        self.frame_thread = threading.Thread(target=self.watch_frames, name='mjpeg-frames', daemon=True)
+        self.frame_thread.start()
+
+    def stop(self):
+        """End every stream and stop the loop"""
+        if not self.running:
+            return
+        self.running = False
+        self.wake()
+        for thread in (self.loop_thread, self.frame_thread):
+            if thread is not None and thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self.loop_thread = self.frame_thread = None
+
+    def add(self, sock, get_tier, is_active, on_sent=None, on_close=None, name=None, events=False):
+        """Take over a /stream (or, with events=True, /updates) socket whose response headers were already sent"""
+        with self.lock:
+            viewer = StreamViewer(sock, get_tier, is_active, on_sent, on_close, name,
+                                  EventStream(self.engine) if events else None, next(self.viewer_ids))
+            self.viewers[sock] = viewer
+            self.added.append(viewer)
+        self.wake()
+        return viewer
+
+    def owns(self, sock):
+        """True for sockets the HTTP server must not shut down after the handler returns"""
+        with self.lock:
+            return sock in self.viewers
+
+    def wake(self):
+        try:
+            self.wake_writer.send(b'\0')
+        except (BlockingIOError, OSError, AttributeError):
+            pass  # Already pending, or not started
+
+    def watch_frames(self):
+        """Wake the loop whenever the engine publishes a frame"""
+        seen = self.engine.frame_sequence
+        while self.running:
+            seen = self.engine.wait_for_frame(seen, TICK_INTERVAL).sequence
+            self.wake()
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+    def loop(self):
+        while self.running:
+            with self.lock:
+                added, self.added = self.added, []
+                ready, self.ready = self.ready, []
+            for viewer in added:
+                viewer.sock.setblocking(False)
+                self.selector.register(viewer.sock, selectors.EVENT_READ, viewer)
+            for viewer in ready:
+                if viewer.sock in self.viewers:
+                    self.send_prepared(viewer)
+
+            # Event viewers also carry the cursor, which moves between frames
+            timeout = TICK_INTERVAL
+            if any(viewer.events is not None for viewer in list(self.viewers.values())):
+                timeout = min(TICK_INTERVAL, 1.0 / CURSOR_FPS)
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.wake_reader:
+                    try:
+                        while self.wake_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                viewer = key.data
+                if events & selectors.EVENT_READ and not self.read_closed(viewer):
+                    continue
+                if events & selectors.EVENT_WRITE:
+                    self.flush(viewer)
+
+            now = time.time()
+            for viewer in list(self.viewers.values()):
+                if viewer.sock not in self.viewers:
+                    continue
+                if viewer.part is None and not viewer.preparing:
+                    self.offer_frame(viewer)
+                elif viewer.stalled(now):
+                    self.evict(viewer)
+
+        self.workers.shutdown(wait=False, cancel_futures=True)
+        for viewer in list(self.viewers.values()):
+            self.close(viewer)
+        self.selector.close()
+        self.wake_reader.close()
+        self.wake_writer.close()
+
+    def read_closed(self, viewer):
+        """Viewers never send anything after the request: readable means closed. Returns True if still open"""
+        try:
+            if viewer.sock.recv(4096):
+                return True
+        except BlockingIOError:
+            return True
+        except OSError:
+            pass
+        self.close(viewer)
+        return False
+
+    def offer_frame(self, viewer):
+        """Have a worker build the viewer's next message if it may need one (new frame, keepalive, cursor)"""
+        try:
+            if not viewer.is_active():
+                self.close(viewer)
+                return
+            tier = viewer.get_tier()
+        except Exception as e:
+            print(f"[-] Stream error: {e}")
+            self.close(viewer)
+            return
+        viewer.sync_epoch(self.engine.epoch)
+        if (viewer.events is None and (tier, self.engine.frame_sequence) == viewer.last_sent
+                and time.time() - viewer.last_send_time < KEEPALIVE_INTERVAL):
+            return
+        viewer.preparing = True
+        self.workers.submit(self.prepare, viewer, tier)
+
+    def prepare(self, viewer, tier):
+        """Build a viewer's next message (worker thread: may encode) and hand it to the loop"""
+        try:
+            if viewer.events is not None:
+                message = viewer.events.next_message(tier)
+            else:
+                message = self.get_part(tier)
+        except Exception as e:
+            print(f"[-] Stream error: {e}")
+            message = False  # The loop closes the viewer
+        with self.lock:
+            viewer.prepared = (tier, message)
+            self.ready.append(viewer)
+        self.wake()
+
+    def send_prepared(self, viewer):
+        """Start sending the message a worker built for the viewer"""
+        tier, message = viewer.prepared
+        viewer.prepared = None
+        viewer.preparing = False
+        if message is False:
+            self.close(viewer)
+            return
+        if message is None:
+            return
+        part, sequence = message
+        if not part:
+            return
+        # Frames published while the previous part was draining count as dropped
+        dropped = viewer.frames_dropped
+        viewer.queue(len(part), tier, sequence)
+        self.stats['stream_frames_dropped'] += viewer.frames_dropped - dropped
+        viewer.part = memoryview(part)
+        viewer.part_is_frame = viewer.events is None or sequence is not None
+        viewer.last_send_time = time.time()
+        self.flush(viewer)
+
+    def flush(self, viewer):
+        """Write as much of the pending part as the socket takes without blocking"""
+        while viewer.part is not None:
+            try:
+                sent = viewer.sock.send(viewer.part)
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.close(viewer)
+                return
+            viewer.progress(sent)
+            if sent < len(viewer.part):
+                viewer.part = viewer.part[sent:]
+                if not viewer.writing:
+                    # Backpressure: wait for the socket instead of queueing newer frames
+                    self.selector.modify(viewer.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, viewer)
+                    viewer.writing = True
+                return
+            viewer.part = None
+            if viewer.part_is_frame:
+                viewer.frames_sent += 1
+                self.stats['stream_frames_sent'] += 1
+            if viewer.on_sent:
+                viewer.on_sent(viewer)
+        if viewer.writing:
+            self.selector.modify(viewer.sock, selectors.EVENT_READ, viewer)
+            viewer.writing = False
+
+    def evict(self, viewer):
+        """Drop a viewer whose part stopped draining (dead peer or hopeless link)"""
+        viewer.evicted = True
+        with self.lock:
+            self.evictions[viewer.id] = {
+                'session': viewer.name,
+                'stream': self.stream_type(viewer),
+                'pending_bytes': viewer.pending,
+                'time': time.time()
+            }
+            while len(self.evictions) > MAX_EVICTION_RECORDS:
+                del self.evictions[next(iter(self.evictions))]
+        self.stats['stream_evictions'] += 1
+        print(f"[-] Evicting {'update' if viewer.events is not None else 'stream'} viewer {viewer.id} "
+              f"(session {viewer.name or '-'}): no progress for "
+              f"{time.time() - viewer.last_progress:.1f}s ({viewer.pending} bytes pending)")
+        self.close(viewer)
+
+    def close(self, viewer):
+        with self.lock:
+            if self.viewers.pop(viewer.sock, None) is None:
+                return
+            if viewer in self.added:
+                self.added.remove(viewer)
+        try:
+            self.selector.unregister(viewer.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            viewer.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        viewer.sock.close()
+        if viewer.on_close:
+            try:
+                viewer.on_close(viewer)
+            except Exception as e:
+                print(f"[-] Stream cleanup failed: {e}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        with self.lock:
+            stats['stream_viewers'] = len(self.viewers)
+            stats['update_viewers'] = sum(1 for viewer in self.viewers.values() if viewer.events is not None)
+        return stats
+
+    @staticmethod
+    def stream_type(viewer):
+        return 'updates' if viewer.events is not None else 'mjpeg'
+
+    def viewer_stats(self):
+        """Per-viewer traffic keyed by viewer id: session, stream type, frames sent/dropped, drain rate"""
+        with self.lock:
+            viewers = list(self.viewers.values())
+        return {
+            viewer.id: dict(viewer.link_stats(), session=viewer.name, stream=self.stream_type(viewer))
+            for viewer in viewers
+        }
+
+    def session_stats(self):
+        """viewer_stats() grouped by session: session -> {viewer id: stats}"""
+        sessions = {}
+        for viewer_id, stats in self.viewer_stats().items():
+            sessions.setdefault(stats.pop('session'), {})[viewer_id] = stats
+        return sessions
+
+    def eviction_stats(self):
+        """Recently evicted viewers: viewer id -> session, stream type, pending bytes, time"""
+        with self.lock:
+            return {viewer_id: dict(record) for viewer_id, record in self.evictions.items()}
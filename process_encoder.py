@@ -0,0 +1,84 @@
+"""
+Process-pool JPEG encoder
+Encodes tier images in worker processes so the encoding never competes
+with the capture loop and HTTP handler threads for the GIL. Pixels are
+handed over through multiprocessing.shared_memory (one copy, no
+pickling); only the encoded JPEG bytes travel back.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+# Shared memory blocks a worker keeps attached (blocks are replaced when the
+# frame size grows, so old names stop being used)
+MAX_ATTACHED_BLOCKS = 16
+
+_attached = {}  # Worker side: block name -> SharedMemory
+
+
+def encode_shared(name, shape, params):
+    """Worker: JPEG-encode the image stored in shared memory block `name`"""
+    block = _attached.get(name)
+    if block is None:
+        if len(_attached) >= MAX_ATTACHED_BLOCKS:
+            for stale in _attached.values():
+                stale.close()
+            _attached.clear()
+        block = shared_memory.SharedMemory(name=name)
+        _attached[name] = block
+    image = np.ndarray(shape, dtype=np.uint8, buffer=block.buf)
+    result, encoded = cv2.imencode('.jpg', image, params)
+    del image  # Release the view of the block before returning
+    return encoded.tobytes() if result else None
+
+
+class ProcessEncoder:
+    """Pool of encoder processes plus one shared memory slot per concurrent image
+
+    encode() blocks until every image is done, so a slot is free again
+    for the next frame as soon as it returns.
+    """
+
+    def __init__(self, workers):
+        # spawn: forking a process full of capture/HTTP threads and locks is unsafe
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.workers = workers
+        self.slots = []
+
+    def _slot(self, index, size):
+        """Shared memory block number `index`, at least `size` bytes"""
+        if index < len(self.slots) and self.slots[index].size >= size:
+            return self.slots[index]
+        block = shared_memory.SharedMemory(create=True, size=size)
+        if index < len(self.slots):
+            self._release(self.slots[index])
+            self.slots[index] = block
+        else:
+            self.slots.append(block)
+        return block
+
+    def _release(self, block):
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+    def encode(self, jobs):
+        """Encode [(image, imencode params), ...], returns JPEG bytes (or None) per job"""
+        futures = []
+        for index, (image, params) in enumerate(jobs):
+            block = self._slot(index, image.nbytes)
+            np.ndarray(image.shape, dtype=np.uint8, buffer=block.buf)[...] = image
+            futures.append(self.pool.submit(encode_shared, block.name, image.shape, params))
+        return [future.result() for future in futures]
+
+    def close(self):
+        """Stop the workers and free the shared memory"""
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        for block in self.slots:
+            self._release(block)
+        self.slots = []
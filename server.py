@@ -1,3 +1,5 @@
+import asyncio
+import functools
 import socket
 import threading
 import pickle
@@ -5,34 +7,69 @@ import struct
 import random
 import string
 import time
-from mss import mss
-import cv2
 import numpy as np
 from datetime import datetime
+from capture_engine import CursorFeed, DeltaViewer, ViewerLink, CURSOR_FPS, KEEPALIVE_INTERVAL
+from capture_daemon import create_engine
+from wire_format import (HELLO_PREFIX, WIRE_COMMAND, encode_message, parse_line, select_capabilities,
+                         selected_line)
+
+# While a message drains, the writer checks this often whether the client's
+# socket still makes progress (no progress for STALL_TIMEOUT evicts it)
+DRAIN_CHECK_INTERVAL = 0.5
+
+# After APPROVED, how long to wait for a client's HELLO (or first commands)
+# before streaming with the legacy defaults; current clients send it at once
+NEGOTIATION_TIMEOUT = 1.0
+
+# Longest control command kept while waiting for the rest of its line;
+# anything longer is not a command and is dropped
+MAX_COMMAND_LENGTH = 4096
+
+
+class TCPClient(ViewerLink):
+    """Streaming state of one approved desktop client"""
+
+    def __init__(self, reader, writer, address, engine, keyframe_interval):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+        self.address = address
+        self.quality = 'MEDIUM'  # Default quality for new clients
+        # Delta mode (MODE:DELTA): only changed tiles (and scroll copies)
+        # are sent, the client patches its own canvas
+        self.delta_mode = False
+        self.delta = DeltaViewer(engine, keyframe_interval)
+        # Cursor channel (CURSOR): the client draws the pointer itself from
+        # small cursor messages, so frames no longer carry it
+        self.cursor_feed = None
+        # Binary wire format (WIRE:1): raw JPEG payloads behind a fixed header
+        # instead of pickled messages
+        self.wire = False
+        # Capability handshake (HELLO / SELECTED): what the client advertised
+        # and what the server picked, None for clients that predate it
+        self.capabilities = None
+        self.negotiated = None
+        self.command_buffer = b''  # Control bytes still waiting for their newline
+        self.wake = asyncio.Event()  # Set on every new frame and control command
+        self.last_send_time = 0
+        self.evicted = False
 
-# Import for cursor capture
-try:
-    import pyautogui
-    CURSOR_AVAILABLE = True
-except ImportError:
-    CURSOR_AVAILABLE = False
-    print("[!] Warning: pyautogui not installed. Cursor won't be visible. Install with: pip install pyautogui")
 
 class ScreenShareServer:
-    def __init__(self, host='0.0.0.0', port=5555):
+    def __init__(self, host='0.0.0.0', port=5555, capture_source=None, engine=None):
         self.host = host
         self.port = port
-        self.server_socket = None
+        self.server = None  # asyncio server, runs on self.loop
+        self.loop = None
+        self.stop_event = None
+        self.client_tasks = set()
         self.security_code = None
         self.clients = []
         self.sharing = False
+        self.prompt_lock = threading.Lock()  # Serializes operator prompts (may be shared with a web server)
         
         # Multi-user performance optimizations
-        self.frame_cache = {}  # Cache frames for different quality levels
-        self.cache_lock = threading.Lock()
-        self.current_frame = None
-        self.frame_lock = threading.Lock()
-        self.adaptive_fps = 20  # Dynamic FPS based on user count
         self.user_count_lock = threading.Lock()
         self.quality_settings = {
             'HIGH': {'scale': 100, 'jpeg_quality': 95},
@@ -40,13 +77,20 @@ class ScreenShareServer:
             'LOW': {'scale': 70, 'jpeg_quality': 75}
         }
         self.current_quality = 'MEDIUM'  # Default quality
+        self.delta_keyframe_interval = 30.0  # Seconds between full keyframes for delta clients
         self.performance_stats = {
-            'frames_captured': 0,
             'frames_served': 0,
-            'active_clients': 0,
-            'avg_frame_time': 0
+            'delta_updates_served': 0,
+            'frames_dropped': 0,
+            'clients_evicted': 0,
+            'active_clients': 0
         }
-        self.capture_thread = None
+        self.evictions = {}  # Client IP -> times it was evicted
+        
+        # Capture/encode pipeline (may be shared with other servers)
+        if engine is None:
+            engine = create_engine(capture_source=capture_source, quality_settings=self.quality_settings)
+        self.engine = engine
     
     def get_local_ip(self):
         """Get the local IP address of this machine"""
@@ -67,284 +111,458 @@ class ScreenShareServer:
         self.security_code = ''.join(random.choice(characters) for _ in range(length))
         return self.security_code
     
-    def capture_screen_loop(self):
-        """Optimized screen capture with multi-user performance enhancements"""
-        sct = mss()
-        frame_count = 0
-        
-        print("[*] Starting optimized capture loop for multi-user performance")
-        
-        while self.sharing:
-            capture_start = time.time()
-            
-            try:
-                # Dynamic FPS adjustment based on user count
-                with self.user_count_lock:
-                    active_count = len(self.clients)
-                    
-                    # Adaptive FPS: More users = lower FPS to maintain performance
-                    if active_count == 0:
-                        self.adaptive_fps = 20  # Full speed when no viewers
-                    elif active_count <= 2:
-                        self.adaptive_fps = 20  # Full speed for 1-2 users
-                    elif active_count <= 5:
-                        self.adaptive_fps = 15  # Slight reduction for 3-5 users
-                    elif active_count <= 10:
-                        self.adaptive_fps = 12  # Further reduction for 6-10 users
-                    else:
-                        self.adaptive_fps = 8   # Conservative for 10+ users
-                
-                # Capture the primary monitor
-                monitor = sct.monitors[1]
-                screenshot = sct.grab(monitor)
-                
-                # Convert to numpy array
-                img = np.array(screenshot)
-                
-                # Convert BGRA to BGR (remove alpha channel)
-                img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                
-                # Draw cursor on the image (only once for all users)
-                if CURSOR_AVAILABLE:
-                    try:
-                        # Get cursor position
-                        cursor_x, cursor_y = pyautogui.position()
-                        
-                        # Adjust cursor position relative to monitor
-                        cursor_x -= monitor['left']
-                        cursor_y -= monitor['top']
-                        
-                        # Draw cursor (optimized for performance)
-                        cursor_size = 12
-                        cursor_thickness = 2
-                        
-                        # Draw outer circle (white outline for visibility on any background)
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
-                        # Draw inner circle (black for contrast)
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
-                        # Draw center dot (red for visibility)
-                        cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
-                        
-                    except Exception:
-                        # Cursor drawing failed, continue without cursor
-                        pass
-                
-                # Generate frames for all quality levels (cache optimization)
-                with self.cache_lock:
-                    self.frame_cache.clear()  # Clear old cache
-                    
-                    for quality_name, quality_config in self.quality_settings.items():
-                        # Create frame for each quality level
-                        scale_percent = quality_config['scale']
-                        jpeg_quality = quality_config['jpeg_quality']
-                        
-                        # Resize image for this quality
-                        if scale_percent == 100:
-                            quality_img = img.copy()
-                        else:
-                            width = int(img.shape[1] * scale_percent / 100)
-                            height = int(img.shape[0] * scale_percent / 100)
-                            quality_img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)  # Faster for downscaling
-                        
-                        # Encode with quality-specific settings
-                        encode_param = [
-                            int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality,
-                            int(cv2.IMWRITE_JPEG_OPTIMIZE), 1
-                        ]
-                        result, encoded_img = cv2.imencode('.jpg', quality_img, encode_param)
-                        
-                        # Cache the encoded frame
-                        self.frame_cache[quality_name] = encoded_img
-                
-                # Update current frame (backward compatibility)
-                with self.frame_lock:
-                    self.current_frame = self.frame_cache.get(self.current_quality)
-                
-                # Performance tracking
-                capture_time = time.time() - capture_start
-                frame_count += 1
-                
-                # Update stats every 100 frames
-                if frame_count % 100 == 0:
-                    self.performance_stats['frames_captured'] = frame_count
-                    self.performance_stats['active_clients'] = len(self.clients)
-                    self.performance_stats['avg_frame_time'] = capture_time
-                    
-                    if len(self.clients) > 0:
-                        print(f"[📊] Performance: {len(self.clients)} clients, "
-                              f"{self.adaptive_fps} FPS, "
-                              f"{capture_time*1000:.1f}ms/frame")
-                
-                # Dynamic sleep based on adaptive FPS
-                sleep_time = max(0, (1.0 / self.adaptive_fps) - capture_time)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                
-            except Exception as e:
-                print(f"[-] Error capturing screen: {e}")
-                time.sleep(1)
-        
-        sct.close()
-        print("[*] Screen capture loop ended")
-    
     def get_cached_frame(self, quality='MEDIUM'):
         """Get cached frame for specific quality level"""
-        with self.cache_lock:
-            cached_frame = self.frame_cache.get(quality)
-            if cached_frame is not None:
-                self.performance_stats['frames_served'] += 1
-                return cached_frame
+        return self.get_cached_frame_with_sequence(quality)[0]
+    
+    def get_cached_frame_with_sequence(self, quality='MEDIUM'):
+        """Get cached frame for specific quality level plus its engine sequence number"""
+        frame, sequence = self.engine.get_frame_with_sequence(quality)
+        if frame is None:
+            # Fallback to the default quality
+            frame, sequence = self.engine.get_frame_with_sequence(self.current_quality)
+        if frame is not None:
+            self.performance_stats['frames_served'] += 1
+            # The client unpickles a numpy array, so wrap the bytes (no copy)
+            return np.frombuffer(frame, dtype=np.uint8), sequence
+        return None, sequence
+    
+    def parse_control_messages(self, client, data):
+        """Complete commands in a client's control bytes
+
+        Commands are newline terminated (QUALITY:HIGH, MODE:DELTA, MODE:FULL,
+        KEYFRAME, CURSOR, WIRE:1) and may arrive split across reads: bytes
+        after the last newline wait in client.command_buffer for the rest of
+        their line. Older clients send a single QUALITY:X without a newline,
+        so a buffered tail that is a whole QUALITY command is taken as is.
+        The stream mode is normally settled by negotiate() instead.
+        """
+        complete, _, partial = (client.command_buffer + data).rpartition(b'\n')
+        text = complete.decode('utf-8', 'ignore')
+        commands = [line.strip() for line in text.split('\n') if line.strip()]
         
-        # Fallback to current frame
-        with self.frame_lock:
-            if self.current_frame is not None:
-                self.performance_stats['frames_served'] += 1
-                return self.current_frame
-        return None
+        tail = partial.decode('utf-8', 'ignore').strip()
+        if tail.startswith("QUALITY:") and tail[len("QUALITY:"):] in self.quality_settings:
+            commands.append(tail)
+            partial = b''
+        client.command_buffer = partial if len(partial) <= MAX_COMMAND_LENGTH else b''
+        return commands
+    
+    def get_client_stats(self):
+        """Per-client traffic: frames sent/dropped, drain rate, evictions"""
+        stats = {}
+        for client in list(self.clients):
+            address = client.address
+            stats[f"{address[0]}:{address[1]}"] = dict(
+                client.link_stats(),
+                quality=client.quality,
+                mode='delta' if client.delta_mode else 'full',
+                negotiated=client.negotiated,
+                evictions=self.evictions.get(address[0], 0))
+        return stats
+    
+    def get_performance_stats(self):
+        """Server stats merged with the capture engine's stats"""
+        stats = self.performance_stats.copy()
+        stats.update(self.engine.get_performance_stats())
+        stats['active_clients'] = len(self.clients)
+        return stats
+    
+    def ask_approval(self, address):
+        """Ask the operator to approve a client (blocking, runs off the event loop)"""
+        with self.prompt_lock:
+            print(f"\n{'='*60}")
+            print(f"[!] Connection request from {address}")
+            print(f"{'='*60}")
+            
+            # Ask server operator for approval
+            return input("Do you want to allow this connection? (y/n): ").strip().lower()
     
-    def handle_client(self, client_socket, address):
+    async def handle_client(self, reader, writer):
         """Handle individual client connection with multi-user optimization"""
+        address = writer.get_extra_info('peername')
         print(f"[*] Connection from {address}")
-        client_quality = 'MEDIUM'  # Default quality for new clients
+        self.client_tasks.add(asyncio.current_task())
+        client = None
         
         try:
             # Receive security code from client
-            received_code = client_socket.recv(1024).decode('utf-8').strip()
+            received_code = (await reader.read(1024)).decode('utf-8').strip()
             
             print(f"[DEBUG] Expected code: '{self.security_code}' (length: {len(self.security_code)})")
             print(f"[DEBUG] Received code: '{received_code}' (length: {len(received_code)})")
             print(f"[DEBUG] Codes match: {received_code == self.security_code}")
             
             if received_code == self.security_code:
-                # Code is correct, now ask for manual approval
-                print(f"\n{'='*60}")
-                print(f"[!] Connection request from {address}")
-                print(f"{'='*60}")
-                
                 # Send waiting status to client
-                client_socket.send(b"WAITING_APPROVAL\n")
+                writer.write(b"WAITING_APPROVAL\n")
+                await writer.drain()
                 
-                # Ask server operator for approval
-                approval = input("Do you want to allow this connection? (y/n): ").strip().lower()
+                # Code is correct, now ask for manual approval (one prompt at a time,
+                # other clients keep streaming meanwhile)
+                approval = await self.loop.run_in_executor(None, self.ask_approval, address)
                 
                 if approval in ['y', 'yes']:
                     # Approved
-                    client_socket.send(b"APPROVED\n")
+                    writer.write(b"APPROVED\n")
+                    await writer.drain()
+                    
+                    # drain() only returns once the kernel took everything, so a
+                    # frame is never queued behind another one in user space
+                    writer.transport.set_write_buffer_limits(0)
                     
                     # Add client to active list (thread-safe)
+                    client = TCPClient(reader, writer, address, self.engine, self.delta_keyframe_interval)
                     with self.user_count_lock:
-                        self.clients.append(client_socket)
+                        self.clients.append(client)
                         active_count = len(self.clients)
+                    await self.subscribe(client)
                     
                     print(f"[+] Client {address} connection approved (Total clients: {active_count})")
                     print(f"[📺] Streaming with adaptive quality optimization")
                     print(f"[📊] Multi-user performance mode enabled")
                     
-                    # Set socket timeout for quality change requests
-                    client_socket.settimeout(0.1)
-                    
-                    # Performance tracking for this client
-                    frame_count = 0
-                    last_stats_time = time.time()
-                    
-                    # Stream optimized frames to this client
-                    while self.sharing:
-                        try:
-                            # Check for quality change requests (non-blocking)
-                            try:
-                                data = client_socket.recv(64)
-                                if data and data.startswith(b"QUALITY:"):
-                                    new_quality = data.decode().replace("QUALITY:", "").strip()
-                                    if new_quality in self.quality_settings:
-                                        client_quality = new_quality
-                                        print(f"[📺] Client {address} changed quality to {client_quality}")
-                            except socket.timeout:
-                                pass  # No quality change request
-                            except (ConnectionResetError, BrokenPipeError):
-                                break  # Client disconnected
-                            
-                            # Get cached frame for client's quality level
-                            frame = self.get_cached_frame(client_quality)
-                            
-                            if frame is not None:
-                                # Serialize and send frame (compatible with existing client)
-                                data = pickle.dumps(frame)
-                                message_size = struct.pack("L", len(data))
-                                
-                                try:
-                                    client_socket.settimeout(1.0)  # Timeout for sending
-                                    client_socket.sendall(message_size + data)
-                                    frame_count += 1
-                                except (BrokenPipeError, ConnectionResetError, socket.timeout):
-                                    break
-                            
-                            # Adaptive frame rate based on user count
-                            with self.user_count_lock:
-                                current_user_count = len(self.clients)
-                            
-                            # Dynamic delay based on client count
-                            if current_user_count <= 2:
-                                client_delay = 0.033  # ~30 FPS for 1-2 users
-                            elif current_user_count <= 5:
-                                client_delay = 0.050  # ~20 FPS for 3-5 users
-                            elif current_user_count <= 10:
-                                client_delay = 0.067  # ~15 FPS for 6-10 users
-                            else:
-                                client_delay = 0.100  # ~10 FPS for 10+ users
-                            
-                            time.sleep(client_delay)
-                            
-                            # Log performance stats periodically
-                            current_time = time.time()
-                            if current_time - last_stats_time >= 30:  # Every 30 seconds
-                                if last_stats_time > 0:
-                                    fps = frame_count / (current_time - last_stats_time)
-                                    print(f"[📊] Client {address}: Quality={client_quality}, "
-                                          f"FPS={fps:.1f}, Total clients={current_user_count}")
-                                frame_count = 0
-                                last_stats_time = current_time
-                            
-                        except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError) as e:
-                            print(f"[*] Client {address} disconnected gracefully")
-                            break
-                        except OSError as e:
-                            # Windows error 10053 and similar connection aborts
-                            if e.winerror == 10053 or 'connection' in str(e).lower():
-                                print(f"[*] Client {address} closed the connection")
-                            else:
-                                print(f"[-] Network error with {address}: {e}")
-                            break
-                        except Exception as e:
-                            print(f"[-] Unexpected error sending to {address}: {e}")
-                            break
+                    await self.negotiate(client)
+                    await self.stream_client(client)
                 else:
                     # Rejected
-                    client_socket.send(b"REJECTED\n")
+                    writer.write(b"REJECTED\n")
+                    await writer.drain()
                     print(f"[-] Client {address} connection rejected")
             else:
-                client_socket.send(b"UNAUTHORIZED\n")
+                writer.write(b"UNAUTHORIZED\n")
+                await writer.drain()
                 print(f"[-] Client {address} provided wrong code: '{received_code}'")
-                
+        
+        except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError):
+            print(f"[*] Client {address} disconnected gracefully")
+        except asyncio.CancelledError:
+            pass  # Server stopping
         except Exception as e:
             print(f"[-] Error handling client {address}: {e}")
         finally:
+            self.client_tasks.discard(asyncio.current_task())
+            
             # Remove client from active list (thread-safe)
             with self.user_count_lock:
-                if client_socket in self.clients:
-                    self.clients.remove(client_socket)
+                if client in self.clients:
+                    self.clients.remove(client)
                 remaining_count = len(self.clients)
+            if client is not None:
+                self.engine.unsubscribe(client)
+                if client.evicted:
+                    self.evictions[address[0]] = self.evictions.get(address[0], 0) + 1
+                    self.performance_stats['clients_evicted'] += 1
+                    print(f"[-] Client {address} evicted: no progress for "
+                          f"{time.time() - client.last_progress:.1f}s ({client.pending} bytes pending)")
             
             try:
-                client_socket.close()
-            except:
+                writer.close()
+            except Exception:
                 pass
             
             print(f"[-] Client {address} disconnected (Remaining clients: {remaining_count})")
     
+    async def negotiate(self, client):
+        """Settle codec, transport, features and tier before the first frame
+
+        A HELLO line gets the most efficient common set back as a SELECTED
+        line. Older clients send separate commands (or nothing) instead and
+        keep the format they asked for.
+        """
+        try:
+            data = await asyncio.wait_for(client.reader.read(1024), NEGOTIATION_TIMEOUT)
+        except asyncio.TimeoutError:
+            return  # Oldest clients say nothing: pickled full frames
+        if not data:
+            raise ConnectionResetError
+        if not data.startswith(HELLO_PREFIX.encode('utf-8')):
+            for command in self.parse_control_messages(client, data):
+                await self.apply_command(client, command)
+            return
+        
+        if b'\n' not in data:
+            try:
+                data += await asyncio.wait_for(client.reader.readline(), NEGOTIATION_TIMEOUT)
+            except (asyncio.TimeoutError, ValueError):  # Stalled, or a line over the reader's limit
+                print(f"[-] Client {client.address} sent an incomplete HELLO - using defaults")
+                return
+        line, _, rest = data.partition(b'\n')
+        hello = parse_line(line, HELLO_PREFIX)
+        if hello is None:
+            print(f"[-] Client {client.address} sent an unreadable HELLO - using defaults")
+            return
+        
+        selection = select_capabilities(hello)
+        selection['quality'] = self.choose_tier(hello)
+        selection['screen_size'] = list(self.engine.screen_size())
+        client.writer.write(selected_line(selection))
+        await client.writer.drain()
+        
+        client.capabilities = hello
+        client.negotiated = selection
+        if selection['transport'] == 'wire1':
+            await self.apply_command(client, WIRE_COMMAND)
+        if 'delta' in selection['features']:
+            await self.apply_command(client, "MODE:DELTA")
+        if 'cursor' in selection['features']:
+            await self.apply_command(client, "CURSOR")
+        if selection['quality'] != client.quality:
+            await self.apply_command(client, f"QUALITY:{selection['quality']}")
+        print(f"[📺] Client {client.address} negotiated {selection['codec']} over {selection['transport']}, "
+              f"features={selection['features'] or 'none'}, quality={selection['quality']}")
+        
+        # Commands sent right behind the HELLO
+        for command in self.parse_control_messages(client, rest):
+            await self.apply_command(client, command)
+    
+    def choose_tier(self, hello):
+        """Tier for a HELLO: the one asked for, but no larger than max_resolution
+        and no larger than needed to fill the viewport"""
+        requested = str(hello.get('quality') or '').upper()
+        tier = requested if requested in self.quality_settings else self.current_quality
+        width, height = self.engine.screen_size()
+        if not width or not height:
+            return tier  # Screen size not known yet
+        
+        def tier_size(name):
+            scale = self.quality_settings[name]['scale'] / 100
+            return int(width * scale), int(height * scale)
+        
+        def parse_size(value):
+            try:
+                size_width, size_height = (int(part) for part in value)
+            except (TypeError, ValueError):
+                return None
+            return (size_width, size_height) if size_width > 0 and size_height > 0 else None
+        
+        # Largest first
+        tiers = sorted(self.quality_settings, key=lambda name: self.quality_settings[name]['scale'], reverse=True)
+        tiers = tiers[tiers.index(tier):]
+        
+        max_resolution = parse_size(hello.get('max_resolution'))
+        if max_resolution:
+            fitting = [name for name in tiers
+                       if tier_size(name)[0] <= max_resolution[0] and tier_size(name)[1] <= max_resolution[1]]
+            tiers = fitting or tiers[-1:]
+        
+        viewport = parse_size(hello.get('viewport'))
+        if viewport:
+            covering = [name for name in tiers
+                        if tier_size(name)[0] >= viewport[0] or tier_size(name)[1] >= viewport[1]]
+            if covering:
+                return covering[-1]
+        return tiers[0]
+    
+    async def stream_client(self, client):
+        """Run the client's control reader and frame writer until either one ends"""
+        tasks = [asyncio.ensure_future(self.read_commands(client)),
+                 asyncio.ensure_future(self.write_frames(client))]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()  # Re-raise a connection error
+        finally:
+            for task in tasks:
+                task.cancel()
+    
+    async def read_commands(self, client):
+        """Apply control commands as they arrive (no polling between frames)"""
+        while self.sharing:
+            data = await client.reader.read(64)
+            if not data:
+                return  # Client closed the connection
+            for command in self.parse_control_messages(client, data):
+                await self.apply_command(client, command)
+            client.wake.set()  # Let the writer act on it right away
+    
+    async def subscribe(self, client, **modes):
+        """(Re)subscribe a client on its tier from an executor thread
+
+        Subscribing to a tier nobody watched encodes it right away, which
+        must not hold up the other clients' reads and writes on the loop.
+        """
+        await self.loop.run_in_executor(
+            None, functools.partial(self.engine.subscribe, client, client.quality, **modes))
+    
+    async def apply_command(self, client, command):
+        """Apply one control command to a client's streaming state"""
+        if command.startswith("QUALITY:"):
+            new_quality = command.replace("QUALITY:", "").strip()
+            if new_quality in self.quality_settings:
+                client.quality = new_quality
+                client.delta.request_keyframe()  # New tier size
+                await self.subscribe(client, tiles=client.delta_mode)
+                print(f"[📺] Client {client.address} changed quality to {client.quality}")
+        elif command in ("MODE:DELTA", "MODE:FULL"):
+            client.delta_mode = command == "MODE:DELTA"
+            client.delta.request_keyframe()
+            await self.subscribe(client, tiles=client.delta_mode)
+            print(f"[📺] Client {client.address} switched to {'delta' if client.delta_mode else 'full frame'} mode")
+        elif command == "KEYFRAME":
+            client.delta.request_keyframe()
+        elif command == "CURSOR" and client.cursor_feed is None:
+            client.cursor_feed = CursorFeed(self.engine)
+            await self.subscribe(client, cursor=True)
+            print(f"[📺] Client {client.address} draws the cursor itself")
+        elif command.startswith("WIRE:"):
+            if command == WIRE_COMMAND:
+                client.wire = True
+                print(f"[📺] Client {client.address} switched to the binary wire format")
+            else:
+                print(f"[-] Client {client.address} asked for unsupported {command} - keeping pickled messages")
+    
+    def next_frame(self, client):
+        """(message, sequence) the client should get now, message None if it is up to date
+
+        May encode a tier or changed tiles: write_frames() calls it from an
+        executor thread, never on the event loop.
+        """
+        if client.delta_mode:
+            # Changed tiles since the client's last frame (or a keyframe)
+            update = client.delta.next_update(client.quality)
+            return update, update['sequence'] if update else None
+        # Only send when the screen changed (or as a keepalive)
+        client.sync_epoch(self.engine.epoch)
+        frame_key = (client.quality, self.engine.frame_sequence)
+        if frame_key == client.last_sent and time.time() - client.last_send_time < KEEPALIVE_INTERVAL:
+            return None, None
+        # Get cached frame for client's quality level
+        return self.get_cached_frame_with_sequence(client.quality)
+    
+    async def send_message(self, client, message, tier=None, sequence=None):
+        """Send one message: wire format header + raw payload, or pickled for older clients
+
+        Returns False if the client stalled and was marked for eviction.
+        """
+        if client.wire:
+            timestamp = self.engine.frame_timestamp(sequence) if sequence is not None else time.time()
+            buffers = encode_message(message, sequence or 0, client.quality, timestamp)
+        else:
+            # Legacy framing (compatible with existing clients)
+            data = pickle.dumps(message)
+            buffers = [struct.pack("L", len(data)), data]
+        client.queue(sum(len(buffer) for buffer in buffers), tier, sequence)
+        # The JPEG goes to the transport as a view, next to the header
+        client.writer.writelines(buffers)
+        return await self.drain(client)
+
+    async def drain(self, client):
+        """Wait until the socket took the message in flight, tracking its progress"""
+        transport = client.writer.transport
+        while True:
+            client.progress(client.pending - transport.get_write_buffer_size())
+            if not client.pending:
+                return True
+            if client.stalled():
+                client.evicted = True
+                return False
+            try:
+                await asyncio.wait_for(client.writer.drain(), DRAIN_CHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def write_frames(self, client):
+        """Send the newest frame whenever one is published (latest frame wins)
+
+        Frames published while a send is still draining are never queued: the
+        next pass sends whatever is newest by then, so a slow client skips
+        frames instead of falling behind real time.
+        """
+        frame_count = 0
+        last_stats_time = time.time()
+        
+        while self.sharing:
+            client.wake.clear()
+            
+            frame, sequence = await self.loop.run_in_executor(None, self.next_frame, client)
+            if frame is not None:
+                dropped = client.frames_dropped
+                if not await self.send_message(client, frame, client.quality, sequence):
+                    return
+                self.performance_stats['frames_dropped'] += client.frames_dropped - dropped
+                client.frames_sent += 1
+                frame_count += 1
+                client.last_send_time = time.time()
+                if client.delta_mode:
+                    self.performance_stats['delta_updates_served'] += 1
+                    client.delta.sent(frame)
+            
+            # Pointer moved: a few dozen bytes instead of new frames
+            cursor = None
+            if client.cursor_feed:
+                cursor = await self.loop.run_in_executor(None, client.cursor_feed.next_update, client.quality)
+            if cursor is not None and not await self.send_message(client, cursor):
+                return
+            
+            # Log performance stats periodically
+            current_time = time.time()
+            if current_time - last_stats_time >= 30:  # Every 30 seconds
+                fps = frame_count / (current_time - last_stats_time)
+                print(f"[📊] Client {client.address}: Quality={client.quality}, "
+                      f"FPS={fps:.1f}, Dropped={client.frames_dropped}, Total clients={len(self.clients)}")
+                frame_count = 0
+                last_stats_time = current_time
+            
+            # Sleep until a new frame or control command wakes this client, or the
+            # cursor tick / keepalive is due (a new frame may already have arrived)
+            if not client.wake.is_set():
+                timeout = KEEPALIVE_INTERVAL - (time.time() - client.last_send_time)
+                if client.cursor_feed:
+                    timeout = min(timeout, 1.0 / CURSOR_FPS)
+                try:
+                    await asyncio.wait_for(client.wake.wait(), max(timeout, 0.01))
+                except asyncio.TimeoutError:
+                    pass
+    
+    def wake_clients(self):
+        """Wake every client's writer (runs on the event loop)"""
+        for client in list(self.clients):
+            client.wake.set()
+    
+    def watch_frames(self):
+        """Wake the clients whenever the engine publishes a frame"""
+        seen = self.engine.frame_sequence
+        while self.sharing:
+            sequence = self.engine.wait_for_frame(seen, 0.1).sequence
+            if sequence != seen:
+                seen = sequence
+                try:
+                    self.loop.call_soon_threadsafe(self.wake_clients)
+                except RuntimeError:
+                    break  # Event loop closed
+    
+    async def serve(self):
+        """Accept clients until stop_sharing() is called"""
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.client_tasks = set()
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, reuse_address=True)
+        self.sharing = True
+        
+        print(f"[*] Server listening on {self.host}:{self.port}")
+        print("[*] Starting optimized screen capture loop...")
+        
+        # Start the shared capture engine with multi-user optimization
+        self.engine.start()
+        threading.Thread(target=self.watch_frames, name='tcp-frames', daemon=True).start()
+        
+        print("[*] Waiting for connections...")
+        
+        try:
+            await self.stop_event.wait()
+        finally:
+            # Close all client connections
+            self.server.close()
+            for task in list(self.client_tasks):
+                task.cancel()
+            await asyncio.gather(*self.client_tasks, return_exceptions=True)
+            await self.server.wait_closed()
+    
     def start_sharing(self):
         """Start the screen sharing server"""
-        # Generate security code
-        code = self.generate_security_code()
+        # Generate security code (unless one was assigned, e.g. in combined mode)
+        code = self.security_code or self.generate_security_code()
         
         # Get local IP address
         local_ip = self.get_local_ip()
@@ -359,44 +577,10 @@ class ScreenShareServer:
         print(f"   Security Code: {code}")
         print("="*60 + "\n")
         
-        # Create server socket
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        
+        # One event loop serves every client: a reader task for control
+        # messages and a writer task for frames per connection
         try:
-            self.server_socket.bind((self.host, self.port))
-            self.server_socket.listen(5)
-            self.sharing = True
-            
-            print(f"[*] Server listening on {self.host}:{self.port}")
-            print("[*] Starting optimized screen capture loop...")
-            
-            # Start the screen capture thread with multi-user optimization
-            capture_thread = threading.Thread(target=self.capture_screen_loop, daemon=True)
-            capture_thread.start()
-            
-            print("[*] Waiting for connections...")
-            
-            # Accept client connections
-            while self.sharing:
-                try:
-                    self.server_socket.settimeout(1.0)
-                    client_socket, address = self.server_socket.accept()
-                    
-                    # Handle each client in a separate thread
-                    client_thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, address),
-                        daemon=True
-                    )
-                    client_thread.start()
-                    
-                except socket.timeout:
-                    continue
-                except Exception as e:
-                    if self.sharing:
-                        print(f"[-] Error accepting connection: {e}")
-                    
+            asyncio.run(self.serve())
         except Exception as e:
             print(f"[-] Server error: {e}")
         finally:
@@ -405,22 +589,17 @@ class ScreenShareServer:
     def stop_sharing(self):
         """Stop the screen sharing server"""
         print("\n[*] Stopping server...")
+        was_sharing = self.sharing
         self.sharing = False
+        if was_sharing:
+            self.engine.stop()
         
-        # Close all client connections
-        for client in self.clients:
-            try:
-                client.close()
-            except:
-                pass
-        self.clients.clear()
-        
-        # Close server socket
-        if self.server_socket:
+        # Wake the event loop so it closes the listener and all client connections
+        if self.loop is not None and self.stop_event is not None:
             try:
-                self.server_socket.close()
-            except:
-                pass
+                self.loop.call_soon_threadsafe(self.stop_event.set)
+            except RuntimeError:
+                pass  # Loop already finished
         
         print("[*] Server stopped")
 
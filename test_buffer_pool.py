@@ -0,0 +1,91 @@
+"""
+Unit tests for the capture engine's frame buffer pool (capture_engine.BufferPool)
+Run with: python -m pytest -q test_buffer_pool.py
+"""
+
+from capture_engine import BufferPool
+
+SHAPE = (4, 6, 3)
+
+
+def build_frame(pool, generation):
+    pool.begin_frame(generation)
+    return pool.get(SHAPE)
+
+
+def build_frames(pool, generations):
+    """Steady-state capture: each frame retires the one before it"""
+    buffers = []
+    for generation in generations:
+        buffers.append(build_frame(pool, generation))
+        pool.retire(generation - 1)
+    return buffers
+
+
+def contains(buffers, buffer):
+    return any(candidate is buffer for candidate in buffers)
+
+
+def test_retired_arrays_are_reused():
+    pool = BufferPool()
+    first = build_frame(pool, 1)
+    build_frame(pool, 2)
+    pool.retire(1)
+    assert build_frame(pool, 3) is first
+    assert pool.allocations == 2
+
+
+def test_held_buffer_is_not_handed_out_until_released():
+    pool = BufferPool()
+    held = build_frame(pool, 1)
+    hold = pool.hold(1)
+    assert not contains(build_frames(pool, range(2, 6)), held)
+
+    pool.release(hold)
+    assert contains(build_frames(pool, range(6, 9)), held)
+
+
+def test_nested_holds_keep_the_buffer_until_the_last_release():
+    pool = BufferPool()
+    held = build_frame(pool, 1)
+    holds = [pool.hold(1), pool.hold(1)]
+    build_frame(pool, 2)
+    pool.retire(1)
+    pool.release(holds[0])
+    assert build_frame(pool, 3) is not held
+    pool.release(holds[1])
+    assert build_frame(pool, 4) is held
+
+
+def test_held_buffer_is_never_handed_out_after_clear():
+    pool = BufferPool()
+    held = build_frame(pool, 1)
+    stale_hold = pool.hold(1)
+    pool.clear()
+
+    # Same generation again after the pause, held by a new reader
+    current = build_frame(pool, 1)
+    hold = pool.hold(1)
+    pool.release(stale_hold)  # Must not release the new reader's hold
+    build_frame(pool, 2)
+    pool.retire(1)
+    assert build_frame(pool, 3) is not current
+
+    pool.release(hold)
+    handed_out = build_frames(pool, range(4, 8))
+    assert contains(handed_out, current)
+    assert not contains(handed_out, held)
+
+
+def test_failed_attempt_is_reclaimed_by_the_retry():
+    pool = BufferPool()
+    attempt = build_frame(pool, 1)
+    assert build_frame(pool, 1) is attempt
+
+
+def test_reuse_disabled_always_allocates():
+    pool = BufferPool(reuse=False)
+    buffers = [build_frame(pool, generation) for generation in range(1, 4)]
+    pool.retire(2)
+    assert len({id(buffer) for buffer in buffers + [build_frame(pool, 4)]}) == 4
+    assert pool.allocations == 4
@@ -0,0 +1,109 @@
+"""
+Unit tests for per-tile change detection (frame_delta.ChangeDetector, TileTracker)
+Run with: python -m pytest -q test_frame_delta.py
+"""
+
+import numpy as np
+import pytest
+
+from frame_delta import ChangeDetector, TileTracker
+
+TILE = 16
+
+
+def synthetic_frame(height=64, width=96, channels=4, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, channels), dtype=np.uint8)
+
+
+def dirty_tiles(mask):
+    return {(int(row), int(col)) for row, col in np.argwhere(mask)}
+
+
+@pytest.mark.parametrize('channels', [3, 4])
+def test_first_frame_is_all_dirty_and_a_repeat_is_clean(channels):
+    detector = ChangeDetector(TILE)
+    frame = synthetic_frame(channels=channels)
+    assert detector.update(frame).all()
+    assert not detector.update(frame.copy()).any()
+
+
+@pytest.mark.parametrize('channels', [3, 4])
+def test_single_pixel_change_marks_only_its_tile(channels):
+    detector = ChangeDetector(TILE)
+    frame = synthetic_frame(channels=channels)
+    detector.update(frame)
+    changed = frame.copy()
+    changed[37, 50, channels - 1] ^= 1
+    dirty = detector.update(changed)
+    assert dirty.shape == (4, 6)
+    assert dirty_tiles(dirty) == {(37 // TILE, 50 // TILE)}
+
+
+def test_swapped_pixels_are_detected():
+    detector = ChangeDetector(TILE)
+    frame = synthetic_frame()
+    detector.update(frame)
+    swapped = frame.copy()
+    # Same pixels, different places: a plain sum over the tile would not change
+    swapped[3, 2], swapped[3, 9] = frame[3, 9], frame[3, 2]
+    assert dirty_tiles(detector.update(swapped)) == {(0, 0)}
+
+
+def test_partial_edge_tiles():
+    detector = ChangeDetector(TILE)
+    frame = synthetic_frame(height=40, width=70)
+    assert detector.update(frame).shape == (3, 5)
+    changed = frame.copy()
+    changed[39, 69] = 255 - changed[39, 69]
+    assert dirty_tiles(detector.update(changed)) == {(2, 4)}
+
+
+def test_resolution_change_and_reset_mark_everything_dirty():
+    detector = ChangeDetector(TILE)
+    detector.update(synthetic_frame())
+    assert detector.update(synthetic_frame(height=32, width=48)).all()
+    detector.reset()
+    assert detector.update(synthetic_frame(height=32, width=48)).all()
+
+
+def test_tracker_versions_follow_changed_tiles():
+    tracker = TileTracker(TILE)
+    frame = synthetic_frame()
+    tracker.update(frame, 1)
+    assert tracker.start_sequence == 1
+    assert (tracker.versions == 1).all()
+
+    second = frame.copy()
+    second[0:5, 0:5] = 0
+    tracker.update(second, 2)
+    third = second.copy()
+    third[60, 90] = 255 - third[60, 90]
+    tracker.update(third, 3)
+
+    assert tracker.image is third and tracker.sequence == 3
+    assert dirty_tiles(tracker.versions > 1) == {(0, 0), (3, 5)}
+    assert dirty_tiles(tracker.versions > 2) == {(3, 5)}
+    assert not (tracker.versions > 3).any()
+
+
+def test_tracker_versions_are_a_new_array_every_frame():
+    tracker = TileTracker(TILE)
+    frame = synthetic_frame()
+    tracker.update(frame, 1)
+    snapshot = tracker.versions
+    changed = frame.copy()
+    changed[20, 20] = 255 - changed[20, 20]
+    tracker.update(changed, 2)
+    # Readers holding the old versions see a consistent frame
+    assert (snapshot == 1).all()
+    assert tracker.versions[1, 1] == 2
+
+
+def test_tracker_restarts_on_a_new_size():
+    tracker = TileTracker(TILE)
+    tracker.update(synthetic_frame(), 1)
+    tracker.encoded_tiles[(0, 0)] = (1, b'jpeg')
+    tracker.update(synthetic_frame(height=32, width=32), 2)
+    assert tracker.start_sequence == 2
+    assert tracker.versions.shape == (2, 2)
+    assert tracker.encoded_tiles == {}
@@ -0,0 +1,160 @@
+"""
+Unit tests for the capture daemon's shared memory ring (capture_daemon.FrameRing)
+Run with: python -m pytest -q test_frame_ring.py
+"""
+
+import itertools
+import os
+import struct
+import threading
+import time
+
+import pytest
+
+from capture_daemon import RECORD_FRAME, RECORD_TILES, FrameRing
+
+QUALITY_SETTINGS = {'high': {'scale': 100}, 'low': {'scale': 50}}
+SLOTS = 4
+SLOT_SIZE = 1024
+
+ring_names = itertools.count()
+
+
+def create_ring(slots=SLOTS):
+    return FrameRing.create(f'test_ring_{os.getpid()}_{next(ring_names)}', QUALITY_SETTINGS,
+                            slots=slots, slot_size=SLOT_SIZE)
+
+
+@pytest.fixture
+def ring():
+    ring = create_ring()
+    yield ring
+    ring.close()
+
+
+def payload_for(sequence, size=200):
+    return bytes([sequence % 256]) * size
+
+
+def slot_generation(ring, slot):
+    return struct.unpack_from('<Q', ring.buf, ring._slot_offset(slot))[0]
+
+
+class RacingBuffer(bytearray):
+    """Ring memory whose first payload copy runs `race` first, like a writer overtaking the reader"""
+
+    race = None
+
+    def __getitem__(self, key):
+        if isinstance(key, slice) and self.race is not None:
+            race, self.race = self.race, None
+            race()
+        return super().__getitem__(key)
+
+
+def test_write_then_read(ring):
+    assert ring.read('high', RECORD_FRAME) is None
+    assert ring.write(RECORD_FRAME, 'high', 7, payload_for(7), timestamp=123.5)
+    assert ring.newest('high', RECORD_FRAME) == 7
+    assert ring.read('high', RECORD_FRAME) == (7, 0, 123.5, payload_for(7))
+    # Other tiers and record kinds are indexed separately
+    assert ring.read('low', RECORD_FRAME) is None
+    assert ring.read('high', RECORD_TILES) is None
+
+
+def test_generation_is_even_after_every_write(ring):
+    for sequence in range(1, 2 * SLOTS + 1):
+        ring.write(RECORD_FRAME, 'high', sequence, payload_for(sequence))
+    assert all(slot_generation(ring, slot) == 4 for slot in range(SLOTS))
+
+
+def test_oversized_record_is_refused(ring):
+    assert not ring.write(RECORD_FRAME, 'high', 1, bytes(SLOT_SIZE + 1))
+    assert ring.read('high', RECORD_FRAME) is None
+
+
+def test_record_being_written_is_not_served(ring):
+    ring.write(RECORD_FRAME, 'high', 1, payload_for(1))
+    offset = ring._slot_offset(0)
+    generation = slot_generation(ring, 0)
+    struct.pack_into('<Q', ring.buf, offset, generation + 1)  # Writer stopped mid-record
+    assert ring.read('high', RECORD_FRAME) is None
+    struct.pack_into('<Q', ring.buf, offset, generation + 2)
+    assert ring.read('high', RECORD_FRAME) == (1, 0, pytest.approx(time.time(), abs=5), payload_for(1))
+
+
+def test_overwritten_slot_is_not_served_for_the_old_index(ring):
+    ring.write(RECORD_FRAME, 'low', 1, payload_for(1))
+    for sequence in range(2, SLOTS + 2):
+        ring.write(RECORD_FRAME, 'high', sequence, payload_for(sequence))
+    # 'low' still points at slot 0, which now holds a 'high' frame
+    assert ring.read('low', RECORD_FRAME) is None
+    assert ring.read('high', RECORD_FRAME)[0] == SLOTS + 1
+
+
+def test_torn_read_is_retried():
+    ring = create_ring(slots=2)
+    try:
+        ring.write(RECORD_FRAME, 'high', 1, payload_for(1))
+        memory = RacingBuffer(ring.buf)
+        ring.buf = memory
+
+        def overtake():
+            # Two more frames: the second one lands in the slot being copied
+            ring.write(RECORD_FRAME, 'high', 2, payload_for(2, 300))
+            ring.write(RECORD_FRAME, 'high', 3, payload_for(3, 100))
+
+        memory.race = overtake
+        sequence, base, timestamp, payload = ring.read('high', RECORD_FRAME)
+        assert memory.race is None
+        assert (sequence, payload) == (3, payload_for(3, 100))
+    finally:
+        ring.buf = ring.block.buf
+        ring.close()
+
+
+def test_concurrent_reads_are_never_torn(ring):
+    stop = threading.Event()
+
+    def writer():
+        for sequence in itertools.count(1):
+            if stop.is_set():
+                return
+            ring.write(RECORD_FRAME, 'high', sequence, payload_for(sequence, 200 + sequence % 700))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reads = 0
+    try:
+        deadline = time.time() + 0.5
+        while time.time() < deadline:
+            record = ring.read('high', RECORD_FRAME)
+            if record is not None:
+                sequence, _, _, payload = record
+                assert payload == payload_for(sequence, 200 + sequence % 700)
+                reads += 1
+    finally:
+        stop.set()
+        thread.join()
+    assert reads > 0
+
+
+def test_clear_index_forgets_every_record(ring):
+    ring.write(RECORD_FRAME, 'high', 1, payload_for(1))
+    ring.write(RECORD_TILES, 'low', 1, payload_for(1))
+    ring.clear_index()
+    assert ring.read('high', RECORD_FRAME) is None
+    assert ring.newest('low', RECORD_TILES) is None
+
+
+def test_every_ring_has_its_own_epoch(ring):
+    other = create_ring()
+    try:
+        assert ring.header()[5] != other.header()[5]
+    finally:
+        other.close()
+
+
+def test_stats_round_trip(ring):
+    ring.write_stats({'fps': 30})
+    assert ring.read_stats() == {'fps': 30}
@@ -0,0 +1,84 @@
+"""
+Unit tests for the viewer's reusable receive buffer (client.ReceiveBuffer)
+Run with: python -m pytest -q test_receive_buffer.py
+"""
+
+import socket
+
+import pytest
+
+from client import ReceiveBuffer
+
+
+@pytest.fixture
+def sockets():
+    reader, writer = socket.socketpair()
+    yield reader, writer
+    reader.close()
+    writer.close()
+
+
+def receive(buffer, sock, size):
+    buffer.fill(sock, size)
+    view = buffer.peek(size)
+    buffer.consume(size)
+    return view
+
+
+def test_compacts_in_place_without_keep_views(sockets):
+    reader, writer = sockets
+    buffer = ReceiveBuffer(64)
+    for index in range(10):
+        writer.sendall(bytes([index]) * 40)
+        assert bytes(receive(buffer, reader, 40)) == bytes([index]) * 40
+    assert buffer.allocations == 1
+
+
+def test_keep_views_leaves_unreleased_messages_intact(sockets):
+    reader, writer = sockets
+    buffer = ReceiveBuffer(64)
+    buffer.keep_views = True
+    views = []
+    for index in range(6):
+        writer.sendall(bytes([index]) * 40)
+        views.append(receive(buffer, reader, 40))
+    # Nothing released: every wrap needs another array, no message was overwritten
+    assert [bytes(view) for view in views] == [bytes([index]) * 40 for index in range(6)]
+    assert buffer.allocations == 6
+
+
+def test_released_arrays_are_reused(sockets):
+    reader, writer = sockets
+    buffer = ReceiveBuffer(64)
+    buffer.keep_views = True
+    for index in range(20):
+        writer.sendall(bytes([index]) * 40)
+        view = receive(buffer, reader, 40)
+        assert bytes(view) == bytes([index]) * 40
+        buffer.release(buffer.handed_out)
+    # The pipeline alternates between two arrays
+    assert buffer.allocations == 2
+
+
+def test_release_only_frees_arrays_of_released_messages(sockets):
+    reader, writer = sockets
+    buffer = ReceiveBuffer(64)
+    buffer.keep_views = True
+    writer.sendall(b'a' * 40)
+    first = receive(buffer, reader, 40)
+    writer.sendall(b'b' * 40)
+    second = receive(buffer, reader, 40)  # Wrapped: the first array is retired
+    buffer.release(0)
+    writer.sendall(b'c' * 40)
+    receive(buffer, reader, 40)  # Wraps again, must not reuse the first array
+    assert bytes(first) == b'a' * 40
+    assert bytes(second) == b'b' * 40
+
+
+def test_grows_for_a_message_larger_than_the_buffer(sockets):
+    reader, writer = sockets
+    buffer = ReceiveBuffer(64)
+    buffer.keep_views = True
+    writer.sendall(b'x' * 200)
+    assert bytes(receive(buffer, reader, 200)) == b'x' * 200
+    assert len(buffer.buffer) >= 200
@@ -0,0 +1,101 @@
+"""
+Unit tests for scroll/move detection (frame_delta.find_copy_rect via TileTracker)
+Run with: python -m pytest -q test_scroll_detection.py
+"""
+
+import numpy as np
+
+from frame_delta import TileTracker, copy_residual, tile_any
+
+TILE = 16
+HEIGHT, WIDTH = 256, 192
+
+
+def noise(height, width, seed):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def track(previous, image):
+    tracker = TileTracker(TILE)
+    tracker.update(previous, 1)
+    dirty = tracker.update(image, 2)
+    return tracker, dirty
+
+
+def apply_copy(previous, rect):
+    src_x, src_y, width, height, dst_x, dst_y = rect
+    result = previous.copy()
+    result[dst_y:dst_y + height, dst_x:dst_x + width] = previous[src_y:src_y + height, src_x:src_x + width]
+    return result
+
+
+def assert_copy_explains(previous, image, tracker, dirty):
+    """The copy plus the residual tiles rebuild image, with fewer tiles than plain deltas"""
+    assert tracker.copy is not None
+    assert tracker.copy['base'] == 1
+    residual = tracker.copy['residual']
+    assert residual.sum() < dirty.sum()
+    mismatched = tile_any(apply_copy(previous, tracker.copy['rect']) != image, TILE)
+    assert not (mismatched & ~residual).any()
+
+
+def test_vertical_scroll_of_the_whole_screen():
+    previous = noise(HEIGHT, WIDTH, 1)
+    image = np.concatenate([previous[40:], noise(40, WIDTH, 2)])
+    tracker, dirty = track(previous, image)
+    assert_copy_explains(previous, image, tracker, dirty)
+    src_x, src_y, width, height, dst_x, dst_y = tracker.copy['rect']
+    assert (src_x, dst_x) == (0, 0)
+    assert src_y - dst_y == 40
+    # Only the newly revealed rows remain
+    assert tracker.copy['residual'].sum() <= 3 * (WIDTH // TILE)
+
+
+def test_scroll_inside_a_pane_next_to_static_content():
+    previous = noise(HEIGHT, WIDTH, 3)
+    image = previous.copy()
+    # Right pane (x 64..192, y 32..224) scrolls down by 24 pixels
+    image[56:224, 64:] = previous[32:200, 64:]
+    image[32:56, 64:] = noise(24, WIDTH - 64, 4)
+    tracker, dirty = track(previous, image)
+    assert_copy_explains(previous, image, tracker, dirty)
+    src_x, src_y, width, height, dst_x, dst_y = tracker.copy['rect']
+    assert src_x == dst_x and src_x >= 64
+    assert dst_y - src_y == 24
+
+
+def test_horizontal_scroll():
+    previous = noise(HEIGHT, WIDTH, 5)
+    image = np.concatenate([previous[:, 32:], noise(HEIGHT, 32, 6)], axis=1)
+    tracker, dirty = track(previous, image)
+    assert_copy_explains(previous, image, tracker, dirty)
+    src_x, src_y, width, height, dst_x, dst_y = tracker.copy['rect']
+    assert src_y == dst_y
+    assert src_x - dst_x == 32
+
+
+def test_unrelated_change_has_no_copy():
+    previous = noise(HEIGHT, WIDTH, 7)
+    tracker, dirty = track(previous, noise(HEIGHT, WIDTH, 8))
+    assert dirty.all()
+    assert tracker.copy is None
+
+
+def test_blank_screen_does_not_match_a_shift():
+    previous = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    image = previous.copy()
+    image[64:128, 64:128] = 255
+    tracker, dirty = track(previous, image)
+    # Identical blank lines must not vote for any shift
+    assert tracker.copy is None
+
+
+def test_copy_residual_keeps_dirty_state_outside_the_copy():
+    previous = noise(HEIGHT, WIDTH, 9)
+    image = previous.copy()
+    dirty = np.zeros((HEIGHT // TILE, WIDTH // TILE), dtype=bool)
+    dirty[0, 0] = True
+    residual = copy_residual(previous, image, dirty, (0, 96, 64, 32, 0, 128), TILE)
+    assert residual[0, 0]
+    # The copied rows differ from the unchanged image
+    assert residual[8:10, 0:4].all()
@@ -0,0 +1,106 @@
+"""
+Unit tests for tier pyramid calibration (tier_pyramid.TierPyramid)
+Run with: python -m pytest -q test_tier_pyramid.py
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+import tier_pyramid
+from tier_pyramid import CALIBRATION_FRAMES, TierPyramid
+
+QUALITY_SETTINGS = {
+    'full': {'scale': 100},
+    'medium': {'scale': 50},
+    'low': {'scale': 25},
+    'preview': {'scale': 25}
+}
+
+
+def smooth_frame(height=240, width=320):
+    y, x = np.mgrid[0:height, 0:width]
+    return np.dstack([x * 255 // width, y * 255 // height, (x + y) * 127 // (width + height)]).astype(np.uint8)
+
+
+def noise_frame(height=240, width=320, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def favour_linear(source, size, kernel, timings):
+    """Deterministic stand-in for timed_resize: linear is cheapest, cheaper still from a smaller source"""
+    timings.append((1.0 if kernel == cv2.INTER_LINEAR else 2.0) * source.shape[0])
+    return cv2.resize(source, size, interpolation=kernel)
+
+
+@pytest.fixture
+def pyramid():
+    pyramid = TierPyramid()
+    pyramid.timed_resize = favour_linear
+    return pyramid
+
+
+def calibrate(pyramid, img, tiers):
+    for _ in range(CALIBRATION_FRAMES):
+        images = pyramid.build(img, tiers, QUALITY_SETTINGS)
+    return images
+
+
+def test_plan_is_kept_once_every_calibration_frame_is_measured(pyramid):
+    img = smooth_frame()
+    for _ in range(CALIBRATION_FRAMES):
+        assert not pyramid.plans
+        images = pyramid.build(img, ['low', 'medium'], QUALITY_SETTINGS)
+    assert len(pyramid.plans) == 1
+    assert not pyramid.measurements
+    assert images['medium'].shape == (120, 160, 3)
+    assert images['low'].shape == (60, 80, 3)
+
+
+def test_full_and_equal_scale_tiers_share_images(pyramid):
+    img = smooth_frame()
+    images = calibrate(pyramid, img, ['full', 'low', 'preview'])
+    assert images['full'] is img
+    assert images['preview'] is images['low']
+    images = pyramid.build(img, ['full', 'low', 'preview'], QUALITY_SETTINGS)
+    assert images['full'] is img
+    assert images['preview'] is images['low']
+
+
+def test_cheapest_close_enough_path_wins(pyramid):
+    calibrate(pyramid, smooth_frame(), ['low', 'medium'])
+    assert pyramid.describe() == 'medium <- full (linear), low <- medium (linear)'
+
+
+def test_path_below_min_psnr_is_never_chosen(pyramid):
+    img = noise_frame()
+    images = calibrate(pyramid, img, ['low'])
+    # Linear sampling of noise at 25% is far from the area average: the reference is kept
+    assert pyramid.describe() == 'low <- full (area)'
+    assert np.array_equal(images['low'], cv2.resize(img, (80, 60), interpolation=cv2.INTER_AREA))
+
+
+def test_lowest_psnr_over_all_calibration_frames_counts(pyramid):
+    frames = [smooth_frame(), smooth_frame(), noise_frame()]
+    for img in frames:
+        pyramid.build(img, ['low'], QUALITY_SETTINGS)
+    assert pyramid.describe() == 'low <- full (area)'
+
+
+def test_check_falls_back_to_the_reference_on_new_content(pyramid, monkeypatch):
+    calibrate(pyramid, smooth_frame(), ['low'])
+    assert pyramid.describe() == 'low <- full (linear)'
+
+    monkeypatch.setattr(tier_pyramid, 'CHECK_INTERVAL', 0.0)
+    img = noise_frame()
+    images = pyramid.build(img, ['low'], QUALITY_SETTINGS)
+    assert np.array_equal(images['low'], cv2.resize(img, (80, 60), interpolation=cv2.INTER_AREA))
+    assert not pyramid.plans
+
+
+def test_plan_is_measured_again_after_the_recalibrate_interval(pyramid, monkeypatch):
+    calibrate(pyramid, smooth_frame(), ['low'])
+    monkeypatch.setattr(tier_pyramid, 'RECALIBRATE_INTERVAL', 0.0)
+    pyramid.build(smooth_frame(), ['low'], QUALITY_SETTINGS)
+    assert not pyramid.plans
+    assert next(iter(pyramid.measurements.values()))['frames'] == 1
@@ -0,0 +1,52 @@
+"""
+Unit tests for the viewer's reduced-decode choice (client.choose_reduction)
+Run with: python -m pytest -q test_viewer_reduction.py
+"""
+
+import pytest
+
+from client import ScreenShareClient
+
+
+def make_client(quality, frame_size=(1920, 1080), zoomed=False):
+    client = ScreenShareClient()
+    client.quality = quality
+    client.frame_full_size = frame_size
+    client.is_zoomed = zoomed
+    return client
+
+
+@pytest.mark.parametrize("window, expected", [
+    # (window width, height) -> reduction for HIGH, MEDIUM, LOW
+    ((1920, 1080), (1, 1, 1)),
+    ((960, 540), (2, 2, 2)),
+    ((640, 360), (2, 2, 4)),
+    ((480, 270), (4, 4, 4)),
+    ((240, 135), (8, 8, 8)),
+])
+def test_reduction_matrix(window, expected):
+    reductions = tuple(make_client(quality).choose_reduction(*window)
+                       for quality in ('HIGH', 'MEDIUM', 'LOW'))
+    assert reductions == expected
+
+
+@pytest.mark.parametrize("window", [(1920, 1080), (1280, 720), (960, 540), (640, 360), (320, 180)])
+def test_lower_quality_never_decodes_larger(window):
+    high, medium, low = (make_client(quality).choose_reduction(*window)
+                         for quality in ('HIGH', 'MEDIUM', 'LOW'))
+    assert high <= medium <= low
+
+
+def test_picture_still_covers_window_at_quality_detail():
+    for quality, scale in (('HIGH', 1.0), ('MEDIUM', 0.8), ('LOW', 0.6)):
+        client = make_client(quality)
+        for width in (1920, 1280, 960, 640, 480, 320, 200):
+            height = width * 9 // 16
+            reduction = client.choose_reduction(width, height)
+            assert 1920 / reduction >= width * scale
+
+
+def test_no_reduction_while_zoomed_or_unknown():
+    assert make_client('LOW', zoomed=True).choose_reduction(320, 180) == 1
+    assert make_client('LOW', frame_size=None).choose_reduction(320, 180) == 1
+    assert make_client('LOW').choose_reduction(0, 0) == 1
@@ -0,0 +1,175 @@
+"""
+Unit tests for the binary wire format and the HELLO/SELECTED handshake
+Run with: python -m pytest -q test_wire_format.py
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import wire_format
+from wire_format import (HEADER, HEADER_SIZE, SELECTED_PREFIX, HELLO_PREFIX, decode_header, decode_message,
+                         encode_message, hello_line, is_wire_message, loads_legacy, parse_line,
+                         select_capabilities, selected_line)
+
+JPEG = b'\xff\xd8' + bytes(range(256)) * 4 + b'\xff\xd9'
+
+
+def round_trip(message, **kwargs):
+    """Encode a message, check its header, and decode it again"""
+    buffers = encode_message(message, **kwargs)
+    data = b''.join(bytes(buffer) for buffer in buffers)
+    assert is_wire_message(data)
+    kind, tier, sequence, timestamp, length = decode_header(data)
+    assert len(data) == HEADER_SIZE + length
+    return kind, decode_message(kind, tier, sequence, timestamp, memoryview(data)[HEADER_SIZE:])
+
+
+def test_header_layout():
+    assert HEADER.format == '<4sBBBxQdI'
+    assert HEADER_SIZE == 28
+
+
+def test_frame_round_trip():
+    kind, message = round_trip(JPEG, sequence=7, tier='MEDIUM', timestamp=1234.5)
+    assert kind == wire_format.MSG_FRAME
+    assert message['type'] == 'frame'
+    assert message['sequence'] == 7
+    assert message['tier'] == 'medium'
+    assert message['timestamp'] == 1234.5
+    assert bytes(message['data']) == JPEG
+
+
+def test_frame_from_numpy_array():
+    array = np.frombuffer(JPEG, dtype=np.uint8)
+    _, message = round_trip(array, sequence=1, tier='low')
+    assert bytes(message['data']) == JPEG
+
+
+def test_keyframe_round_trip():
+    kind, message = round_trip({'type': 'keyframe', 'sequence': 42, 'data': JPEG}, tier='high')
+    assert kind == wire_format.MSG_KEYFRAME
+    assert message['sequence'] == 42
+    assert message['tier'] == 'high'
+    assert bytes(message['data']) == JPEG
+
+
+def test_tiles_round_trip():
+    tiles = [(0, 0, JPEG[:100]), (64, 128, JPEG[:1]), (1856, 1016, JPEG)]
+    copies = [(0, 64, 1920, 960, 0, 0)]
+    kind, message = round_trip({'type': 'tiles', 'sequence': 9, 'size': (1920, 1080),
+                                'copies': copies, 'tiles': tiles}, tier='medium')
+    assert kind == wire_format.MSG_TILES
+    assert message['sequence'] == 9
+    assert message['size'] == (1920, 1080)
+    assert [tuple(rect) for rect in message['copies']] == copies
+    assert [(x, y, bytes(data)) for x, y, data in message['tiles']] == tiles
+
+
+def test_tiles_without_copies():
+    _, message = round_trip({'type': 'tiles', 'size': (640, 360), 'tiles': []})
+    assert message['copies'] == []
+    assert message['tiles'] == []
+    assert message['tier'] is None
+
+
+def test_keepalive_round_trip():
+    kind, message = round_trip({'type': 'keepalive'})
+    assert kind == wire_format.MSG_KEEPALIVE
+    assert message['type'] == 'keepalive'
+    assert message['tier'] is None
+
+
+@pytest.mark.parametrize("x, y, visible", [(100, 200, True), (-5, -10, False)])
+def test_cursor_round_trip(x, y, visible):
+    kind, message = round_trip({'type': 'cursor', 'x': x, 'y': y, 'visible': visible})
+    assert kind == wire_format.MSG_CURSOR
+    assert (message['x'], message['y'], message['visible']) == (x, y, visible)
+
+
+def test_unknown_message_type_is_skipped():
+    assert decode_message(99, wire_format.NO_TIER, 0, 0.0, memoryview(b'')) is None
+
+
+def test_bad_magic_and_version_are_rejected():
+    with pytest.raises(ValueError):
+        decode_header(HEADER.pack(b'XXXX', wire_format.WIRE_VERSION, 1, 0, 0, 0.0, 0))
+    with pytest.raises(ValueError):
+        decode_header(HEADER.pack(wire_format.WIRE_MAGIC, wire_format.WIRE_VERSION + 1, 1, 0, 0, 0.0, 0))
+    assert not is_wire_message(pickle.dumps({'type': 'frame'}))
+
+
+def test_legacy_pickle_of_data_and_arrays_loads():
+    message = {'type': 'keyframe', 'sequence': 3, 'data': np.frombuffer(JPEG, dtype=np.uint8)}
+    loaded = loads_legacy(pickle.dumps(message))
+    assert loaded['type'] == 'keyframe'
+    assert bytes(loaded['data']) == JPEG
+
+
+class Payload:
+    def __reduce__(self):
+        return (os.system, ('echo unsafe',))
+
+
+@pytest.mark.parametrize("value", [Payload(), pickle.UnpicklingError, {'nested': [Payload()]}])
+def test_legacy_unpickler_refuses_other_classes(value):
+    with pytest.raises(pickle.UnpicklingError):
+        loads_legacy(pickle.dumps(value))
+
+
+def test_hello_round_trip_and_selection():
+    line = hello_line(max_resolution=(1920, 1080), viewport=(1280, 720), quality='HIGH')
+    assert line.endswith(b'\n')
+    hello = parse_line(line, HELLO_PREFIX)
+    assert hello['max_resolution'] == [1920, 1080]
+    assert hello['viewport'] == [1280, 720]
+    assert hello['quality'] == 'HIGH'
+    selection = select_capabilities(hello)
+    assert selection == {'protocol': 1, 'codec': 'jpeg', 'transport': 'wire1', 'features': ['delta', 'cursor']}
+    assert parse_line(selected_line(selection), SELECTED_PREFIX) == selection
+
+
+def test_selection_keeps_only_common_capabilities():
+    hello = parse_line(hello_line(transports=('pickle',), features=('cursor', 'audio')), HELLO_PREFIX)
+    selection = select_capabilities(hello)
+    assert selection['transport'] == 'pickle'
+    assert selection['features'] == ['cursor']
+
+
+def test_future_peer_is_capped_at_our_protocol():
+    hello = parse_line(hello_line(codecs=('av1', 'jpeg'), transports=('wire9', 'wire1')), HELLO_PREFIX)
+    hello['protocol'] = 7
+    selection = select_capabilities(hello)
+    assert selection['protocol'] == wire_format.PROTOCOL_VERSION
+    assert selection['codec'] == 'jpeg'
+    assert selection['transport'] == 'wire1'
+
+
+@pytest.mark.parametrize("line", [b'QUALITY:HIGH', b'MODE:DELTA\n', b'WIRE:1\n', b'', b'SELECTED:{}'])
+def test_legacy_commands_are_not_hellos(line):
+    assert parse_line(line, HELLO_PREFIX) is None
+
+
+@pytest.mark.parametrize("line", [b'HELLO:', b'HELLO:{not json', b'HELLO:[1, 2]', b'HELLO:"text"',
+                                  b'HELLO:\xff\xfe'])
+def test_unreadable_hello_lines(line):
+    assert parse_line(line, HELLO_PREFIX) is None
+
+
+@pytest.mark.parametrize("hello", [
+    {},
+    {'protocol': 'two'},
+    {'protocol': [1]},
+    {'protocol': {'major': 1}},
+    {'protocol': float('inf')},
+    {'protocol': -3},
+    {'protocol': None, 'codecs': 'jpeg', 'transports': 5, 'features': 'delta'},
+])
+def test_malformed_hello_is_protocol_one_with_defaults(hello):
+    selection = select_capabilities(hello)
+    assert selection['protocol'] == 1
+    assert selection['codec'] == 'jpeg'
+    assert selection['transport'] == 'pickle'
+    assert selection['features'] == []
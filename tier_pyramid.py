@@ -0,0 +1,195 @@
+"""
+Quality tier pyramid
+Builds the resized image of every subscribed quality tier in one pass.
+Each tier is derived from the full frame or from a larger tier already
+built, with whichever resampling kernel measured cheapest while staying
+visually identical to INTER_AREA from the full frame. Works for any
+tier ladder (any number of tiers, any scales).
+"""
+
+import statistics
+import time
+import cv2
+
+# Candidate kernels (INTER_AREA from the full frame is the quality reference)
+RESAMPLING_KERNELS = {
+    'area': cv2.INTER_AREA,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC
+}
+
+# Lowest PSNR (dB) against the reference a cheaper path may have. JPEG at
+# the tiers' qualities loses far more than this, so the difference never shows.
+MIN_RESAMPLE_PSNR = 38.0
+
+# A plan is measured on this many (changed) frames before it is trusted,
+# timing every candidate TIMING_SAMPLES times per frame (the median counts)
+CALIBRATION_FRAMES = 3
+TIMING_SAMPLES = 2
+
+# Every CHECK_INTERVAL seconds the current frame is compared with the
+# reference again (new content may resample worse); every
+# RECALIBRATE_INTERVAL seconds the plan is measured again from scratch
+CHECK_INTERVAL = 10.0
+RECALIBRATE_INTERVAL = 300.0
+
+
+def tier_size(shape, scale_percent):
+    """(width, height) of a tier for a full-resolution image shape"""
+    return int(shape[1] * scale_percent / 100), int(shape[0] * scale_percent / 100)
+
+
+class TierPyramid:
+    """Plans and builds tier images (largest tier first)
+
+    The plan for a frame size and set of tiers is measured on the first
+    CALIBRATION_FRAMES frames that need it: for every tier, each candidate
+    parent (the full frame or any larger tier) and kernel is timed and
+    compared with the reference, and the candidate with the lowest median
+    time that stayed close enough on every one of those frames wins. Plans
+    are spot-checked against the reference every CHECK_INTERVAL seconds
+    and measured again when the content no longer resamples well enough,
+    or after RECALIBRATE_INTERVAL seconds.
+    """
+
+    def __init__(self, min_psnr=MIN_RESAMPLE_PSNR, kernels=None):
+        self.min_psnr = min_psnr
+        self.kernels = dict(kernels or RESAMPLING_KERNELS)
+        self.plans = {}  # (image shape, ladder) -> [(tier, scale, parent tier or None, kernel name)]
+        self.planned_at = {}  # key -> (time the plan was made, time it was last checked)
+        self.measurements = {}  # key -> {'frames', 'timings': path -> [seconds], 'psnr': path -> lowest dB}
+        self.last_plan = []
+
+    def ladder(self, tiers, quality_settings):
+        """(tier, scale) pairs, largest first"""
+        return tuple(sorted(((tier, quality_settings[tier]['scale']) for tier in tiers),
+                            key=lambda item: (-item[1], item[0])))
+
+    def build(self, img, tiers, quality_settings, buffer_pool=None):
+        """Resized image per tier (a 100% tier is img itself)"""
+        ladder = self.ladder(tiers, quality_settings)
+        key = (img.shape, ladder)
+        plan = self.plans.get(key)
+        now = time.time()
+        if plan is not None and now - self.planned_at[key][0] >= RECALIBRATE_INTERVAL:
+            self.forget(key)
+            plan = None
+        if plan is None:
+            plan, images = self.calibrate(img, ladder, key)
+            return images
+
+        self.last_plan = plan
+        images = {}
+        for tier, scale, parent, kernel in plan:
+            if kernel is None:
+                # Full size, or the same size as a tier built just before
+                images[tier] = img if parent is None else images[parent]
+                continue
+            source = img if parent is None else images[parent]
+            width, height = tier_size(img.shape, scale)
+            dst = buffer_pool.get((height, width) + img.shape[2:]) if buffer_pool is not None else None
+            images[tier] = cv2.resize(source, (width, height), dst=dst, interpolation=self.kernels[kernel])
+
+        if now - self.planned_at[key][1] >= CHECK_INTERVAL:
+            self.planned_at[key] = (self.planned_at[key][0], now)
+            self.check(img, key, images)
+        return images
+
+    def check(self, img, key, images):
+        """Compare resampled tiers with the reference on this frame; a tier that
+        fell short is replaced by the reference and the plan is measured again"""
+        for tier, scale, parent, kernel in self.plans[key]:
+            if kernel is None or (parent is None and kernel == 'area'):
+                continue
+            reference = cv2.resize(img, tier_size(img.shape, scale), interpolation=cv2.INTER_AREA)
+            psnr = cv2.PSNR(reference, images[tier])
+            if psnr < self.min_psnr:
+                images[tier] = reference
+                if key in self.plans:
+                    print(f"[*] Tier pyramid: {tier} dropped to {psnr:.1f} dB on new content - measuring again")
+                    self.forget(key)
+
+    def calibrate(self, img, ladder, key=None):
+        """Measure every candidate path on this frame, returns (plan, images)
+
+        Timings and PSNR add up over CALIBRATION_FRAMES frames; the plan is
+        kept (and used by build()) once all of them are measured.
+        """
+        measured = self.measurements.setdefault(key, {'frames': 0, 'timings': {}, 'psnr': {}})
+        timings, quality = measured['timings'], measured['psnr']
+        plan = []
+        images = {}
+        built = []  # (tier, scale) of tiers that can serve as parents
+
+        for tier, scale in ladder:
+            same = next((other for other, other_scale in built if other_scale == scale), None)
+            if scale == 100 or same is not None:
+                plan.append((tier, scale, same, None))
+                images[tier] = img if same is None else images[same]
+                built.append((tier, scale))
+                continue
+
+            size = tier_size(img.shape, scale)
+            reference = self.timed_resize(img, size, cv2.INTER_AREA, timings.setdefault((tier, None, 'area'), []))
+            candidates = [(None, 'area', reference)]
+
+            parents = [None] + [other for other, other_scale in built if 100 > other_scale > scale]
+            for parent in parents:
+                source = img if parent is None else images[parent]
+                for name, kernel in self.kernels.items():
+                    if parent is None and name == 'area':
+                        continue  # That is the reference
+                    path = (tier, parent, name)
+                    result = self.timed_resize(source, size, kernel, timings.setdefault(path, []))
+                    quality[path] = min(quality.get(path, float('inf')), cv2.PSNR(reference, result))
+                    if quality[path] >= self.min_psnr:
+                        candidates.append((parent, name, result))
+
+            parent, name, result = min(candidates, key=lambda candidate: statistics.median(
+                timings[(tier, candidate[0], candidate[1])]))
+            plan.append((tier, scale, parent, name))
+            images[tier] = result
+            built.append((tier, scale))
+
+        measured['frames'] += 1
+        self.last_plan = plan
+        if measured['frames'] < CALIBRATION_FRAMES:
+            return plan, images
+        del self.measurements[key]
+        self.plans[key] = plan
+        self.planned_at[key] = (time.time(), time.time())
+        if any(kernel is not None for _, _, _, kernel in plan):
+            print(f"[*] Tier pyramid for {img.shape[1]}x{img.shape[0]}: {self.describe(plan)}")
+        return plan, images
+
+    @staticmethod
+    def timed_resize(source, size, kernel, timings):
+        """Resize TIMING_SAMPLES times, adding each run's seconds to timings"""
+        for _ in range(TIMING_SAMPLES):
+            start = time.perf_counter()
+            result = cv2.resize(source, size, interpolation=kernel)
+            timings.append(time.perf_counter() - start)
+        return result
+
+    def describe(self, plan=None):
+        """Human readable plan, e.g. 'medium <- full (linear), low <- medium (linear)'"""
+        steps = []
+        for tier, scale, parent, kernel in (self.last_plan if plan is None else plan):
+            if kernel is None:
+                steps.append(f"{tier} = {parent or 'full'}")
+            else:
+                steps.append(f"{tier} <- {parent or 'full'} ({kernel})")
+        return ', '.join(steps)
+
+    def forget(self, key):
+        """Drop one plan (it is measured again from the next frame on)"""
+        self.plans.pop(key, None)
+        self.planned_at.pop(key, None)
+        self.measurements.pop(key, None)
+
+    def reset(self):
+        """Forget measured plans (they are measured again on the next frame)"""
+        self.plans = {}
+        self.planned_at = {}
+        self.measurements = {}
+        self.last_plan = []
@@ -2,9 +2,6 @@ import socket
 import threading
 import random
 import string
-from mss import mss
-import cv2
-import numpy as np
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
 import json
@@ -20,26 +17,21 @@ try:
 except ImportError:
     CLIPBOARD_AVAILABLE = False
 
-# Import for cursor capture (cross-platform)
-try:
-    import pyautogui
-    CURSOR_AVAILABLE = True
-except ImportError:
-    CURSOR_AVAILABLE = False
-    print("[!] Warning: pyautogui not installed. Cursor won't be visible. Install with: pip install pyautogui")
+from capture_engine import MJPEG_BOUNDARY
+from capture_daemon import create_engine
+from mjpeg_broadcaster import MJPEGBroadcaster
 
 class ScreenShareWebServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, capture_source=None, engine=None):
         self.host = host
         self.port = port
         self.security_code = None
         self.sharing = False
         self.authorized_sessions = set()
-        self.current_frame = None
-        self.frame_lock = threading.Lock()
         self.active_streams = {}  # Track active streaming connections
         self.pending_approvals = {}  # session_id -> {'ip': ip, 'approved': None}
         self.approval_lock = threading.Lock()  # Lock for approval process
+        self.prompt_lock = threading.Lock()  # Serializes operator prompts (may be shared with the TCP server)
         self.approval_queue = queue.Queue()  # Queue for approval requests
         self.approval_processor_thread = None  # Thread to process approvals sequentially
         
@@ -52,18 +44,21 @@ class ScreenShareWebServer:
         self.current_quality = 'medium'  # Default quality
         
         # Multi-user performance optimizations
-        self.frame_cache = {}  # Cache frames for different quality levels
-        self.cache_lock = threading.Lock()
-        self.last_capture_time = 0
-        self.adaptive_fps = 20  # Dynamic FPS based on user count
         self.user_count_lock = threading.Lock()
         self.performance_stats = {
-            'frames_captured': 0,
             'frames_served': 0,
-            'active_viewers': 0,
-            'avg_frame_time': 0
+            'active_viewers': 0
         }
         
+        # Capture/encode pipeline (may be shared with other servers)
+        if engine is None:
+            engine = create_engine(capture_source=capture_source, quality_settings=self.quality_settings)
+        self.engine = engine
+        
+        # One event loop streams every /stream and /updates viewer
+        self.broadcaster = MJPEGBroadcaster(self.engine, self.get_current_part_with_sequence)
+        self.tcp_server = None  # Desktop server sharing the engine (combined mode), for /stats
+        
     def copy_to_clipboard(self, text, description="text"):
         """Copy text to clipboard with user feedback"""
         if CLIPBOARD_AVAILABLE:
@@ -84,141 +79,35 @@ class ScreenShareWebServer:
         self.security_code = ''.join(random.choice(characters) for _ in range(length))
         return self.security_code
     
-    def capture_screen_loop(self):
-        """Optimized screen capture with multi-user performance enhancements"""
-        sct = mss()
-        frame_count = 0
-        
-        print("[*] Starting optimized capture loop for multi-user performance")
-        
-        while self.sharing:
-            capture_start = time.time()
-            
-            try:
-                # Dynamic FPS adjustment based on user count
-                with self.user_count_lock:
-                    active_count = len(self.active_streams)
-                    
-                    # Adaptive FPS: More users = lower FPS to maintain performance
-                    if active_count == 0:
-                        self.adaptive_fps = 20  # Full speed when no viewers
-                    elif active_count <= 2:
-                        self.adaptive_fps = 20  # Full speed for 1-2 users
-                    elif active_count <= 5:
-                        self.adaptive_fps = 15  # Slight reduction for 3-5 users
-                    elif active_count <= 10:
-                        self.adaptive_fps = 12  # Further reduction for 6-10 users
-                    else:
-                        self.adaptive_fps = 8   # Conservative for 10+ users
-                
-                # Capture the primary monitor
-                monitor = sct.monitors[1]
-                screenshot = sct.grab(monitor)
-                
-                # Convert to numpy array
-                img = np.array(screenshot)
-                
-                # Convert BGRA to BGR (remove alpha channel)
-                img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                
-                # Draw cursor on the image (only once for all users)
-                if CURSOR_AVAILABLE:
-                    try:
-                        # Get cursor position
-                        cursor_x, cursor_y = pyautogui.position()
-                        
-                        # Adjust cursor position relative to monitor
-                        cursor_x -= monitor['left']
-                        cursor_y -= monitor['top']
-                        
-                        # Draw cursor (optimized for performance)
-                        cursor_size = 12
-                        cursor_thickness = 2
-                        
-                        # Draw outer circle (white outline for visibility on any background)
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
-                        # Draw inner circle (black for contrast)
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
-                        # Draw center dot (red for visibility)
-                        cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
-                        
-                    except Exception:
-                        # Cursor drawing failed, continue without cursor
-                        pass
-                
-                # Generate frames for all quality levels (cache optimization)
-                with self.cache_lock:
-                    self.frame_cache.clear()  # Clear old cache
-                    
-                    for quality_name, quality_config in self.quality_settings.items():
-                        # Create frame for each quality level
-                        scale_percent = quality_config['scale']
-                        jpeg_quality = quality_config['jpeg_quality']
-                        
-                        # Resize image for this quality
-                        if scale_percent == 100:
-                            quality_img = img.copy()
-                        else:
-                            width = int(img.shape[1] * scale_percent / 100)
-                            height = int(img.shape[0] * scale_percent / 100)
-                            quality_img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)  # Faster for downscaling
-                        
-                        # Encode with quality-specific settings
-                        encode_param = [
-                            int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality,
-                            int(cv2.IMWRITE_JPEG_OPTIMIZE), 1
-                        ]
-                        result, encoded_img = cv2.imencode('.jpg', quality_img, encode_param)
-                        
-                        # Cache the encoded frame
-                        self.frame_cache[quality_name] = encoded_img.tobytes()
-                
-                # Update current frame (backward compatibility)
-                with self.frame_lock:
-                    self.current_frame = self.frame_cache.get(self.current_quality)
-                
-                # Performance tracking
-                capture_time = time.time() - capture_start
-                frame_count += 1
-                
-                # Update stats every 100 frames
-                if frame_count % 100 == 0:
-                    self.performance_stats['frames_captured'] = frame_count
-                    self.performance_stats['active_viewers'] = len(self.active_streams)
-                    self.performance_stats['avg_frame_time'] = capture_time
-                    
-                    if len(self.active_streams) > 0:
-                        print(f"[📊] Performance: {len(self.active_streams)} viewers, "
-                              f"{self.adaptive_fps} FPS, "
-                              f"{capture_time*1000:.1f}ms/frame")
-                
-                # Dynamic sleep based on adaptive FPS
-                sleep_time = max(0, (1.0 / self.adaptive_fps) - capture_time)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                
-            except Exception as e:
-                print(f"[-] Error capturing screen: {e}")
-                time.sleep(1)
-        
-        sct.close()
-        print("[*] Screen capture loop ended")
-    
     def get_current_frame(self, quality=None):
         """Get the current frame as JPEG bytes with optional quality specification"""
-        if quality and quality in self.quality_settings:
-            # Return cached frame for specific quality
-            with self.cache_lock:
-                frame = self.frame_cache.get(quality)
-                if frame:
-                    self.performance_stats['frames_served'] += 1
-                    return frame
-        
-        # Fallback to current frame (backward compatibility)
-        with self.frame_lock:
-            if self.current_frame:
-                self.performance_stats['frames_served'] += 1
-            return self.current_frame
+        return self.get_current_frame_with_sequence(quality)[0]
+    
+    def get_current_frame_with_sequence(self, quality=None):
+        """Get the current frame as JPEG bytes plus its engine sequence number"""
+        if not quality or quality not in self.quality_settings:
+            quality = self.current_quality
+        frame, sequence = self.engine.get_frame_with_sequence(quality)
+        if frame:
+            self.performance_stats['frames_served'] += 1
+        return frame, sequence
+    
+    def get_current_part_with_sequence(self, quality=None):
+        """Current frame as a complete MJPEG part (built once per tier and frame) plus its sequence"""
+        if not quality or quality not in self.quality_settings:
+            quality = self.current_quality
+        part, sequence = self.engine.get_mjpeg_part_with_sequence(quality)
+        if part:
+            self.performance_stats['frames_served'] += 1
+        return part, sequence
+    
+    def get_performance_stats(self):
+        """Server stats merged with the capture engine's stats"""
+        stats = self.performance_stats.copy()
+        stats.update(self.engine.get_performance_stats())
+        stats.update(self.broadcaster.get_stats())
+        stats['active_viewers'] = len(self.active_streams)
+        return stats
     
     def verify_security_code(self, code):
         """Verify if the provided security code is correct"""
@@ -241,14 +130,15 @@ class ScreenShareWebServer:
                     if session_id not in self.pending_approvals:
                         continue  # Skip if already timed out
                     
-                print(f"\n{'='*60}")
-                print(f"[!] Web connection request from {ip_address}")
-                print(f"[!] Session: {session_id[:8]}...")
-                print(f"[!] Currently {len(self.authorized_sessions)} user(s) connected")
-                print(f"[!] Pending requests in queue: {self.approval_queue.qsize()}")
-                print(f"{'='*60}")
-                
-                approval = input("Do you want to allow this connection? (y/n): ").strip().lower()
+                with self.prompt_lock:
+                    print(f"\n{'='*60}")
+                    print(f"[!] Web connection request from {ip_address}")
+                    print(f"[!] Session: {session_id[:8]}...")
+                    print(f"[!] Currently {len(self.authorized_sessions)} user(s) connected")
+                    print(f"[!] Pending requests in queue: {self.approval_queue.qsize()}")
+                    print(f"{'='*60}")
+                    
+                    approval = input("Do you want to allow this connection? (y/n): ").strip().lower()
                 
                 # Update approval status with lock and check if session still exists
                 with self.approval_lock:
@@ -308,73 +198,10 @@ class ScreenShareWebServer:
         """Force an immediate frame capture with current quality settings"""
         if not self.sharing:
             return
-            
-        try:
-            sct = mss()
-            
-            # Capture the primary monitor
-            monitor = sct.monitors[1]
-            screenshot = sct.grab(monitor)
-            
-            # Convert to numpy array
-            img = np.array(screenshot)
-            
-            # Convert BGRA to BGR (remove alpha channel)
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-            
-            # Draw cursor on the image
-            if CURSOR_AVAILABLE:
-                try:
-                    # Get cursor position
-                    cursor_x, cursor_y = pyautogui.position()
-                    
-                    # Adjust cursor position relative to monitor
-                    cursor_x -= monitor['left']
-                    cursor_y -= monitor['top']
-                    
-                    # Draw cursor (simple circle with outline for visibility)
-                    cursor_size = 12
-                    cursor_thickness = 2
-                    
-                    # Draw outer circle (white outline for visibility on any background)
-                    cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
-                    # Draw inner circle (black for contrast)
-                    cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
-                    # Draw center dot (red for visibility)
-                    cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
-                    
-                except Exception:
-                    # Cursor drawing failed, continue without cursor
-                    pass
-            
-            # Apply current quality settings
-            quality_config = self.quality_settings[self.current_quality]
-            scale_percent = quality_config['scale']
-            jpeg_quality = quality_config['jpeg_quality']
-            
-            width = int(img.shape[1] * scale_percent / 100)
-            height = int(img.shape[0] * scale_percent / 100)
-            
-            # Only resize if scaling is needed, use best quality interpolation
-            if scale_percent != 100:
-                img = cv2.resize(img, (width, height), interpolation=cv2.INTER_LANCZOS4)
-            
-            # Encode image to JPEG format with current quality setting
-            encode_param = [
-                int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality,
-                int(cv2.IMWRITE_JPEG_OPTIMIZE), 1,   # Optimize encoding
-                int(cv2.IMWRITE_JPEG_PROGRESSIVE), 1  # Progressive JPEG for better streaming
-            ]
-            result, encoded_img = cv2.imencode('.jpg', img, encode_param)
-            
-            # Update current frame immediately
-            with self.frame_lock:
-                self.current_frame = encoded_img.tobytes()
-                
-            print(f"[*] Frame updated immediately with {self.current_quality} quality")
-            
-        except Exception as e:
-            print(f"[-] Error forcing frame update: {e}")
+        
+        # Every tier is produced by the shared engine; just wake it up
+        self.engine.request_frame()
+        print(f"[*] Frame update requested with {self.current_quality} quality")
     
     def create_request_handler(self):
         """Create HTTP request handler class with access to server instance"""
@@ -407,10 +234,7 @@ class ScreenShareWebServer:
                     self.end_headers()
                     
                     # Gather performance stats
-                    active_count = len(server_instance.active_streams)
-                    stats = server_instance.performance_stats.copy()
-                    stats['active_viewers'] = active_count
-                    stats['adaptive_fps'] = server_instance.adaptive_fps
+                    stats = server_instance.get_performance_stats()
                     
                     response = json.dumps({
                         'status': 'ok', 
@@ -433,30 +257,115 @@ class ScreenShareWebServer:
                     self.send_header('Content-type', 'application/json')
                     self.end_headers()
                     
+                    links = server_instance.broadcaster.session_stats()
                     detailed_stats = {
                         'server': {
-                            'adaptive_fps': server_instance.adaptive_fps,
+                            'adaptive_fps': server_instance.engine.adaptive_fps,
                             'current_quality': server_instance.current_quality,
                             'sharing_active': server_instance.sharing
                         },
-                        'performance': server_instance.performance_stats,
+                        'performance': server_instance.get_performance_stats(),
                         'active_streams': {
                             session_id: {
                                 'ip': info['ip'],
                                 'duration': time.time() - info['start_time'],
                                 'frames_sent': info['frames_sent'],
-                                'quality': info['quality']
+                                'quality': info['quality'],
+                                # Viewer id -> stream type, dropped frames, drain rate (a
+                                # session may have an MJPEG and a delta stream, or several tabs)
+                                'links': links.get(session_id, {})
                             }
-                            for session_id, info in server_instance.active_streams.items()
+                            for session_id, info in list(server_instance.active_streams.items())
                         },
+                        'evicted_viewers': server_instance.broadcaster.eviction_stats(),
                         'optimization_status': {
-                            'frame_caching': len(server_instance.frame_cache),
+                            'frame_caching': len(server_instance.engine.frame_cache),
                             'total_active_viewers': len(server_instance.active_streams)
                         }
                     }
+                    if server_instance.tcp_server is not None:
+                        # Combined mode: desktop clients share the engine
+                        detailed_stats['desktop_clients'] = server_instance.tcp_server.get_client_stats()
                     
                     self.wfile.write(json.dumps(detailed_stats, indent=2).encode())
                 
+                elif self.path == '/delta_viewer.js':
+                    # Canvas viewer script for the delta stream
+                    script_path = os.path.join(os.path.dirname(__file__), 'delta_viewer.js')
+                    try:
+                        with open(script_path, 'rb') as f:
+                            script = f.read()
+                        self.send_response(200)
+                        self.send_header('Content-type', 'application/javascript')
+                        self.end_headers()
+                        self.wfile.write(script)
+                    except FileNotFoundError:
+                        self.send_response(404)
+                        self.end_headers()
+                
+                elif self.path.startswith('/updates'):
+                    # Delta stream (Server-Sent Events): keyframes, changed tiles, scroll copies
+                    # and cursor positions (the canvas viewer draws the pointer itself)
+                    from urllib.parse import urlparse, parse_qs
+                    parsed = urlparse(self.path)
+                    params = parse_qs(parsed.query)
+                    session_id = params.get('session', [None])[0]
+                    
+                    if not session_id or session_id not in server_instance.authorized_sessions:
+                        self.send_response(403)
+                        self.send_header('Content-type', 'text/plain')
+                        self.end_headers()
+                        self.wfile.write(b"Unauthorized - Invalid or missing session")
+                        return
+                    
+                    client_ip = self.client_address[0]
+                    
+                    with server_instance.user_count_lock:
+                        server_instance.active_streams[session_id] = {
+                            'ip': client_ip,
+                            'start_time': time.time(),
+                            'frames_sent': 0,
+                            'quality': server_instance.current_quality
+                        }
+                    server_instance.engine.subscribe(session_id, server_instance.current_quality, tiles=True, cursor=True)
+                    
+                    active_count = len(server_instance.active_streams)
+                    print(f"[*] Delta stream started for session {session_id} from {client_ip}")
+                    print(f"[*] Active viewers: {active_count}")
+                    
+                    self.send_response(200)
+                    self.send_header('Content-type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                    self.send_header('Connection', 'close')
+                    self.send_header('X-Accel-Buffering', 'no')
+                    self.end_headers()
+                    
+                    # The broadcaster's event loop streams from here on, like /stream
+                    def updates_sent(viewer):
+                        stream = server_instance.active_streams.get(session_id)
+                        if stream is not None:
+                            stream['frames_sent'] = viewer.frames_sent
+                    
+                    def updates_closed(viewer):
+                        with server_instance.user_count_lock:
+                            if session_id in server_instance.active_streams:
+                                stream_info = server_instance.active_streams[session_id]
+                                session_duration = time.time() - stream_info['start_time']
+                                print(f"[*] Delta stream {'evicted' if viewer.evicted else 'ended'} for {client_ip}")
+                                print(f"    Duration: {session_duration:.1f}s, Updates sent: {viewer.frames_sent}, Dropped: {viewer.frames_dropped}")
+                                del server_instance.active_streams[session_id]
+                        server_instance.engine.unsubscribe(session_id)
+                        print(f"[*] Active viewers: {len(server_instance.active_streams)}")
+                    
+                    server_instance.broadcaster.add(
+                        self.connection,
+                        get_tier=lambda: server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality),
+                        is_active=lambda: server_instance.sharing and session_id in server_instance.authorized_sessions,
+                        on_sent=updates_sent,
+                        on_close=updates_closed,
+                        name=session_id,
+                        events=True)
+                
                 elif self.path.startswith('/stream'):
                     # Stream MJPEG
                     # Parse session ID from query parameter
@@ -482,6 +391,7 @@ class ScreenShareWebServer:
                             'frames_sent': 0,
                             'quality': server_instance.current_quality
                         }
+                    server_instance.engine.subscribe(session_id, server_instance.current_quality, tiles=False)
                     
                     active_count = len(server_instance.active_streams)
                     print(f"[*] Stream started for session {session_id} from {client_ip}")
@@ -492,73 +402,50 @@ class ScreenShareWebServer:
                     
                     # Send MJPEG stream headers with optimizations
                     self.send_response(200)
-                    self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
+                    self.send_header('Content-type', f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}')
                     self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
                     self.send_header('Pragma', 'no-cache')
                     self.send_header('Expires', '0')
                     self.send_header('Connection', 'close')
                     # Add performance headers
-                    self.send_header('X-Frame-Rate', str(server_instance.adaptive_fps))
+                    self.send_header('X-Frame-Rate', str(server_instance.engine.adaptive_fps))
                     self.send_header('X-Active-Viewers', str(active_count))
                     self.end_headers()
                     
-                    try:
-                        frames_sent = 0
-                        last_frame_time = time.time()
-                        
-                        while server_instance.sharing and session_id in server_instance.authorized_sessions:
-                            # Get user's preferred quality or fallback to server default
-                            user_quality = server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality)
-                            frame = server_instance.get_current_frame(user_quality)
-                            
-                            if frame:
-                                # Send frame in MJPEG format
-                                self.wfile.write(b'--frame\r\n')
-                                self.wfile.write(b'Content-Type: image/jpeg\r\n')
-                                self.wfile.write(f'Content-Length: {len(frame)}\r\n'.encode())
-                                self.wfile.write(b'\r\n')
-                                self.wfile.write(frame)
-                                self.wfile.write(b'\r\n')
-                                self.wfile.flush()
-                                
-                                frames_sent += 1
-                                
-                                # Update stream stats
-                                if session_id in server_instance.active_streams:
-                                    server_instance.active_streams[session_id]['frames_sent'] = frames_sent
-                            
-                            # Adaptive sleep based on current FPS and user count
-                            current_time = time.time()
-                            frame_interval = 1.0 / server_instance.adaptive_fps
-                            elapsed = current_time - last_frame_time
-                            sleep_time = max(0, frame_interval - elapsed)
-                            
-                            if sleep_time > 0:
-                                time.sleep(sleep_time)
-                            last_frame_time = time.time()
-                    except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                        # Client disconnected gracefully
-                        print(f"[*] Client {client_ip} (session {session_id}) disconnected")
-                    except Exception as e:
-                        print(f"[-] Stream error for session {session_id}: {e}")
-                    finally:
+                    # The broadcaster's event loop streams from here on; this handler
+                    # thread returns right away instead of living as long as the viewer
+                    def stream_sent(viewer):
+                        stream = server_instance.active_streams.get(session_id)
+                        if stream is not None:
+                            stream['frames_sent'] = viewer.frames_sent
+                    
+                    def stream_closed(viewer):
                         # Remove from active streams with performance stats
                         with server_instance.user_count_lock:
                             if session_id in server_instance.active_streams:
                                 stream_info = server_instance.active_streams[session_id]
                                 session_duration = time.time() - stream_info['start_time']
-                                frames_sent = stream_info['frames_sent']
                                 
-                                print(f"[*] Stream ended for {client_ip}")
-                                print(f"    Duration: {session_duration:.1f}s, Frames sent: {frames_sent}")
+                                print(f"[*] Stream {'evicted' if viewer.evicted else 'ended'} for {client_ip}")
+                                print(f"    Duration: {session_duration:.1f}s, Frames sent: {viewer.frames_sent}, Dropped: {viewer.frames_dropped}")
                                 
                                 del server_instance.active_streams[session_id]
+                        server_instance.engine.unsubscribe(session_id)
                         
                         remaining_viewers = len(server_instance.active_streams)
                         print(f"[*] Active viewers: {remaining_viewers}")
                         
                         if remaining_viewers == 0:
                             print(f"[*] All viewers disconnected - full performance restored")
+                    
+                    server_instance.broadcaster.add(
+                        self.connection,
+                        # User's preferred quality or fallback to server default
+                        get_tier=lambda: server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality),
+                        is_active=lambda: server_instance.sharing and session_id in server_instance.authorized_sessions,
+                        on_sent=stream_sent,
+                        on_close=stream_closed,
+                        name=session_id)
                 
                 else:
                     self.send_response(404)
@@ -654,6 +541,11 @@ class ScreenShareWebServer:
                         old_quality = server_instance.current_quality
                         server_instance.current_quality = quality
                         
+                        # Move this viewer's running stream to the new tier right away
+                        if session_id in server_instance.active_streams:
+                            server_instance.active_streams[session_id]['quality'] = quality
+                            server_instance.engine.subscribe(session_id, quality)
+                        
                         quality_config = server_instance.quality_settings[quality]
                         print(f"[*] Quality changed from {old_quality} to {quality}")
                         print(f"    Scale: {quality_config['scale']}%, JPEG Quality: {quality_config['jpeg_quality']}%")
@@ -693,8 +585,8 @@ class ScreenShareWebServer:
     
     def start_sharing(self):
         """Start the web-based screen sharing server"""
-        # Generate security code
-        code = self.generate_security_code()
+        # Generate security code (unless one was assigned, e.g. in combined mode)
+        code = self.security_code or self.generate_security_code()
         print("\n" + "="*60)
         print(f"SECURITY CODE: {code}")
         print("="*60)
@@ -705,7 +597,8 @@ class ScreenShareWebServer:
         # Do not copy security code to clipboard here; let main.py handle it interactively
         # Prompt to copy security code to clipboard
         print()
-        user_input = input("Press C to copy the security code to clipboard, or any other key to skip: ").strip().lower()
+        with self.prompt_lock:
+            user_input = input("Press C to copy the security code to clipboard, or any other key to skip: ").strip().lower()
         if user_input == 'c':
             self.copy_to_clipboard(code, "Security code")
             print("[✓] Security code copied to clipboard!")
@@ -735,9 +628,9 @@ class ScreenShareWebServer:
         
         self.sharing = True
         
-        # Start screen capture thread
-        capture_thread = threading.Thread(target=self.capture_screen_loop, daemon=True)
-        capture_thread.start()
+        # Start the shared capture engine and the MJPEG stream loop
+        self.engine.start()
+        self.broadcaster.start()
         
         # Start approval processor thread
         self.approval_processor_thread = threading.Thread(target=self.process_approval_queue, daemon=True)
@@ -745,8 +638,15 @@ class ScreenShareWebServer:
         print("[*] Approval processor started - requests will be handled sequentially")
         
         # Create a threaded HTTP server
+        broadcaster = self.broadcaster
+        
         class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
             daemon_threads = True
+            
+            def shutdown_request(self, request):
+                # /stream and /updates sockets were handed to the broadcaster, which closes them
+                if not broadcaster.owns(request):
+                    super().shutdown_request(request)
         
         # Start HTTP server
         try:
@@ -764,7 +664,11 @@ class ScreenShareWebServer:
     def stop_sharing(self):
         """Stop the screen sharing server"""
         print("\n[*] Stopping server...")
+        was_sharing = self.sharing
         self.sharing = False
+        if was_sharing:
+            self.broadcaster.stop()
+            self.engine.stop()
         
         # Stop approval processor thread
         if self.approval_processor_thread and self.approval_processor_thread.is_alive():
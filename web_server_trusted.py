@@ -4,9 +4,6 @@ For sharing with trusted users only
 Reuses optimized code from web_server.py
 """
 
-from mss import mss
-import cv2
-import numpy as np
 import socket
 import threading
 import json
@@ -14,23 +11,16 @@ import time
 import os
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from socketserver import ThreadingMixIn
-
-# Try to import cursor capture (cross-platform)
-try:
-    import pyautogui
-    CURSOR_AVAILABLE = True
-except ImportError:
-    CURSOR_AVAILABLE = False
-    print("[!] Warning: pyautogui not installed. Cursor won't be visible. Install with: pip install pyautogui")
+from capture_engine import MJPEG_BOUNDARY
+from capture_daemon import create_engine
+from mjpeg_broadcaster import MJPEGBroadcaster
 
 class TrustedScreenShareWebServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, capture_source=None, engine=None):
         self.host = host
         self.port = port
         self.sharing = False
         self.authorized_sessions = set()
-        self.current_frame = None
-        self.frame_lock = threading.Lock()
         self.active_streams = {}  # Track active streaming connections
         self.session_qualities = {}  # Persistent quality preferences per session
         self.connected_users_log = []  # Log of connected users
@@ -44,17 +34,19 @@ class TrustedScreenShareWebServer:
         self.current_quality = 'medium'  # Default quality
         
         # Multi-user performance optimizations (same as regular server)
-        self.frame_cache = {}
-        self.cache_lock = threading.Lock()
-        self.last_capture_time = 0
-        self.adaptive_fps = 20
         self.user_count_lock = threading.Lock()
         self.performance_stats = {
-            'frames_captured': 0,
             'frames_served': 0,
-            'active_viewers': 0,
-            'avg_frame_time': 0
+            'active_viewers': 0
         }
+        
+        # Capture/encode pipeline (may be shared with other servers)
+        if engine is None:
+            engine = create_engine(capture_source=capture_source, quality_settings=self.quality_settings)
+        self.engine = engine
+        
+        # One event loop streams every /stream and /updates viewer
+        self.broadcaster = MJPEGBroadcaster(self.engine, self.get_current_part_with_sequence)
     
     def log_connection(self, session_id, ip_address):
         """Log connection details"""
@@ -74,124 +66,35 @@ class TrustedScreenShareWebServer:
         print(f"[*] Currently active: {len(self.authorized_sessions)}")
         print(f"{'='*60}\n")
     
-    def capture_screen_loop(self):
-        """Optimized screen capture with multi-user performance enhancements"""
-        sct = mss()
-        frame_count = 0
-        
-        print("[*] Starting optimized capture loop for multi-user performance")
-        
-        while self.sharing:
-            capture_start = time.time()
-            
-            try:
-                # Dynamic FPS adjustment based on user count
-                with self.user_count_lock:
-                    active_count = len(self.active_streams)
-                    
-                    # Adaptive FPS: More users = lower FPS to maintain performance
-                    if active_count == 0:
-                        self.adaptive_fps = 20
-                    elif active_count <= 2:
-                        self.adaptive_fps = 20
-                    elif active_count <= 5:
-                        self.adaptive_fps = 15
-                    elif active_count <= 10:
-                        self.adaptive_fps = 12
-                    else:
-                        self.adaptive_fps = 8
-                
-                # Capture the primary monitor
-                monitor = sct.monitors[1]
-                screenshot = sct.grab(monitor)
-                
-                # Convert to numpy array
-                img = np.array(screenshot)
-                
-                # Convert BGRA to BGR (remove alpha channel)
-                img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                
-                # Draw cursor on the image
-                if CURSOR_AVAILABLE:
-                    try:
-                        cursor_x, cursor_y = pyautogui.position()
-                        cursor_x -= monitor['left']
-                        cursor_y -= monitor['top']
-                        
-                        cursor_size = 12
-                        cursor_thickness = 2
-                        
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (255, 255, 255), cursor_thickness + 2)
-                        cv2.circle(img, (cursor_x, cursor_y), cursor_size, (0, 0, 0), cursor_thickness)
-                        cv2.circle(img, (cursor_x, cursor_y), 3, (0, 0, 255), -1)
-                    except Exception:
-                        pass
-                
-                # Generate frames for all quality levels
-                with self.cache_lock:
-                    self.frame_cache.clear()
-                    
-                    for quality_name, quality_config in self.quality_settings.items():
-                        scale_percent = quality_config['scale']
-                        jpeg_quality = quality_config['jpeg_quality']
-                        
-                        if scale_percent == 100:
-                            quality_img = img
-                        else:
-                            width = int(img.shape[1] * scale_percent / 100)
-                            height = int(img.shape[0] * scale_percent / 100)
-                            quality_img = cv2.resize(img, (width, height), interpolation=cv2.INTER_LANCZOS4)
-                        
-                        encode_param = [
-                            int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality,
-                            int(cv2.IMWRITE_JPEG_OPTIMIZE), 1
-                        ]
-                        result, encoded_img = cv2.imencode('.jpg', quality_img, encode_param)
-                        self.frame_cache[quality_name] = encoded_img.tobytes()
-                
-                # Update current frame
-                with self.frame_lock:
-                    self.current_frame = self.frame_cache.get(self.current_quality)
-                
-                # Performance tracking
-                capture_time = time.time() - capture_start
-                frame_count += 1
-                
-                if frame_count % 100 == 0:
-                    self.performance_stats['frames_captured'] = frame_count
-                    self.performance_stats['active_viewers'] = len(self.active_streams)
-                    self.performance_stats['avg_frame_time'] = capture_time
-                    
-                    if len(self.active_streams) > 0:
-                        print(f"[📊] Performance: {len(self.active_streams)} viewers, "
-                              f"{self.adaptive_fps} FPS, "
-                              f"{capture_time*1000:.1f}ms/frame")
-                
-                # Dynamic sleep based on adaptive FPS
-                sleep_time = max(0, (1.0 / self.adaptive_fps) - capture_time)
-                if sleep_time > 0:
-                    time.sleep(sleep_time)
-                
-            except Exception as e:
-                print(f"[-] Error capturing screen: {e}")
-                time.sleep(1)
-        
-        sct.close()
-        print("[*] Screen capture loop ended")
-    
     def get_current_frame(self, quality=None):
         """Get the current frame as JPEG bytes with optional quality specification"""
-        if quality and quality in self.quality_settings:
-            with self.cache_lock:
-                frame = self.frame_cache.get(quality)
-                if frame:
-                    self.performance_stats['frames_served'] += 1
-                    return frame
-        
-        with self.frame_lock:
-            if self.current_frame:
-                self.performance_stats['frames_served'] += 1
-            return self.current_frame
+        return self.get_current_frame_with_sequence(quality)[0]
+    
+    def get_current_frame_with_sequence(self, quality=None):
+        """Get the current frame as JPEG bytes plus its engine sequence number"""
+        if not quality or quality not in self.quality_settings:
+            quality = self.current_quality
+        frame, sequence = self.engine.get_frame_with_sequence(quality)
+        if frame:
+            self.performance_stats['frames_served'] += 1
+        return frame, sequence
+    
+    def get_current_part_with_sequence(self, quality=None):
+        """Current frame as a complete MJPEG part (built once per tier and frame) plus its sequence"""
+        if not quality or quality not in self.quality_settings:
+            quality = self.current_quality
+        part, sequence = self.engine.get_mjpeg_part_with_sequence(quality)
+        if part:
+            self.performance_stats['frames_served'] += 1
+        return part, sequence
+    
+    def get_performance_stats(self):
+        """Server stats merged with the capture engine's stats"""
+        stats = self.performance_stats.copy()
+        stats.update(self.engine.get_performance_stats())
+        stats.update(self.broadcaster.get_stats())
+        stats['active_viewers'] = len(self.active_streams)
+        return stats
     
     def create_request_handler(self):
         """Create HTTP request handler class with access to server instance"""
@@ -222,10 +125,7 @@ class TrustedScreenShareWebServer:
                     self.send_header('Content-type', 'application/json')
                     self.end_headers()
                     
-                    active_count = len(server_instance.active_streams)
-                    stats = server_instance.performance_stats.copy()
-                    stats['active_viewers'] = active_count
-                    stats['adaptive_fps'] = server_instance.adaptive_fps
+                    stats = server_instance.get_performance_stats()
                     
                     response = json.dumps({
                         'status': 'ok', 
@@ -237,6 +137,109 @@ class TrustedScreenShareWebServer:
                     })
                     self.wfile.write(response.encode())
                 
+                elif self.path == '/stats':
+                    # Per-stream statistics (dropped frames, drain rate, evicted viewers)
+                    self.send_response(200)
+                    self.send_header('Content-type', 'application/json')
+                    self.end_headers()
+                    
+                    links = server_instance.broadcaster.session_stats()
+                    evicted = server_instance.broadcaster.eviction_stats()
+                    for record in evicted.values():
+                        record['session'] = (record['session'] or '')[:8]
+                    detailed_stats = {
+                        'performance': server_instance.get_performance_stats(),
+                        'active_streams': {
+                            session_id[:8]: {
+                                'ip': info['ip'],
+                                'duration': time.time() - info['start_time'],
+                                'frames_sent': info['frames_sent'],
+                                'quality': info['quality'],
+                                'links': links.get(session_id, {})
+                            }
+                            for session_id, info in list(server_instance.active_streams.items())
+                        },
+                        'evicted_viewers': evicted
+                    }
+                    self.wfile.write(json.dumps(detailed_stats, indent=2).encode())
+                
+                elif self.path == '/delta_viewer.js':
+                    # Canvas viewer script for the delta stream
+                    script_path = os.path.join(os.path.dirname(__file__), 'delta_viewer.js')
+                    try:
+                        with open(script_path, 'rb') as f:
+                            script = f.read()
+                        self.send_response(200)
+                        self.send_header('Content-type', 'application/javascript')
+                        self.end_headers()
+                        self.wfile.write(script)
+                    except FileNotFoundError:
+                        self.send_response(404)
+                        self.end_headers()
+                
+                elif self.path.startswith('/updates'):
+                    # Delta stream (Server-Sent Events): keyframes, changed tiles, scroll copies
+                    # and cursor positions (the canvas viewer draws the pointer itself)
+                    from urllib.parse import urlparse, parse_qs
+                    parsed = urlparse(self.path)
+                    params = parse_qs(parsed.query)
+                    session_id = params.get('session', [None])[0]
+                    
+                    if not session_id or session_id not in server_instance.authorized_sessions:
+                        self.send_response(403)
+                        self.send_header('Content-type', 'text/plain')
+                        self.end_headers()
+                        self.wfile.write(b"Unauthorized - Invalid or missing session")
+                        return
+                    
+                    client_ip = self.client_address[0]
+                    
+                    with server_instance.user_count_lock:
+                        session_quality = server_instance.session_qualities.get(session_id, server_instance.current_quality)
+                        
+                        server_instance.active_streams[session_id] = {
+                            'ip': client_ip,
+                            'start_time': time.time(),
+                            'frames_sent': 0,
+                            'quality': session_quality
+                        }
+                    server_instance.engine.subscribe(session_id, session_quality, tiles=True, cursor=True)
+                    
+                    active_count = len(server_instance.active_streams)
+                    print(f"[*] Delta stream started for session {session_id[:8]}... from {client_ip}")
+                    print(f"[*] Active viewers: {active_count}, Quality: {session_quality.title()}")
+                    
+                    self.send_response(200)
+                    self.send_header('Content-type', 'text/event-stream')
+                    self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
+                    self.send_header('Connection', 'close')
+                    self.send_header('X-Accel-Buffering', 'no')
+                    self.end_headers()
+                    
+                    # The broadcaster's event loop streams from here on, like /stream
+                    def updates_sent(viewer):
+                        stream = server_instance.active_streams.get(session_id)
+                        if stream is not None:
+                            stream['frames_sent'] = viewer.frames_sent
+                    
+                    def updates_closed(viewer):
+                        final_quality = 'unknown'
+                        with server_instance.user_count_lock:
+                            if session_id in server_instance.active_streams:
+                                final_quality = server_instance.active_streams[session_id].get('quality', 'unknown')
+                                del server_instance.active_streams[session_id]
+                        server_instance.engine.unsubscribe(session_id)
+                        print(f"[*] Delta stream {'evicted' if viewer.evicted else 'ended'} for session {session_id[:8]}... ({viewer.frames_sent} updates sent, {viewer.frames_dropped} dropped, {final_quality} quality)")
+                    
+                    server_instance.broadcaster.add(
+                        self.connection,
+                        get_tier=lambda: server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality),
+                        is_active=lambda: server_instance.sharing and session_id in server_instance.authorized_sessions,
+                        on_sent=updates_sent,
+                        on_close=updates_closed,
+                        name=session_id,
+                        events=True)
+                
                 elif self.path.startswith('/stream'):
                     # Stream MJPEG
                     from urllib.parse import urlparse, parse_qs
@@ -264,6 +267,7 @@ class TrustedScreenShareWebServer:
                             'frames_sent': 0,
                             'quality': session_quality
                         }
+                    server_instance.engine.subscribe(session_id, session_quality, tiles=False)
                     
                     active_count = len(server_instance.active_streams)
                     print(f"[*] Stream started for session {session_id[:8]}... from {client_ip}")
@@ -271,47 +275,39 @@ class TrustedScreenShareWebServer:
                     
                     # Send MJPEG stream headers
                     self.send_response(200)
-                    self.send_header('Content-type', 'multipart/x-mixed-replace; boundary=frame')
+                    self.send_header('Content-type', f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}')
                     self.send_header('Cache-Control', 'no-cache, no-store, must-revalidate')
                     self.send_header('Pragma', 'no-cache')
                     self.send_header('Expires', '0')
                     self.send_header('Connection', 'close')
-                    self.send_header('X-Frame-Rate', str(server_instance.adaptive_fps))
+                    self.send_header('X-Frame-Rate', str(server_instance.engine.adaptive_fps))
                     self.send_header('X-Active-Viewers', str(active_count))
                     self.end_headers()
                     
-                    try:
-                        frames_sent = 0
-                        while server_instance.sharing and session_id in server_instance.authorized_sessions:
-                            # Get quality preference for this session
-                            quality = server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality)
-                            
-                            frame = server_instance.get_current_frame(quality)
-                            if frame:
-                                try:
-                                    self.wfile.write(b'--frame\r\n')
-                                    self.wfile.write(b'Content-Type: image/jpeg\r\n')
-                                    self.wfile.write(f'Content-Length: {len(frame)}\r\n'.encode())
-                                    self.wfile.write(b'\r\n')
-                                    self.wfile.write(frame)
-                                    self.wfile.write(b'\r\n')
-                                    
-                                    frames_sent += 1
-                                    server_instance.active_streams[session_id]['frames_sent'] = frames_sent
-                                except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                                    break
-                            
-                            time.sleep(1.0 / server_instance.adaptive_fps)
-                    except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
-                        pass
-                    except Exception as e:
-                        print(f"[-] Stream error for {session_id[:8]}...: {e}")
-                    finally:
+                    # The broadcaster's event loop streams from here on; this handler
+                    # thread returns right away instead of living as long as the viewer
+                    def stream_sent(viewer):
+                        stream = server_instance.active_streams.get(session_id)
+                        if stream is not None:
+                            stream['frames_sent'] = viewer.frames_sent
+                    
+                    def stream_closed(viewer):
+                        final_quality = 'unknown'
                         with server_instance.user_count_lock:
                             if session_id in server_instance.active_streams:
                                 final_quality = server_instance.active_streams[session_id].get('quality', 'unknown')
                                 del server_instance.active_streams[session_id]
-                        print(f"[*] Stream ended for session {session_id[:8]}... ({frames_sent} frames sent, {final_quality} quality)")
+                        server_instance.engine.unsubscribe(session_id)
+                        print(f"[*] Stream {'evicted' if viewer.evicted else 'ended'} for session {session_id[:8]}... ({viewer.frames_sent} frames sent, {viewer.frames_dropped} dropped, {final_quality} quality)")
+                    
+                    server_instance.broadcaster.add(
+                        self.connection,
+                        # Quality preference for this session
+                        get_tier=lambda: server_instance.active_streams.get(session_id, {}).get('quality', server_instance.current_quality),
+                        is_active=lambda: server_instance.sharing and session_id in server_instance.authorized_sessions,
+                        on_sent=stream_sent,
+                        on_close=stream_closed,
+                        name=session_id)
                 
                 else:
                     self.send_response(404)
@@ -380,6 +376,7 @@ class TrustedScreenShareWebServer:
                         server_instance.session_qualities[session_id] = quality
                         if session_id in server_instance.active_streams:
                             server_instance.active_streams[session_id]['quality'] = quality
+                            server_instance.engine.subscribe(session_id, quality)
                         
                         print(f"[*] Quality changed to '{quality}' for session {session_id[:8]}...")
                         print(f"[*] Session quality preferences: {[(sid[:8], qual) for sid, qual in server_instance.session_qualities.items()]}")
@@ -442,13 +439,20 @@ class TrustedScreenShareWebServer:
         
         self.sharing = True
         
-        # Start screen capture thread
-        capture_thread = threading.Thread(target=self.capture_screen_loop, daemon=True)
-        capture_thread.start()
+        # Start the shared capture engine and the MJPEG stream loop
+        self.engine.start()
+        self.broadcaster.start()
         
         # Create threaded HTTP server
+        broadcaster = self.broadcaster
+        
         class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
             daemon_threads = True
+            
+            def shutdown_request(self, request):
+                # /stream and /updates sockets were handed to the broadcaster, which closes them
+                if not broadcaster.owns(request):
+                    super().shutdown_request(request)
         
         # Start HTTP server
         try:
@@ -466,7 +470,11 @@ class TrustedScreenShareWebServer:
     def stop_sharing(self):
         """Stop the screen sharing server"""
         print("\n[*] Stopping server...")
+        was_sharing = self.sharing
         self.sharing = False
+        if was_sharing:
+            self.broadcaster.stop()
+            self.engine.stop()
         self.authorized_sessions.clear()
         self.active_streams.clear()
         self.session_qualities.clear()  # Clear session quality preferences
@@ -0,0 +1,246 @@
+"""
+Binary wire format
+Versioned framing for the desktop (TCP) protocol. Every message is a fixed
+little-endian header followed by a raw payload, so the server hands the
+JPEG bytes it already has to the socket without pickling or copying them,
+the client decodes them straight out of its receive buffer, and both sides
+agree on sizes regardless of platform. Nothing in a message is executed.
+
+Header (28 bytes): magic b'SSWF', version, message type, tier, reserved,
+sequence (uint64), capture timestamp (float64, time.time()), payload length
+(uint32).
+
+Right after APPROVED a client advertises what it supports in a HELLO line
+(codecs, transports, max resolution, viewport, features) and the server
+answers with one SELECTED line holding the common set it picked, before
+any frame. Servers that do not know HELLO ignore it and send legacy
+pickled messages; the client then falls back to separate commands
+(WIRE_COMMAND, MODE:DELTA, CURSOR) and reads the pickles with
+loads_legacy(), which allows nothing but plain data and numpy byte arrays.
+"""
+
+import io
+import json
+import pickle
+import struct
+
+WIRE_MAGIC = b'SSWF'
+WIRE_VERSION = 1
+
+# Control command that switches a connection to this format
+WIRE_COMMAND = f"WIRE:{WIRE_VERSION}"
+
+# Capability handshake lines: client -> server, server -> client
+HELLO_PREFIX = 'HELLO:'
+SELECTED_PREFIX = 'SELECTED:'
+PROTOCOL_VERSION = 1
+
+# What this version can use, most efficient first
+CODECS = ('jpeg',)
+TRANSPORTS = ('wire1', 'pickle')  # wire1 = this module's format version 1
+FEATURES = ('delta', 'cursor')  # Tile deltas, cursor channel
+
+HEADER = struct.Struct('<4sBBBxQdI')  # magic, version, type, tier, sequence, timestamp, payload length
+HEADER_SIZE = HEADER.size
+
+# Message types
+MSG_FRAME = 1      # Payload: JPEG of the whole tier
+MSG_KEYFRAME = 2   # Payload: JPEG of the whole tier (delta mode)
+MSG_TILES = 3      # Payload: TILES_HEADER, copies, then (TILE, JPEG) per tile
+MSG_KEEPALIVE = 4  # No payload
+MSG_CURSOR = 5     # Payload: CURSOR
+
+MESSAGE_TYPES = {
+    'frame': MSG_FRAME,
+    'keyframe': MSG_KEYFRAME,
+    'tiles': MSG_TILES,
+    'keepalive': MSG_KEEPALIVE,
+    'cursor': MSG_CURSOR
+}
+MESSAGE_NAMES = {code: name for name, code in MESSAGE_TYPES.items()}
+
+# Tier byte (NO_TIER when a message belongs to no tier)
+WIRE_TIERS = ('high', 'medium', 'low')
+NO_TIER = 255
+
+TILES_HEADER = struct.Struct('<HHHH')  # canvas width, canvas height, copies, tiles
+COPY = struct.Struct('<6H')  # src_x, src_y, width, height, dst_x, dst_y
+TILE = struct.Struct('<HHI')  # x, y, JPEG length
+CURSOR = struct.Struct('<iiB')  # x, y, visible
+
+# Globals a legacy (pickled) message may reference: numpy byte arrays only
+LEGACY_PICKLE_GLOBALS = {
+    ('numpy', 'ndarray'),
+    ('numpy', 'dtype'),
+    ('numpy.core.multiarray', '_reconstruct'),
+    ('numpy._core.multiarray', '_reconstruct'),
+    ('numpy.core.numeric', '_frombuffer'),
+    ('numpy._core.numeric', '_frombuffer')
+}
+
+
+def tier_code(tier):
+    """Tier name (any case) -> tier byte"""
+    if tier is None:
+        return NO_TIER
+    try:
+        return WIRE_TIERS.index(tier.lower())
+    except ValueError:
+        return NO_TIER
+
+
+def encode_message(message, sequence=0, tier=None, timestamp=0.0):
+    """Buffers making up one message: [header, payload...]
+
+    message is the JPEG of a full frame (bytes or a uint8 array) or a delta
+    mode / cursor dict. JPEG payloads are passed through, not copied, so
+    the list can go straight to sendmsg()/writelines().
+    """
+    if not isinstance(message, dict):
+        kind, payload = MSG_FRAME, [memoryview(message)]
+    else:
+        kind = MESSAGE_TYPES[message['type']]
+        sequence = message.get('sequence', sequence) or 0
+        if kind == MSG_KEYFRAME:
+            payload = [memoryview(message['data'])]
+        elif kind == MSG_TILES:
+            width, height = message['size']
+            copies = message.get('copies', ())
+            parts = [TILES_HEADER.pack(width, height, len(copies), len(message['tiles']))]
+            parts.extend(COPY.pack(*(int(value) for value in rect)) for rect in copies)
+            for x, y, data in message['tiles']:
+                parts.append(TILE.pack(x, y, len(data)))
+                parts.append(data)
+            payload = [b''.join(parts)]  # Small tiles: one buffer beats hundreds of iovecs
+        elif kind == MSG_CURSOR:
+            payload = [CURSOR.pack(message['x'], message['y'], bool(message['visible']))]
+        else:
+            payload = []
+    length = sum(len(part) for part in payload)
+    header = HEADER.pack(WIRE_MAGIC, WIRE_VERSION, kind, tier_code(tier), sequence, timestamp, length)
+    return [header] + payload
+
+
+def is_wire_message(buffer, offset=0):
+    """True if the bytes at offset start a wire format message (else: legacy framing)"""
+    return bytes(buffer[offset:offset + len(WIRE_MAGIC)]) == WIRE_MAGIC
+
+
+def decode_header(buffer, offset=0):
+    """(type, tier, sequence, timestamp, payload length) of the header at offset"""
+    magic, version, kind, tier, sequence, timestamp, length = HEADER.unpack_from(buffer, offset)
+    if magic != WIRE_MAGIC:
+        raise ValueError("Not a wire format message")
+    if version != WIRE_VERSION:
+        raise ValueError(f"Unsupported wire format version {version}")
+    return kind, tier, sequence, timestamp, length
+
+
+def decode_message(kind, tier, sequence, timestamp, payload):
+    """Message dict for a payload (a memoryview; JPEG data stays a view into it)
+
+    Returns None for message types this version does not know.
+    """
+    name = MESSAGE_NAMES.get(kind)
+    if name is None:
+        return None
+    message = {
+        'type': name,
+        'sequence': sequence,
+        'timestamp': timestamp,
+        'tier': WIRE_TIERS[tier] if tier < len(WIRE_TIERS) else None
+    }
+    if kind in (MSG_FRAME, MSG_KEYFRAME):
+        message['data'] = payload
+    elif kind == MSG_TILES:
+        width, height, copy_count, tile_count = TILES_HEADER.unpack_from(payload, 0)
+        offset = TILES_HEADER.size
+        copies = []
+        for _ in range(copy_count):
+            copies.append(COPY.unpack_from(payload, offset))
+            offset += COPY.size
+        tiles = []
+        for _ in range(tile_count):
+            x, y, length = TILE.unpack_from(payload, offset)
+            offset += TILE.size
+            tiles.append((x, y, payload[offset:offset + length]))
+            offset += length
+        message.update(size=(width, height), copies=copies, tiles=tiles)
+    elif kind == MSG_CURSOR:
+        x, y, visible = CURSOR.unpack_from(payload, 0)
+        message.update(x=x, y=y, visible=bool(visible))
+    return message
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """Unpickler for messages from servers without the wire format"""
+
+    def find_class(self, module, name):
+        if (module, name) in LEGACY_PICKLE_GLOBALS:
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from the server")
+
+
+def loads_legacy(data):
+    """Unpickle a legacy message, allowing only data and numpy arrays"""
+    return LegacyUnpickler(io.BytesIO(data)).load()
+
+
+def hello_line(codecs=CODECS, transports=TRANSPORTS, features=FEATURES, max_resolution=None, viewport=None, quality=None):
+    """HELLO line a client sends to advertise its capabilities"""
+    hello = {
+        'protocol': PROTOCOL_VERSION,
+        'codecs': list(codecs),
+        'transports': list(transports),
+        'features': list(features),
+        'max_resolution': list(max_resolution) if max_resolution else None,
+        'viewport': list(viewport) if viewport else None,
+        'quality': quality
+    }
+    return f"{HELLO_PREFIX}{json.dumps(hello)}\n".encode('utf-8')
+
+
+def parse_line(line, prefix):
+    """JSON object of a HELLO / SELECTED line (bytes or str), None if it is not one"""
+    if isinstance(line, (bytes, bytearray)):
+        line = line.decode('utf-8', 'ignore')
+    line = line.strip()
+    if not line.startswith(prefix):
+        return None
+    try:
+        value = json.loads(line[len(prefix):])
+    except ValueError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def offered(hello, key, default):
+    """List a HELLO offers under key (default when missing or malformed)"""
+    value = hello.get(key)
+    return value if isinstance(value, list) and value else default
+
+
+def select_capabilities(hello, codecs=CODECS, transports=TRANSPORTS, features=FEATURES):
+    """Most efficient set both sides support: the first of ours the client also lists
+
+    A malformed HELLO is treated as coming from a protocol 1 peer that only
+    offers what every client understands.
+    """
+    try:
+        protocol = max(1, int(hello.get('protocol') or 1))
+    except (TypeError, ValueError, OverflowError):
+        protocol = 1
+    offered_codecs = offered(hello, 'codecs', ['jpeg'])
+    offered_transports = offered(hello, 'transports', ['pickle'])
+    offered_features = offered(hello, 'features', [])
+    return {
+        'protocol': min(PROTOCOL_VERSION, protocol),
+        'codec': next((codec for codec in codecs if codec in offered_codecs), 'jpeg'),
+        'transport': next((name for name in transports if name in offered_transports), 'pickle'),
+        'features': [feature for feature in features if feature in offered_features]
+    }
+
+
+def selected_line(selection):
+    """SELECTED line a server answers a HELLO with"""
+    return f"{SELECTED_PREFIX}{json.dumps(selection)}\n".encode('utf-8')